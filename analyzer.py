@@ -0,0 +1,79 @@
+"""
+Общий анализ текста для индексации и запросов.
+
+Токен — слово только из русских букв в нижнем регистре, не стоп-слово.
+Слова выделяются одним заранее скомпилированным регулярным выражением
+за один проход по тексту, без nltk word_tokenize и проверок каждого слова:
+кириллическая последовательность не должна примыкать к другим буквам,
+цифрам или дефису, поэтому «научно-технический», «10км» и «i18n»
+отбрасываются целиком, как при разборе через nltk. Лемматизация — через общий для
+процесса кэш лемм (lemma_cache.py).
+
+Использование:
+    from analyzer import iter_tokens, lemmatize
+    counts = Counter(iter_tokens(text))
+"""
+import re
+import threading
+
+from lemma_cache import LemmaCache
+
+WORD_RE = re.compile(r'(?<![\w-])[а-яё]+(?![\w-])')
+
+_stopwords = None
+_lemma_lock = threading.Lock()
+lemma_cache = LemmaCache()
+
+
+def stopword_set():
+    """Русские стоп-слова nltk (загружаются при первом обращении)"""
+    global _stopwords
+    if _stopwords is None:
+        from nltk.corpus import stopwords
+        _stopwords = frozenset(stopwords.words("russian"))
+    return _stopwords
+
+
+def iter_words(text):
+    """Русские слова текста в нижнем регистре, в порядке появления"""
+    for match in WORD_RE.finditer(text.lower()):
+        yield match.group()
+
+
+def iter_tokens(text):
+    """Слова текста без стоп-слов"""
+    stop = stopword_set()
+    for match in WORD_RE.finditer(text.lower()):
+        word = match.group()
+        if word not in stop:
+            yield word
+
+
+def init_lemma_cache(path=None, maxsize=100_000):
+    """
+    Новый кэш лемм процесса (у каждого процесса пула — своё соединение с SQLite).
+    Загруженный pymorphy2.MorphAnalyzer переходит в новый кэш.
+    """
+    global lemma_cache
+    lemma_cache.close()
+    lemma_cache = LemmaCache(maxsize=maxsize, path=path, morph=lemma_cache.morph)
+    return lemma_cache
+
+
+def lemmatize(token):
+    """Нормальная форма через кэш; LRU-кэш общий для потоков, поэтому под блокировкой"""
+    with _lemma_lock:
+        return lemma_cache.normal_form(token)
+
+
+def group_by_lemma(tokens):
+    """{лемма: [формы]} в порядке первого появления лемм"""
+    lemmas = {}
+    for token in tokens:
+        lemmas.setdefault(lemmatize(token), []).append(token)
+    return lemmas
+
+
+def query_tokens(query):
+    """Токены запроса без повторов, в порядке появления"""
+    return list(dict.fromkeys(iter_tokens(query)))
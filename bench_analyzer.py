@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк анализа текста: прежний путь (nltk word_tokenize и три проверки
+каждого слова) против analyzer.iter_tokens, а также лемматизация через
+кэш лемм — с пустым кэшем и с заполненным.
+
+Текст страниц извлекается заранее (BeautifulSoup в замер не входит) из
+--input или генерируется synthetic_corpus.py (--synthetic N). Скорость —
+в МБ текста (UTF-8) в секунду. Заодно выводится, сколько токенов нашёл
+только один из путей.
+
+Использование:
+    python bench_analyzer.py [--input output/] [--synthetic N] [--repeat 3]
+"""
+import argparse
+import os
+import re
+import time
+from collections import Counter
+
+from bs4 import BeautifulSoup
+from nltk.tokenize import word_tokenize
+
+import analyzer
+
+
+def nltk_tokens(text, stop):
+    """Прежний tokenize из tokens_lemmas.py и tf_idf.py"""
+    tokens = []
+    for word in word_tokenize(text.lower()):
+        if (word.isalpha() and
+            word not in stop and
+            not re.search(r'\d', word) and
+            re.fullmatch(r'^[А-Яа-яЁё]+$', word)):
+            tokens.append(word)
+    return tokens
+
+
+def load_texts(folder):
+    texts = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.html'):
+            with open(os.path.join(folder, name), encoding='utf-8') as f:
+                texts.append(BeautifulSoup(f, 'html.parser').get_text())
+    return texts
+
+
+def synthetic_texts(docs, seed):
+    from synthetic_corpus import CorpusGenerator
+    gen = CorpusGenerator(seed=seed)
+    return [BeautifulSoup(gen.html(i), 'html.parser').get_text() for i in range(docs)]
+
+
+def best_of(repeat, fn, texts):
+    """Лучшее время из repeat прогонов и результат последнего"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = [fn(text) for text in texts]
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default='output', help="папка с HTML-страницами")
+    parser.add_argument('--synthetic', type=int, default=0, help="сгенерировать N страниц вместо --input")
+    parser.add_argument('--repeat', type=int, default=3, help="прогонов каждого варианта, берётся лучший")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.synthetic, args.seed) if args.synthetic else load_texts(args.input)
+    mb = sum(len(text.encode('utf-8')) for text in texts) / 2**20
+    print(f"Текст: {len(texts)} страниц, {mb:.1f} МБ")
+    stop = analyzer.stopword_set()
+
+    old_s, old = best_of(args.repeat, lambda text: nltk_tokens(text, stop), texts)
+    new_s, new = best_of(args.repeat, lambda text: list(analyzer.iter_tokens(text)), texts)
+    print(f"{'nltk word_tokenize':>28}: {mb / old_s:7.1f} МБ/с")
+    print(f"{'analyzer.iter_tokens':>28}: {mb / new_s:7.1f} МБ/с  (x{old_s / new_s:.1f})")
+
+    # Лемматизация: первый прогон разбирает формы pymorphy2, следующие берут их из кэша
+    analyzer.lemma_cache.morph  # словари pymorphy2 загружаются вне замера
+    cold_s, _ = best_of(1, lambda text: analyzer.group_by_lemma(analyzer.iter_tokens(text)), texts)
+    warm_s, _ = best_of(args.repeat, lambda text: analyzer.group_by_lemma(analyzer.iter_tokens(text)), texts)
+    print(f"{'+ леммы, пустой кэш':>28}: {mb / cold_s:7.1f} МБ/с")
+    print(f"{'+ леммы, кэш заполнен':>28}: {mb / warm_s:7.1f} МБ/с")
+
+    only_old, only_new = Counter(), Counter()
+    for tokens_old, tokens_new in zip(old, new):
+        a, b = Counter(tokens_old), Counter(tokens_new)
+        only_old.update(a - b)
+        only_new.update(b - a)
+    print(f"Токенов: nltk {sum(map(len, old))}, analyzer {sum(map(len, new))}; "
+          f"только nltk {sum(only_old.values())}, только analyzer {sum(only_new.values())}")
+    for title, diff in (("только nltk", only_old), ("только analyzer", only_new)):
+        if diff:
+            print(f"  {title}: " + ', '.join(f"{word} ({n})" for word, n in diff.most_common(10)))
+
+
+if __name__ == '__main__':
+    main()
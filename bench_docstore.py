@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранилища текстов doc_store.py: загрузка страниц из --input
+(или --synthetic N страниц synthetic_corpus.py) во временное хранилище.
+
+Выводятся:
+- объём на диске: HTML, извлечённый текст и хранилище (блоки zlib + индекс);
+- скорость загрузки (страниц/с и МБ HTML/с);
+- задержка чтения текста по номеру документа: блок не в кэше и в кэше;
+- задержка сниппетов на страницу выдачи из --page документов (p50/p99)
+  в сравнении с разбором их HTML заново, без хранилища.
+Запросы — пары слов случайного документа страницы, так что термины находятся.
+
+Использование:
+    python bench_docstore.py [--input output/] [--synthetic N] [--workers W] [--queries N] [--page K] [--seed S]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import analyzer
+import doc_store
+from bench_search import percentiles
+from snippets import QueryHighlighter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', default=doc_store.INPUT_FOLDER, help="папка с HTML-страницами")
+    parser.add_argument('--synthetic', type=int, default=0, help="сгенерировать N страниц вместо --input")
+    parser.add_argument('--workers', type=int, default=1, help="процессов для разбора HTML при загрузке")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--page', type=int, default=10, help="документов на странице выдачи")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='docstore_') as tmp:
+        input_folder = args.input
+        if args.synthetic:
+            from synthetic_corpus import generate
+            input_folder = os.path.join(tmp, 'output')
+            generate(input_folder, args.synthetic, seed=args.seed)
+        folder = os.path.join(tmp, doc_store.STORE_DIR)
+
+        stats = doc_store.ingest(input_folder, folder, args.workers)
+        store = doc_store.DocStore(folder)
+        text_mb = sum(int(length) for length in store.records['length']) / 2**20
+        store_mb = doc_store.store_mb(folder)
+        print(f"Страниц: {len(store)}; HTML {stats['html_mb']:.1f} МБ, текст {text_mb:.1f} МБ, "
+              f"хранилище {store_mb:.2f} МБ (x{stats['html_mb'] / store_mb:.0f} к HTML, x{text_mb / store_mb:.1f} к тексту)")
+        print(f"Загрузка ({args.workers} проц.): {stats['docs'] / stats['seconds']:.0f} страниц/с, "
+              f"{stats['html_mb'] / stats['seconds']:.1f} МБ HTML/с")
+
+        rng = np.random.default_rng(args.seed)
+        nums = rng.integers(0, len(store.doc_ids), args.queries).tolist()
+        for title, cold in (("блок не в кэше", True), ("блок в кэше", False)):
+            timings = []
+            for num in nums:
+                if cold:
+                    store.clear_cache()
+                else:
+                    store.text(num)
+                start = time.perf_counter()
+                store.text(num)
+                timings.append(time.perf_counter() - start)
+            p50, p99 = percentiles(timings)
+            print(f"{'Чтение текста, ' + title:>32}: p50 {p50:6.3f} мс  p99 {p99:6.3f} мс")
+
+        analyzer.lemma_cache.morph  # словари pymorphy2 загружаются вне замера
+        pages = [rng.integers(0, len(store.doc_ids), args.page).tolist() for _ in range(args.queries)]
+        queries = []
+        for page in pages:
+            words = list(analyzer.iter_tokens(store.text(page[0]))) or ['нет']
+            queries.append(' '.join(rng.choice(words, min(2, len(words)), replace=False)))
+        store.clear_cache()
+        timings = []
+        for query, page in zip(queries, pages):
+            start = time.perf_counter()
+            highlighter = QueryHighlighter(query)
+            for num in page:
+                highlighter.snippet(store.text(num))
+            timings.append(time.perf_counter() - start)
+        p50, p99 = percentiles(timings)
+        print(f"{'Сниппеты, страница из ' + str(args.page):>32}: p50 {p50:6.3f} мс  p99 {p99:6.3f} мс")
+
+        timings = []
+        for page in pages[:max(1, args.queries // 10)]:
+            start = time.perf_counter()
+            for num in page:
+                doc_store.extract_text(os.path.join(input_folder, store.doc_ids[num] + '.html'))
+            timings.append(time.perf_counter() - start)
+        p50, p99 = percentiles(timings)
+        print(f"{'Разбор HTML той же страницы':>32}: p50 {p50:6.3f} мс  p99 {p99:6.3f} мс")
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
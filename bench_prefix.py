@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк раскрытия шаблонов по таблице словаря vocab_table.bin (binary_index.py):
+префиксы и шаблоны с ? берутся из случайных термов словаря. Для каждой длины
+префикса выводятся p50/p99 задержки TermTable.expand, средняя ширина диапазона
+префикса и среднее число термов после отбора по df.
+
+Использование:
+    python bench_prefix.py [--table vocab_table.bin] [--queries N] [--lengths 2 3 4 6] [--limit K] [--seed S]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bench_search import percentiles
+from binary_index import MAX_EXPANSIONS, TermTable, split_pattern
+from vector_search import VOCAB_TABLE_FILE
+
+
+def make_patterns(table, n, length, wildcard, rng):
+    """n шаблонов: первые length символов случайных термов и '*' (или '?' вместо последнего)"""
+    patterns = []
+    for column in rng.integers(0, len(table), n * 4).tolist():
+        term = table[column]
+        if len(term) < length:
+            continue
+        stem = term[:length - 1] + '?' if wildcard else term[:length]
+        patterns.append(stem + '*')
+        if len(patterns) == n:
+            break
+    return patterns
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--table', default=VOCAB_TABLE_FILE)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[2, 3, 4, 6])
+    parser.add_argument('--limit', type=int, default=MAX_EXPANSIONS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    table = TermTable(args.table)
+    rng = np.random.default_rng(args.seed)
+    print(f"Словарь: {len(table)} термов, df {'есть' if table.doc_freqs is not None else 'нет (таблица версии 1)'}")
+    for wildcard in (False, True):
+        for length in args.lengths:
+            patterns = make_patterns(table, args.queries, length, wildcard, rng)
+            if not patterns:
+                continue
+            timings, ranges, sizes = [], [], []
+            for pattern in patterns:
+                start = time.perf_counter()
+                columns = table.expand(pattern, args.limit)
+                timings.append(time.perf_counter() - start)
+                lo, hi = table.prefix_range(split_pattern(pattern)[0])
+                ranges.append(hi - lo)
+                sizes.append(len(columns))
+            p50, p99 = percentiles(timings)
+            print(f"{patterns[0]:>12}: p50 {p50 * 1000:8.1f} мкс  p99 {p99 * 1000:8.1f} мкс  "
+                  f"диапазон {np.mean(ranges):9.0f}  термов {np.mean(sizes):5.1f}")
+
+
+if __name__ == '__main__':
+    main()
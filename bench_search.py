@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк векторного поиска: плотный обход матрицы (cosine_search)
+против обхода инвертированных списков (PostingsIndex).
+
+Запросы из 1..--terms случайных признаков словаря. Для каждого движка
+выводится p50/p99 задержки; заодно проверяется совпадение выдачи.
+
+Использование:
+    python bench_search.py [--mode terms|lemmas] [--queries N] [--terms T] [--top-k K] [--seed S]
+"""
+import argparse
+import time
+import numpy as np
+
+from vector_search import PostingsIndex, cosine_search, load_objects, load_tfidf_matrix
+
+
+def make_queries(n_terms_vocab, n_queries, max_terms, rng):
+    queries = []
+    for _ in range(n_queries):
+        size = rng.integers(1, max_terms + 1)
+        idxs = np.unique(rng.integers(0, n_terms_vocab, size=size))
+        queries.append(idxs)
+    return queries
+
+
+def percentiles(timings):
+    ms = np.array(timings) * 1000
+    return np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['terms','lemmas'], default='terms')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--terms', type=int, default=3)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mat, doc_ids, vocab = load_objects()
+    if mat is None:
+        mat, doc_ids, vocab = load_tfidf_matrix(args.mode)
+
+    start = time.perf_counter()
+    postings = PostingsIndex.from_matrix(mat)
+    print(f"Матрица {mat.shape[0]}×{mat.shape[1]}, nnz={mat.nnz}; "
+          f"списки построены за {time.perf_counter() - start:.3f} с")
+
+    rng = np.random.default_rng(args.seed)
+    queries = make_queries(len(vocab), args.queries, args.terms, rng)
+
+    dense_times, postings_times, mismatches = [], [], 0
+    for idxs in queries:
+        vec = np.zeros(len(vocab), dtype=np.float32)
+        vec[idxs] = 1.0 / np.sqrt(len(idxs))
+
+        start = time.perf_counter()
+        _, dense_idxs = cosine_search(mat, vec.reshape(1, -1), args.top_k)
+        dense_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        _, post_idxs = postings.search({i: vec[i] for i in idxs}, args.top_k)
+        postings_times.append(time.perf_counter() - start)
+
+        if not np.array_equal(dense_idxs, post_idxs):
+            mismatches += 1
+
+    for name, timings in (('dense', dense_times), ('postings', postings_times)):
+        p50, p99 = percentiles(timings)
+        print(f"{name:>9}: p50={p50:.3f} мс  p99={p99:.3f} мс")
+    print(f"Расхождений в выдаче: {mismatches} из {len(queries)}")
+
+
+if __name__ == '__main__':
+    main()
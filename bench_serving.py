@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Масштабирование serve.py по числу воркеров: QPS, задержки и память.
+
+Для каждого N из --workers поднимается serve.py с N процессами, после
+прогрева выполняется --requests запросов к /api/search из --concurrency
+клиентских потоков. Память воркеров берётся из /proc (только Linux):
+RSS, его анонимная часть (собственная память процесса) и PSS, в котором
+общие страницы mmap поделены между процессами поровну — сразу после
+старта (стоимость самого индекса) и после нагрузки (плюс рабочие буферы
+поиска, которые аллокатор оставляет процессу).
+
+Использование:
+    python bench_serving.py [--workers 1 2 4] [--requests N] [--concurrency C]
+"""
+import argparse
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import numpy as np
+import requests
+
+from vector_search import load_objects
+
+WARMUP = 200  # запросов до замера, по отдельному набору
+
+
+def memory_mb(pid):
+    """RSS, RssAnon и PSS процесса, МБ"""
+    fields = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('VmRSS', 'RssAnon'):
+                fields[name] = int(value.split()[0]) / 1024
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Pss:'):
+                fields['Pss'] = int(line.split()[1]) / 1024
+    return fields
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, 'serve.py', '--workers', str(workers), '--port', str(port)],
+                            stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    # Ждём, пока главный процесс откроет сокет; дальше соединения ждут
+    # в его очереди, пока воркер не загрузит индекс
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            requests.get(f'{url}/api/cache/stats', timeout=120).raise_for_status()
+            return proc, url
+        except requests.ConnectionError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.terminate()
+                raise
+            time.sleep(0.1)
+
+
+def load(url, payloads, concurrency):
+    local = threading.local()
+
+    def call(payload):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        local.session.post(f'{url}/api/search', json=payload, timeout=60).raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(call, payloads))
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    return len(payloads) / elapsed, np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    _, _, vocab = load_objects(mmap=True)
+    rng = np.random.default_rng(args.seed)
+    # Уникальные запросы, чтобы кэш результатов не подменял поиск
+    payloads = [{'queries': [' '.join(vocab[int(i)] for i in rng.integers(0, len(vocab), size=3))
+                             + f' #{n}'],
+                 'top_k': args.top_k} for n in range(args.requests + WARMUP)]
+
+    print(f"{args.requests} запросов, {args.concurrency} клиентов")
+    print(f"{'воркеры':>8} {'req/s':>9} {'p50, мс':>8} {'p99, мс':>8} "
+          f"{'RSS/воркер':>11} {'анонимн.':>9} {'PSS/воркер':>11}")
+    for n in args.workers:
+        proc, url = start_server(n)
+        try:
+            idle = [memory_mb(pid) for pid in children(proc.pid)]
+            load(url, payloads[args.requests:], args.concurrency)  # прогрев
+            qps, p50, p99 = load(url, payloads[:args.requests], args.concurrency)
+            busy = [memory_mb(pid) for pid in children(proc.pid)]
+        finally:
+            proc.terminate()
+            proc.wait()
+        row = f"{n:>8} {qps:>9.1f} {p50:>8.2f} {p99:>8.2f}"
+        for label, mem in (('после старта', idle), ('под нагрузкой', busy)):
+            avg = {key: np.mean([m[key] for m in mem]) for key in ('VmRSS', 'RssAnon', 'Pss')}
+            print(f"{row} {avg['VmRSS']:>9.0f}МБ {avg['RssAnon']:>7.0f}МБ {avg['Pss']:>9.0f}МБ  {label}")
+            row = ' ' * len(row)
+
+
+if __name__ == '__main__':
+    main()
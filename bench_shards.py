@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк шардированного поиска: индекс vector_search.py делится на N шардов
+(во временную папку), шарды запускаются локальными процессами, запросы идут
+через координатор ShardedSearch. Для каждого N выводятся p50/p99 задержки
+и число запросов, где выдача разошлась с PostingsIndex по целому индексу
+(совпасть должны документы и, до округления float32, оценки).
+
+Использование:
+    python bench_shards.py [--shards 1 2 4] [--queries N] [--terms T] [--top-k K] [--timeout S] [--seed S]
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from bench_search import make_queries, percentiles
+from shards import SHARD_TIMEOUT, ShardedSearch, build_shards
+from vector_search import PostingsIndex, load_objects
+
+
+def same_hits(expected, hits):
+    """Совпадение выдачи: документы с ненулевой оценкой и оценки с точностью float32"""
+    if len(expected) != len(hits):
+        return False
+    for (doc_a, score_a), (doc_b, score_b) in zip(expected, hits):
+        if abs(score_a - score_b) > 1e-6 or (score_a > 0 and doc_a != doc_b):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--terms', type=int, default=3)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=SHARD_TIMEOUT)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    mat, doc_ids, vocab = load_objects()
+    if mat is None:
+        parser.error("индекс не найден: сначала запустите vector_search.py")
+    rng = np.random.default_rng(args.seed)
+    queries = [{int(i): 1.0 / np.sqrt(len(q)) for i in q} for q in make_queries(mat.shape[1], args.queries, args.terms, rng)]
+    print(f"Индекс: {mat.shape[0]} документов, {mat.shape[1]} признаков, {mat.nnz} ненулевых; запросов {len(queries)}")
+
+    postings = PostingsIndex.from_matrix(mat)
+    expected, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        scores, idxs = postings.search(query, args.top_k)
+        timings.append(time.perf_counter() - start)
+        expected.append([(doc_ids[i], float(s)) for s, i in zip(scores, idxs)])
+    p50, p99 = percentiles(timings)
+    print(f"{'целый индекс':>14}: p50 {p50:7.3f} мс  p99 {p99:7.3f} мс")
+
+    for n in args.shards:
+        with tempfile.TemporaryDirectory(prefix='shards_') as folder:
+            build_shards(mat, doc_ids, vocab, n, folder)
+            with ShardedSearch(folder, timeout=args.timeout) as search:
+                search.search_weights(queries[0], args.top_k)  # прогрев соединений
+                timings, mismatches, partial = [], 0, 0
+                for query, exp in zip(queries, expected):
+                    start = time.perf_counter()
+                    hits, missing = search.search_weights(query, args.top_k)
+                    timings.append(time.perf_counter() - start)
+                    partial += bool(missing)
+                    mismatches += not missing and not same_hits(exp, hits)
+        p50, p99 = percentiles(timings)
+        print(f"{f'{n} шардов':>14}: p50 {p50:7.3f} мс  p99 {p99:7.3f} мс  "
+              f"расхождений {mismatches}, неполных {partial}")
+
+
+if __name__ == '__main__':
+    main()
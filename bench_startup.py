@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта: время от импорта до ответа на первый запрос
+и пиковый RSS процесса. Каждый замер — в отдельном процессе.
+
+Режимы:
+    eager — матрица и vocab.npy читаются в память, строится dict терм -> столбец
+    mmap  — матрица через mmap, словарь — таблица vocab_table.bin с бинарным поиском
+    flask — импорт flask_app и первый запрос к /api/search
+
+Использование:
+    python bench_startup.py [--modes eager mmap flask] [--runs N] [--query "термы"]
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def child(mode, query):
+    start = time.perf_counter()
+    if mode == 'flask':
+        import flask_app
+        client = flask_app.app.test_client()
+        response = client.post('/api/search', json={'queries': [query], 'top_k': 10})
+        hits = len(response.get_json()['results'][0]['hits'])
+    else:
+        from vector_search import cosine_search, load_objects, term_index
+        mat, doc_ids, vocab = load_objects(mmap=(mode == 'mmap'))
+        term_to_idx = term_index(vocab)
+        vec = np.zeros(len(vocab), dtype=np.float32)
+        found = [i for i in (term_to_idx.get(t) for t in query.split()) if i is not None]
+        vec[found] = 1.0 / np.sqrt(max(len(found), 1))
+        hits = len(cosine_search(mat, vec, 10)[1]) if found else 0
+    elapsed = time.perf_counter() - start
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({'seconds': elapsed, 'rss_mb': rss_mb, 'hits': hits}))
+
+
+def run(mode, query):
+    out = subprocess.run([sys.executable, __file__, '--child', mode, '--query', query],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs='+', choices=['eager', 'mmap', 'flask'], default=['eager', 'mmap', 'flask'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--query', default='история россии')
+    parser.add_argument('--child', choices=['eager', 'mmap', 'flask'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.query)
+        return
+
+    for mode in args.modes:
+        results = [run(mode, args.query) for _ in range(args.runs)]
+        ms = np.array([r['seconds'] for r in results]) * 1000
+        rss = max(r['rss_mb'] for r in results)
+        print(f"{mode:>6}: до первого ответа p50={np.percentile(ms, 50):.1f} мс  "
+              f"max={ms.max():.1f} мс; пик RSS {rss:.0f} МБ; найдено {results[0]['hits']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Сквозной бенчмарк конвейера на синтетическом корпусе (synthetic_corpus.py).
+
+В рабочей папке генерируется output/ из --docs страниц, затем по очереди
+выполняются этапы и поисковые движки, каждый в отдельном процессе (так
+пиковый RSS относится только к нему, вместе с его пулом процессов):
+
+    download       — downloader.crawl с локального http.server в download/
+    doc_store      — doc_store.py ingest --rebuild: тексты страниц в хранилище
+    tokens_lemmas  — tokens_lemmas.py --workers N
+    tf_idf         — tf_idf.py --workers N
+    vector_search  — матрица TF-IDF по термам и save_objects
+    search_engine  — build_document_index и inverted_index.bin
+    vector_dense, vector_postings — cosine_search и PostingsIndex.search
+    boolean        — булевы запросы к inverted_index.bin через mmap
+    flask          — POST /api/search через test_client flask_app
+
+Для этапов пишется время, документы/с, МБ/с входного HTML и пиковый RSS,
+для движков — QPS и p50/p95/p99 задержки. Отчёт сохраняется в JSON.
+С --baseline отчёт сравнивается с сохранённым: падение пропускной
+способности или рост задержки и памяти больше --tolerance
+считается регрессией, и скрипт завершается с кодом 1. Шум замеров
+заметный, поэтому для сравнения стоит брать --repeat 3 (медиана).
+
+Всё работает без сети. Пример:
+    python bench_suite.py --docs 10000 --report bench_report.json
+    python bench_suite.py --docs 10000 --baseline bench_report.json
+    python bench_suite.py --compare new.json --baseline old.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import runpy
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+import numpy as np
+
+from synthetic_corpus import generate
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ['download', 'doc_store', 'tokens_lemmas', 'tf_idf', 'vector_search', 'search_engine']
+ENGINES = ['vector_dense', 'vector_postings', 'boolean', 'flask']
+# Метрики, которые сравниваются с базовым отчётом (время и МБ/с этапа дублируют док/с)
+COMPARED = {'stages': ('docs_per_s', 'peak_rss_mb'), 'engines': ('qps', 'p50_ms', 'p99_ms', 'peak_rss_mb')}
+# Для них больше — лучше; для остальных (задержки, память) — меньше лучше
+HIGHER_IS_BETTER = ('docs_per_s', 'qps')
+
+
+def folder_mb(folder, suffix='.html'):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.name.endswith(suffix)) / 2**20
+
+
+def peak_rss_mb():
+    """
+    Пиковый RSS процесса или самого большого из его дочерних процессов, МБ.
+    ru_maxrss процесса переживает execve и достался бы от родителя, поэтому
+    собственный пик берётся из VmHWM (на Linux), который при exec обнуляется.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open('/proc/self/status') as f:
+            own = next(int(line.split()[1]) for line in f if line.startswith('VmHWM:'))
+    except OSError:
+        pass
+    return max(own, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def run_script(name, *argv):
+    """Запуск скрипта репозитория как __main__ в текущем процессе"""
+    sys.argv = [name, *map(str, argv)]
+    runpy.run_path(os.path.join(REPO_DIR, name), run_name='__main__')
+
+
+def latency_stats(timings, elapsed):
+    ms = np.array(timings) * 1000
+    return {'queries': len(timings), 'qps': len(timings) / elapsed,
+            'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+            'p99_ms': float(np.percentile(ms, 99))}
+
+
+def timed_queries(fn, queries):
+    timings = []
+    start = time.perf_counter()
+    for query in queries:
+        t = time.perf_counter()
+        fn(query)
+        timings.append(time.perf_counter() - t)
+    return latency_stats(timings, time.perf_counter() - start)
+
+
+def stage_download(args):
+    """Раздаёт output/ через http.server в отдельном процессе и скачивает downloader.crawl"""
+    import downloader
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = subprocess.Popen([sys.executable, '-m', 'http.server', str(port), '--bind', '127.0.0.1',
+                               '--directory', 'output'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        names = sorted(f for f in os.listdir('output') if f.endswith('.html'))
+        urls = [f'http://127.0.0.1:{port}/{quote(name)}' for name in names]
+        shutil.rmtree('download', ignore_errors=True)
+        start = time.perf_counter()
+        summary = downloader.crawl(urls, output_dir='download', workers=args.workers * 8, per_host_interval=0)
+        seconds = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    if summary['failed']:
+        raise RuntimeError(f"Не скачано страниц: {summary['failed']}")
+    return {'seconds': seconds, 'docs': len(urls), 'mb': folder_mb('download')}
+
+
+def stage_doc_store(args):
+    import doc_store
+
+    start = time.perf_counter()
+    run_script('doc_store.py', 'ingest', '--workers', args.workers, '--rebuild')
+    return {'seconds': time.perf_counter() - start, 'store_mb': doc_store.store_mb()}
+
+
+def stage_tokens_lemmas(args):
+    start = time.perf_counter()
+    run_script('tokens_lemmas.py', '--workers', args.workers)
+    return {'seconds': time.perf_counter() - start}
+
+
+def stage_tf_idf(args):
+    start = time.perf_counter()
+    run_script('tf_idf.py', '--workers', args.workers)
+    return {'seconds': time.perf_counter() - start}
+
+
+def stage_vector_search(args):
+    from vector_search import load_tfidf_matrix, save_objects
+
+    start = time.perf_counter()
+    mat, doc_ids, vocab = load_tfidf_matrix('terms')
+    save_objects(mat, doc_ids, vocab)
+    return {'seconds': time.perf_counter() - start, 'nnz': int(mat.nnz), 'vocab': len(vocab)}
+
+
+def stage_search_engine(args):
+    from search_engine import build_document_index
+
+    start = time.perf_counter()
+    engine = build_document_index()
+    engine.save_index_binary('inverted_index.bin')
+    return {'seconds': time.perf_counter() - start}
+
+
+def vector_queries(args):
+    from bench_search import make_queries
+    from vector_search import load_objects
+
+    mat, _, vocab = load_objects(mmap=True)
+    rng = np.random.default_rng(args.seed)
+    return mat, vocab, make_queries(len(vocab), args.queries, 3, rng)
+
+
+def engine_vector_dense(args):
+    from vector_search import cosine_search
+
+    mat, vocab, queries = vector_queries(args)
+
+    def run(idxs):
+        vec = np.zeros(len(vocab), dtype=np.float32)
+        vec[idxs] = 1.0 / np.sqrt(len(idxs))
+        cosine_search(mat, vec, args.top_k)
+
+    return timed_queries(run, queries)
+
+
+def engine_vector_postings(args):
+    from vector_search import PostingsIndex
+
+    mat, _, queries = vector_queries(args)
+    postings = PostingsIndex.load(mat)
+    return timed_queries(lambda idxs: postings.search({int(i): 1.0 / np.sqrt(len(idxs)) for i in idxs},
+                                                      args.top_k), queries)
+
+
+def engine_boolean(args):
+    from search_engine import load_index
+
+    engine = load_index('inverted_index.bin')
+    index = engine.binary
+    # Термы с вероятностью, пропорциональной df: запросы похожи на реальные
+    df = np.asarray(index.doc_freqs, dtype=np.float64)
+    rng = np.random.default_rng(args.seed)
+    picks = rng.choice(len(df), size=(args.queries, 3), p=df / df.sum())
+    templates = ['{} AND {}', '{} OR {}', '{} NOT {}', '({} OR {}) AND {}']
+    queries = [templates[i % len(templates)].format(*(index.term(int(t)) for t in row))
+               for i, row in enumerate(picks)]
+    return timed_queries(engine.search, queries)
+
+
+def engine_flask(args):
+    import flask_app
+    from vector_search import load_objects
+
+    _, _, vocab = load_objects(mmap=True)
+    rng = np.random.default_rng(args.seed)
+    # Разные запросы, чтобы кэш результатов не подменял поиск
+    queries = [' '.join(vocab[int(i)] for i in rng.integers(0, len(vocab), size=3))
+               for _ in range(args.queries)]
+    client = flask_app.app.test_client()
+
+    def run(query):
+        response = client.post('/api/search', json={'queries': [query], 'top_k': args.top_k})
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/search вернул {response.status_code}")
+
+    return timed_queries(run, queries)
+
+
+def child(name, args):
+    """Выполняет этап или движок в рабочей папке и печатает метрики в JSON"""
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_DIR)
+    result = globals()[('stage_' if name in STAGES else 'engine_') + name](args)
+    result['peak_rss_mb'] = peak_rss_mb()
+    # Скрипты конвейера печатают в stdout, поэтому метрики — отдельной последней строкой
+    print('\n' + json.dumps(result), flush=True)
+
+
+def run_child(name, args):
+    """Медиана каждой метрики по --repeat запускам этапа или движка"""
+    runs = [run_child_once(name, args) for _ in range(args.repeat)]
+    return {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+
+
+def run_child_once(name, args):
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', name, '--workdir', args.workdir,
+           '--workers', str(args.workers), '--queries', str(args.queries), '--top-k', str(args.top_k),
+           '--seed', str(args.seed)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise RuntimeError(f"Этап {name} завершился с кодом {proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def flatten(report):
+    """{'stages.tf_idf.docs_per_s': значение, ...} по сравниваемым метрикам отчёта"""
+    return {f'{section}.{name}.{key}': metrics[key]
+            for section, keys in COMPARED.items()
+            for name, metrics in report.get(section, {}).items()
+            for key in keys if key in metrics}
+
+
+def compare(report, baseline, tolerance):
+    """
+    Печатает сравнение метрик с базовым отчётом.
+    :return: список регрессировавших метрик
+    """
+    keys = ('docs', 'vocab', 'words', 'zipf', 'seed', 'workers', 'queries', 'top_k')
+    current_cfg = {k: report['config'].get(k) for k in keys}
+    baseline_cfg = {k: baseline['config'].get(k) for k in keys}
+    if current_cfg != baseline_cfg:
+        print(f"Внимание: параметры прогонов различаются: {baseline_cfg} -> {current_cfg}")
+
+    old, new = flatten(baseline), flatten(report)
+    regressions = []
+    print(f"{'метрика':<40} {'было':>10} {'стало':>10} {'изм.':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        mark = ''
+        if worse > tolerance:
+            mark = '  РЕГРЕССИЯ'
+            regressions.append(key)
+        elif worse < -tolerance:
+            mark = '  улучшение'
+        print(f"{key:<40} {before:>10.2f} {after:>10.2f} {change:>+7.1%}{mark}")
+    return regressions
+
+
+def run_suite(args):
+    report = {
+        'config': {'docs': args.docs, 'vocab': args.vocab, 'words': args.words, 'zipf': args.zipf,
+                   'seed': args.seed, 'workers': args.workers, 'queries': args.queries, 'top_k': args.top_k,
+                   'repeat': args.repeat},
+        'env': {'python': platform.python_version(), 'platform': platform.platform(),
+                'cpus': os.cpu_count(), 'created': datetime.now(timezone.utc).isoformat(timespec='seconds')},
+        'stages': {}, 'engines': {},
+    }
+    start = time.perf_counter()
+    generate(os.path.join(args.workdir, 'output'), args.docs, args.vocab, args.words, args.zipf, args.seed)
+    html_mb = folder_mb(os.path.join(args.workdir, 'output'))
+    report['corpus'] = {'mb': html_mb, 'generate_s': time.perf_counter() - start}
+    print(f"Корпус: {args.docs} страниц, {html_mb:.1f} МБ ({report['corpus']['generate_s']:.1f} с), "
+          f"папка {args.workdir}")
+
+    for name in args.stages:
+        metrics = run_child(name, args)
+        docs = metrics.setdefault('docs', args.docs)
+        metrics['docs'] = docs = int(docs)
+        metrics['docs_per_s'] = docs / metrics['seconds']
+        metrics['mb_per_s'] = metrics.pop('mb', html_mb) / metrics['seconds']
+        report['stages'][name] = metrics
+        print(f"{name:>16}: {metrics['seconds']:8.2f} с  {metrics['docs_per_s']:9.1f} док/с  "
+              f"{metrics['mb_per_s']:7.2f} МБ/с  пик RSS {metrics['peak_rss_mb']:.0f} МБ")
+    for name in args.engines:
+        metrics = run_child(name, args)
+        report['engines'][name] = metrics
+        print(f"{name:>16}: {metrics['qps']:8.1f} запр/с  p50={metrics['p50_ms']:.2f} мс  "
+              f"p95={metrics['p95_ms']:.2f} мс  p99={metrics['p99_ms']:.2f} мс  "
+              f"пик RSS {metrics['peak_rss_mb']:.0f} МБ")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=1000, help="число страниц корпуса (10^3–10^6)")
+    parser.add_argument('--vocab', type=int, default=50_000, help="число лемм в словаре корпуса")
+    parser.add_argument('--words', type=int, default=300, help="средняя длина страницы в словах")
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help="число процессов этапов конвейера")
+    parser.add_argument('--queries', type=int, default=500, help="запросов на каждый движок")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1, help="запусков каждого этапа, в отчёт идёт медиана")
+    parser.add_argument('--stages', nargs='*', choices=STAGES, default=STAGES)
+    parser.add_argument('--engines', nargs='*', choices=ENGINES, default=ENGINES)
+    parser.add_argument('--workdir', default=None, help="рабочая папка (по умолчанию временная, удаляется)")
+    parser.add_argument('--report', default='bench_report.json', help="куда сохранить отчёт")
+    parser.add_argument('--baseline', default=None, help="отчёт, с которым сравнить результаты")
+    parser.add_argument('--compare', default=None, help="не запускать, а сравнить этот отчёт с --baseline")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="допустимое ухудшение метрики, доля")
+    parser.add_argument('--child', choices=STAGES + ENGINES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args)
+        return
+
+    if args.compare:
+        if not args.baseline:
+            parser.error("--compare требует --baseline")
+        with open(args.compare, encoding='utf-8') as f:
+            report = json.load(f)
+    else:
+        scratch = args.workdir is None
+        args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='bench_suite_'))
+        try:
+            report = run_suite(args)
+        finally:
+            if scratch:
+                shutil.rmtree(args.workdir, ignore_errors=True)
+        # Базовый отчёт не перезаписывается результатом сравнения
+        if args.report and os.path.abspath(args.report) != os.path.abspath(args.baseline or ''):
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"Отчёт сохранён в {args.report}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"Регрессий: {len(regressions)} (допуск {args.tolerance:.0%})")
+            sys.exit(1)
+        print("Регрессий нет")
+
+
+if __name__ == '__main__':
+    main()
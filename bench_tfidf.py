@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк расчёта TF-IDF: построчный (terms_tfidf, lemmas_tfidf по
+каждому документу) против векторного VectorizedTfidf.
+
+Счётчики токенов и словари лемм документов берутся из генератора
+synthetic_corpus.py прямо в памяти, без HTML и записи файлов: замеряется
+только арифметика — df, idf, tf и tf-idf термов и лемм, включая сборку
+строк [(терм, idf, tf-idf)] для записи. Заодно проверяется, что
+результаты совпадают.
+
+Использование:
+    python bench_tfidf.py [--docs 100000] [--vocab 50000] [--words 300] [--seed 0]
+"""
+import argparse
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from synthetic_corpus import ENDINGS, CorpusGenerator
+from tf_idf import VectorizedTfidf, lemmas_tfidf, terms_tfidf
+
+
+def make_corpus(docs, vocab_size, words, seed):
+    """Счётчики токенов и словари {лемма: формы} документов"""
+    gen = CorpusGenerator(vocab_size, words, seed=seed)
+    # Лемма словоформы — основа (форма с пустым окончанием)
+    stems = gen.forms[::len(ENDINGS)]
+    form_lemma = {form: stems[i // len(ENDINGS)] for i, form in enumerate(gen.forms)}
+    doc_counts, lemma_maps = [], []
+    for _ in range(docs):
+        counts = Counter(word for word in gen.document_words() if word in form_lemma)
+        lemma_map = defaultdict(list)
+        for form in sorted(counts):
+            lemma_map[form_lemma[form]].append(form)
+        doc_counts.append(counts)
+        lemma_maps.append(dict(lemma_map))
+    return doc_counts, lemma_maps
+
+
+def reference(doc_counts, lemma_maps):
+    """Построчный расчёт, как compute_tf_idf"""
+    token_df = defaultdict(int)
+    for counts in doc_counts:
+        for token in counts:
+            token_df[token] += 1
+    lemma_df = defaultdict(int)
+    for lemma_map in lemma_maps:
+        for lemma in lemma_map:
+            lemma_df[lemma] += 1
+    N = len(doc_counts)
+    terms = [terms_tfidf(counts, N, token_df) for counts in doc_counts]
+    lemmas = [lemmas_tfidf(counts, lemma_map, N, lemma_df) for counts, lemma_map in zip(doc_counts, lemma_maps)]
+    return terms, lemmas
+
+
+def vectorized(doc_counts, lemma_maps, rows=True):
+    tfidf = VectorizedTfidf(doc_counts)
+    tfidf.add_lemmas(lemma_maps)
+    if not rows:
+        return tfidf
+    N = len(doc_counts)
+    return [tfidf.term_rows(d) for d in range(N)], [tfidf.lemma_rows(d) for d in range(N)]
+
+
+def max_difference(rows_a, rows_b):
+    """Наибольшее расхождение idf и tf-idf; строки документов должны совпасть по термам и порядку"""
+    worst = 0.0
+    for doc_a, doc_b in zip(rows_a, rows_b):
+        if [r[0] for r in doc_a] != [r[0] for r in doc_b]:
+            raise AssertionError("Термы документа или их порядок различаются")
+        if doc_a:
+            a, b = np.array([r[1:] for r in doc_a]), np.array([r[1:] for r in doc_b])
+            worst = max(worst, float(np.abs(a - b).max()))
+    return worst
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=100_000)
+    parser.add_argument('--vocab', type=int, default=50_000)
+    parser.add_argument('--words', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    (doc_counts, lemma_maps), seconds = timed(make_corpus, args.docs, args.vocab, args.words, args.seed)
+    pairs = sum(len(counts) for counts in doc_counts)
+    print(f"Корпус: {args.docs} документов, {pairs} пар (документ, терм), сгенерирован за {seconds:.1f} с")
+
+    (ref_terms, ref_lemmas), ref_s = timed(reference, doc_counts, lemma_maps)
+    _, math_s = timed(vectorized, doc_counts, lemma_maps, rows=False)
+    (vec_terms, vec_lemmas), vec_s = timed(vectorized, doc_counts, lemma_maps)
+
+    print(f"{'построчно':>24}: {ref_s:7.2f} с")
+    print(f"{'векторно, массивы':>24}: {math_s:7.2f} с  (x{ref_s / math_s:.1f})")
+    print(f"{'векторно, со строками':>24}: {vec_s:7.2f} с  (x{ref_s / vec_s:.1f})")
+    print(f"Наибольшее расхождение: термы {max_difference(ref_terms, vec_terms):.2e}, "
+          f"леммы {max_difference(ref_lemmas, vec_lemmas):.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""
+Компактный бинарный формат инвертированного индекса.
+
+Документам присваиваются плотные номера 0..N-1 (в порядке сортировки doc_id),
+списки документов хранятся как разности соседних номеров в кодировке varint.
+Файл открывается через mmap: при загрузке читается только заголовок,
+словарь термов просматривается бинарным поиском, а список документов
+декодируется лишь для тех термов, что встретились в запросе.
+
+Структура файла (little-endian, секции выровнены по 8 байт):
+    заголовок    magic, версия, число термов и документов, смещения секций
+    doc_offsets  uint64[N + 1]  границы doc_id в doc_bytes
+    doc_bytes    doc_id в UTF-8
+    term_offsets uint64[T + 1]  границы термов в term_bytes
+    term_bytes   термы в UTF-8, отсортированы побайтно
+    post_offsets uint64[T + 1]  границы списков в post_bytes
+    doc_freqs    uint32[T]      длины списков
+    post_bytes   varint-разности номеров документов
+
+Таблица словаря векторного поиска (vocab_table.bin) устроена так же:
+термы отсортированы побайтно и ищутся бинарным поиском прямо в mmap,
+поэтому при запуске не нужно строить dict терм -> столбец.
+    заголовок    magic, версия, число термов, смещения секций
+    term_offsets uint64[T + 1]  границы термов в term_bytes
+    term_bytes   термы в UTF-8, отсортированы побайтно
+    columns      uint32[T]      номер столбца матрицы для i-го терма по порядку
+    positions    uint32[T]      обратная перестановка: столбец -> номер в порядке
+    doc_freqs    uint32[T]      число документов i-го терма (с версии 2)
+    by_df        uint32[T]      номера термов по убыванию df (с версии 2)
+
+Раз термы отсортированы, все термы с общим префиксом занимают непрерывный
+диапазон таблицы: его границы — два бинарных поиска. На этом построено
+раскрытие шаблонов запроса: «технолог*» и «ко?ка» (expand).
+"""
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+MAGIC = b'BIX1'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQ7Q')
+TABLE_MAGIC = b'VTB1'
+TABLE_VERSION = 2
+TABLE_HEADERS = {1: struct.Struct('<4sIQ4Q'), 2: struct.Struct('<4sIQ6Q')}
+
+WILDCARDS = '*?'
+MIN_PREFIX = 2         # символов до первого * или ?, иначе шаблон не раскрывается
+MAX_EXPANSIONS = 64    # термов на шаблон, остаются самые частые
+MAX_SCAN = 10_000      # термов диапазона, проверяемых шаблоном с * или ? в середине
+
+
+def is_pattern(word):
+    return any(c in word for c in WILDCARDS)
+
+
+def split_pattern(pattern):
+    """
+    Литеральный префикс шаблона и регулярное выражение для остатка.
+    'технолог*' -> ('технолог', None): хватает диапазона префикса;
+    'ко?ка' -> ('ко', re.compile('ко.ка')).
+    """
+    cut = min((pattern.find(c) for c in WILDCARDS if c in pattern), default=len(pattern))
+    prefix = pattern[:cut]
+    if pattern == prefix + '*':
+        return prefix, None
+    regex = ''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in pattern)
+    return prefix, re.compile(regex)
+
+
+def encode_varints(values):
+    """Закодировать неотрицательные целые в varint (7 бит на байт)"""
+    out = bytearray()
+    for v in values:
+        v = int(v)
+        while v >= 0x80:
+            out.append((v & 0x7F) | 0x80)
+            v >>= 7
+        out.append(v)
+    return bytes(out)
+
+
+def decode_varints(buf):
+    """Векторное декодирование varint из массива uint8"""
+    if len(buf) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shift = (np.arange(len(buf)) - starts[group]) * 7
+    parts = (buf & 0x7F).astype(np.int64) << shift
+    return np.bincount(group, weights=parts, minlength=len(ends)).astype(np.int64)
+
+
+def _pad(out):
+    out.extend(b'\0' * (-len(out) % 8))
+
+
+def _layout(header_size, sections):
+    """Разместить секции после места под заголовок: (буфер, смещения секций)"""
+    out = bytearray(header_size)
+    _pad(out)
+    offsets = []
+    for section in sections:
+        offsets.append(len(out))
+        out += section
+        _pad(out)
+    return out, offsets
+
+
+def _write_atomic(path, data):
+    """Запись через временный файл: читатели через mmap не увидят полузаписанный файл"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _strings_section(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets.tobytes(), b''.join(encoded)
+
+
+def write_binary_index(path, postings, doc_ids):
+    """
+    Записать индекс в бинарный файл.
+    :param postings: {терм: итерируемое doc_id}
+    :param doc_ids: все doc_id коллекции
+    """
+    doc_ids = sorted(doc_ids)
+    doc_num = {doc: i for i, doc in enumerate(doc_ids)}
+    terms = sorted(postings, key=lambda t: t.encode('utf-8'))
+
+    post_bytes = bytearray()
+    post_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+    doc_freqs = np.zeros(len(terms), dtype=np.uint32)
+    for i, term in enumerate(terms):
+        nums = np.array(sorted(doc_num[doc] for doc in postings[term]), dtype=np.int64)
+        post_bytes += encode_varints(np.diff(nums, prepend=0))
+        post_offsets[i + 1] = len(post_bytes)
+        doc_freqs[i] = len(nums)
+
+    sections = [
+        *_strings_section(doc_ids),
+        *_strings_section(terms),
+        post_offsets.tobytes(),
+        doc_freqs.tobytes(),
+        bytes(post_bytes),
+    ]
+    out, offsets = _layout(HEADER.size, sections)
+    HEADER.pack_into(out, 0, MAGIC, VERSION, len(terms), len(doc_ids), *offsets)
+    _write_atomic(path, out)
+
+
+class _SortedTerms:
+    """
+    Общее у BinaryIndex и TermTable: термы в mmap, отсортированные побайтно.
+    Наследник задаёт n_terms, _term_offsets, _term_base, _mm, doc_freqs
+    и by_df (позиции по убыванию df или None).
+    """
+    def _term_bytes(self, i):
+        start, end = int(self._term_offsets[i]), int(self._term_offsets[i + 1])
+        return self._mm[self._term_base + start:self._term_base + end]
+
+    def _lower_bound(self, key, lo=0):
+        """Первая позиция не раньше lo, терм на которой не меньше key (bytes)"""
+        hi = self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, term):
+        """Позиция терма в словаре (бинарный поиск) или -1"""
+        key = term.encode('utf-8')
+        i = self._lower_bound(key)
+        return i if i < self.n_terms and self._term_bytes(i) == key else -1
+
+    def prefix_range(self, prefix):
+        """Диапазон позиций [lo, hi) термов, начинающихся с prefix"""
+        key = prefix.encode('utf-8')
+        # Байт 0xFF не встречается в UTF-8: key + 0xFF больше любого терма с префиксом key
+        lo = self._lower_bound(key)
+        return lo, self._lower_bound(key + b'\xff', lo)
+
+    def expand_positions(self, pattern, limit=MAX_EXPANSIONS):
+        """
+        Позиции термов, подходящих под шаблон (* — любая строка, ? — один символ).
+        Просматривается только диапазон литерального префикса; из подходящих
+        остаются limit самых частых. Для длинного диапазона шаблон с * или ?
+        в середине проверяется лишь на MAX_SCAN самых частых термах.
+        """
+        prefix, regex = split_pattern(pattern)
+        if len(prefix) < MIN_PREFIX:
+            return np.empty(0, dtype=np.int64)
+        lo, hi = self.prefix_range(prefix)
+        found, scanned = [], 0
+        for chunk in self._by_df(lo, hi, limit):
+            if regex is None:
+                found.extend(chunk[:limit - len(found)].tolist())
+            else:
+                for i in chunk[:MAX_SCAN - scanned].tolist():
+                    scanned += 1
+                    if regex.fullmatch(self._term_bytes(i).decode('utf-8')):
+                        found.append(i)
+                        if len(found) == limit:
+                            break
+            if len(found) == limit or scanned == MAX_SCAN:
+                break
+        return np.sort(np.array(found, dtype=np.int64))
+
+    def _by_df(self, lo, hi, limit):
+        """
+        Позиции диапазона [lo, hi) порциями по убыванию df, при равном df — по порядку.
+        Узкий диапазон сортируется целиком. Широкий выбирается из общей
+        перестановки by_df: позиции диапазона составляют в ней долю около
+        (hi - lo) / T, и limit самых частых находятся за ~limit * T / (hi - lo)
+        просмотренных позиций вместо всех hi - lo.
+        """
+        n = hi - lo
+        if n <= limit or self.doc_freqs is None:
+            yield np.arange(lo, hi)
+        elif self.by_df is None or n * n <= limit * self.n_terms:
+            yield lo + np.argsort(-self.doc_freqs[lo:hi].astype(np.int64), kind='stable')
+        else:
+            step = 2 * limit * self.n_terms // n
+            for start in range(0, self.n_terms, step):
+                chunk = self.by_df[start:start + step]
+                yield chunk[(chunk >= lo) & (chunk < hi)]
+
+
+class BinaryIndex(_SortedTerms):
+    """Индекс, открытый через mmap; списки документов декодируются по запросу"""
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_terms, self.n_docs, *offsets = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: неизвестный формат индекса")
+        doc_offs, doc_bytes, term_offs, term_bytes, post_offs, freqs, post_bytes = offsets
+        self._doc_offsets = np.frombuffer(self._mm, np.uint64, self.n_docs + 1, doc_offs)
+        self._doc_base = doc_bytes
+        self._term_offsets = np.frombuffer(self._mm, np.uint64, self.n_terms + 1, term_offs)
+        self._term_base = term_bytes
+        self._post_offsets = np.frombuffer(self._mm, np.uint64, self.n_terms + 1, post_offs)
+        self.doc_freqs = np.frombuffer(self._mm, np.uint32, self.n_terms, freqs)
+        self.by_df = None
+        self._post_base = post_bytes
+
+    def term(self, i):
+        return self._term_bytes(i).decode('utf-8')
+
+    def doc_id(self, num):
+        start, end = int(self._doc_offsets[num]), int(self._doc_offsets[num + 1])
+        return self._mm[self._doc_base + start:self._doc_base + end].decode('utf-8')
+
+    def doc_ids(self):
+        return [self.doc_id(i) for i in range(self.n_docs)]
+
+    def expand(self, pattern, limit=MAX_EXPANSIONS):
+        """Термы словаря под шаблон, не больше limit самых частых"""
+        return [self.term(i) for i in self.expand_positions(pattern, limit).tolist()]
+
+    def postings(self, term):
+        """Отсортированные номера документов терма (пустой массив, если терма нет)"""
+        i = self.find(term)
+        if i < 0:
+            return np.empty(0, dtype=np.int64)
+        start = self._post_base + int(self._post_offsets[i])
+        end = self._post_base + int(self._post_offsets[i + 1])
+        buf = np.frombuffer(self._mm, np.uint8, end - start, start)
+        return np.cumsum(decode_varints(buf))
+
+    def __contains__(self, term):
+        return self.find(term) >= 0
+
+    def __len__(self):
+        return self.n_terms
+
+    def close(self):
+        # Массивы поверх mmap нужно отпустить до его закрытия
+        self._doc_offsets = self._term_offsets = self._post_offsets = self.doc_freqs = None
+        self._mm.close()
+        self._file.close()
+
+
+def write_term_table(path, vocab, doc_freqs):
+    """
+    Записать таблицу словаря: vocab[j] — терм столбца j.
+    :param doc_freqs: число документов по столбцам (для отбора частых термов шаблона)
+    """
+    encoded = [t.encode('utf-8') for t in vocab]
+    columns = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.uint32)
+    positions = np.empty(len(encoded), dtype=np.uint32)
+    positions[columns] = np.arange(len(encoded), dtype=np.uint32)
+    term_offsets, term_bytes = _strings_section([vocab[j] for j in columns])
+    freqs = np.asarray(doc_freqs, dtype=np.uint32)[columns]
+    by_df = np.argsort(-freqs.astype(np.int64), kind='stable').astype(np.uint32)
+    header = TABLE_HEADERS[TABLE_VERSION]
+    out, offsets = _layout(header.size, [term_offsets, term_bytes, columns.tobytes(), positions.tobytes(),
+                                         freqs.tobytes(), by_df.tobytes()])
+    header.pack_into(out, 0, TABLE_MAGIC, TABLE_VERSION, len(encoded), *offsets)
+    _write_atomic(path, out)
+
+
+class TermTable(_SortedTerms):
+    """
+    Словарь терм <-> столбец поверх mmap. Поддерживает то, что нужно поиску
+    от списка vocab и dict term_to_idx: len, vocab[j], get(term), in, а также
+    раскрытие шаблонов expand(). В таблице версии 1 нет df, и из термов
+    шаблона остаются первые по алфавиту.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = struct.unpack_from('<4sI', self._mm, 0)
+        if magic != TABLE_MAGIC or version not in TABLE_HEADERS:
+            raise ValueError(f"{path}: неизвестный формат таблицы словаря")
+        _, _, self.n_terms, *offsets = TABLE_HEADERS[version].unpack_from(self._mm, 0)
+        term_offs, term_bytes, columns, positions = offsets[:4]
+        self._term_offsets = np.frombuffer(self._mm, np.uint64, self.n_terms + 1, term_offs)
+        self._term_base = term_bytes
+        self._columns = np.frombuffer(self._mm, np.uint32, self.n_terms, columns)
+        self._positions = np.frombuffer(self._mm, np.uint32, self.n_terms, positions)
+        self.doc_freqs = self.by_df = None
+        if version >= 2:
+            self.doc_freqs = np.frombuffer(self._mm, np.uint32, self.n_terms, offsets[4])
+            self.by_df = np.frombuffer(self._mm, np.uint32, self.n_terms, offsets[5])
+
+    def get(self, term, default=None):
+        """Столбец терма (бинарный поиск) или default"""
+        i = self.find(term)
+        return int(self._columns[i]) if i >= 0 else default
+
+    def expand(self, pattern, limit=MAX_EXPANSIONS):
+        """Столбцы термов под шаблон, не больше limit самых частых"""
+        return self._columns[self.expand_positions(pattern, limit)].tolist()
+
+    def __getitem__(self, column):
+        return self._term_bytes(int(self._positions[column])).decode('utf-8')
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __len__(self):
+        return self.n_terms
+
+    def __iter__(self):
+        return (self[j] for j in range(self.n_terms))
+
+    def close(self):
+        self._term_offsets = self._columns = self._positions = self.doc_freqs = self.by_df = None
+        self._mm.close()
+        self._file.close()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Построение FAISS-индекса vector.index по сохранённой матрице TF-IDF
+
+Индекс строится по нормированным строкам матрицы (скалярное произведение =
+косинусное сходство). Номер документа в индексе — номер строки матрицы,
+удалённые (tombstones) строки в индекс не попадают.
+
+Типы индекса:
+    flat  — точный перебор (IndexFlatIP)
+    ivf   — IVF-Flat: поиск только в nprobe ближайших кластерах из nlist
+    ivfpq — IVF-PQ: то же, векторы сжаты произведением квантизаторов
+    hnsw  — граф HNSW, точность/скорость регулируется efSearch
+
+Признаки сначала проецируются в --dim измерений (по умолчанию DEFAULT_DIM,
+рандомизированный SVD), проекция сохраняется в vector_projection.npy и
+применяется к запросам в flask_app.py. Индекс хранит плотные float32-векторы,
+поэтому по полному словарю (--dim 0) он строится, только если документы ×
+словарь × 4 байта не больше MAX_FULL_BYTES: иначе такой индекс и обучающая
+выборка не поместятся в память.
+
+Рядом сохраняется vector_index.json с версией и размерами матрицы: индекс,
+построенный по другой версии (матрицу пересобрали или дописали), flask_app.py
+не использует.
+
+После построения выводится отчёт: время построения, размер индекса,
+задержка запроса (p50/p99) и recall@k относительно точного cosine_search.
+
+Использование:
+    python build_faiss_index.py [--type flat|ivf|ivfpq|hnsw] [--dim D]
+                                [--nlist N] [--nprobe P] [--pq-m M]
+                                [--hnsw-m M] [--ef-construction E] [--ef-search E]
+                                [--queries Q] [--terms T] [--top-k K] [--report FILE]
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import faiss
+from pathlib import Path
+
+from vector_search import (FAISS_INDEX_FILE, FAISS_META_FILE, PROJECTION_FILE, cosine_search_batch,
+                           load_objects, matrix_version, save_array, write_index_version)
+
+CHUNK_ROWS = 1024  # сколько строк матрицы разворачивать в плотный вид за раз
+DEFAULT_DIM = 256  # размерность проекции по умолчанию
+MAX_FULL_BYTES = 1 << 30  # предел плотных векторов индекса по полному словарю, байт
+
+
+def dense_rows(mat, projection=None):
+    """Плотные нормированные строки матрицы блоками по CHUNK_ROWS: (номер первой строки, блок)"""
+    for start in range(0, mat.shape[0], CHUNK_ROWS):
+        block = mat.toarray(start, min(start + CHUNK_ROWS, mat.shape[0]))
+        if projection is not None:
+            block = np.ascontiguousarray(block @ projection, dtype=np.float32)
+            faiss.normalize_L2(block)
+        yield start, block
+
+
+def fit_projection(mat, dim, oversample=10, n_iter=2, seed=0):
+    """
+    Рандомизированный SVD (Halko и др.): матрица V × dim из правых
+    сингулярных векторов. Матрица документов разворачивается блоками.
+    """
+    rng = np.random.default_rng(seed)
+    k = min(dim + oversample, *mat.shape)
+    omega = rng.standard_normal((mat.shape[1], k)).astype(np.float32)
+    # Y = A Ω и несколько степенных итераций Y = A Aᵀ Y
+    y = np.vstack([block @ omega for _, block in dense_rows(mat)])
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(y)
+        at_q = np.zeros((mat.shape[1], q.shape[1]), dtype=np.float32)
+        for start, block in dense_rows(mat):
+            at_q += block.T @ q[start:start + len(block)]
+        y = np.vstack([block @ at_q for _, block in dense_rows(mat)])
+    q, _ = np.linalg.qr(y)
+    # B = Qᵀ A (k × V), его правые сингулярные векторы приближают векторы A
+    b = np.zeros((q.shape[1], mat.shape[1]), dtype=np.float32)
+    for start, block in dense_rows(mat):
+        b += q[start:start + len(block)].T @ block
+    _, _, vt = np.linalg.svd(b, full_matrices=False)
+    return np.ascontiguousarray(vt[:dim].T, dtype=np.float32)
+
+
+def factory_string(args, n_train, dim):
+    """Строка index_factory для выбранного типа; nlist и PQ подгоняются под размер корпуса"""
+    if args.type == 'flat':
+        return 'IDMap,Flat'
+    if args.type == 'hnsw':
+        return f'IDMap,HNSW{args.hnsw_m}'
+    nlist = args.nlist or max(1, int(4 * np.sqrt(n_train)))
+    if nlist > n_train:
+        print(f"nlist={nlist} больше числа документов, уменьшено до {n_train}")
+        nlist = n_train
+    args.nlist = nlist
+    if args.type == 'ivf':
+        return f'IVF{nlist},Flat'
+    if dim % args.pq_m:
+        raise SystemExit(f"Размерность {dim} должна делиться на --pq-m {args.pq_m}")
+    # 2^nbits центроидов на подпространство должно хватать обучающих векторов
+    nbits = int(min(8, max(1, np.floor(np.log2(n_train)))))
+    return f'IVF{nlist},PQ{args.pq_m}x{nbits}'
+
+
+def build_index(mat, args, projection=None):
+    live = np.ones(mat.shape[0], dtype=bool) if mat.deleted is None else ~mat.deleted
+    dim = mat.shape[1] if projection is None else projection.shape[1]
+    spec = factory_string(args, int(live.sum()), dim)
+    print(f"Индекс {spec}, размерность {dim}, документов {int(live.sum())}")
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if args.type == 'hnsw':
+        faiss.downcast_index(index.index).hnsw.efConstruction = args.ef_construction
+
+    if not index.is_trained:
+        train = np.vstack([block[live[start:start + len(block)]]
+                           for start, block in dense_rows(mat, projection)])
+        index.train(train)
+        del train
+    for start, block in dense_rows(mat, projection):
+        mask = live[start:start + len(block)]
+        ids = np.arange(start, start + len(block), dtype=np.int64)[mask]
+        if len(ids):
+            index.add_with_ids(np.ascontiguousarray(block[mask]), ids)
+
+    # Параметры поиска сохраняются вместе с индексом
+    if args.type in ('ivf', 'ivfpq'):
+        faiss.extract_index_ivf(index).nprobe = args.nprobe
+    elif args.type == 'hnsw':
+        faiss.downcast_index(index.index).hnsw.efSearch = args.ef_search
+    return index
+
+
+def make_queries(mat, n_queries, max_terms, rng):
+    """Запросы из 1..max_terms признаков случайного живого документа, как векторы (Q, V)"""
+    lengths = np.diff(mat.indptr)
+    live = np.flatnonzero(lengths > 0)
+    if mat.deleted is not None:
+        live = live[~mat.deleted[live]]
+    vecs = np.zeros((n_queries, mat.shape[1]), dtype=np.float32)
+    for row, doc in enumerate(rng.choice(live, size=n_queries)):
+        terms = mat.indices[mat.indptr[doc]:mat.indptr[doc + 1]]
+        chosen = rng.choice(terms, size=min(len(terms), rng.integers(1, max_terms + 1)), replace=False)
+        vecs[row, chosen] = 1.0 / np.sqrt(len(chosen))
+    return vecs
+
+
+def evaluate(index, mat, queries, top_k, projection=None):
+    """Задержка одиночного запроса и recall@k относительно точного косинусного поиска"""
+    exact_scores, exact_idxs = cosine_search_batch(mat, queries, top_k)
+    if projection is not None:
+        queries = np.ascontiguousarray(queries @ projection, dtype=np.float32)
+        faiss.normalize_L2(queries)
+
+    timings, recalls = [], []
+    for row in range(len(queries)):
+        start = time.perf_counter()
+        _, idxs = index.search(queries[row:row + 1], top_k)
+        timings.append(time.perf_counter() - start)
+        # Документы с нулевым сходством в точной выдаче — заполнение, их не учитываем
+        relevant = set(exact_idxs[row][exact_scores[row] > 0].tolist())
+        if relevant:
+            recalls.append(len(relevant & set(idxs[0].tolist())) / len(relevant))
+
+    ms = np.array(timings) * 1000
+    return {
+        'latency_p50_ms': float(np.percentile(ms, 50)),
+        'latency_p99_ms': float(np.percentile(ms, 99)),
+        f'recall@{top_k}': float(np.mean(recalls)) if recalls else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--type', choices=['flat', 'ivf', 'ivfpq', 'hnsw'], default='flat')
+    parser.add_argument('--dim', type=int, default=DEFAULT_DIM,
+                        help=f'размерность после SVD (0 — полный словарь, до {MAX_FULL_BYTES >> 20} МБ векторов)')
+    parser.add_argument('--nlist', type=int, default=0, help='число кластеров IVF (0 — 4·√N)')
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--pq-m', type=int, default=8, help='число подквантизаторов IVF-PQ')
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--ef-construction', type=int, default=40)
+    parser.add_argument('--ef-search', type=int, default=64)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--terms', type=int, default=3)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default='faiss_report.json')
+    args = parser.parse_args()
+
+    mat, doc_ids, vocab = load_objects()
+    if mat is None:
+        raise SystemExit("Нет сохранённой матрицы: сначала запустите vector_search.py")
+
+    start = time.perf_counter()
+    projection = None
+    n_live = mat.shape[0] - (0 if mat.deleted is None else int(np.count_nonzero(mat.deleted)))
+    if not args.dim and n_live * mat.shape[1] * 4 > MAX_FULL_BYTES:
+        raise SystemExit(f"Индекс по полному словарю займёт {n_live * mat.shape[1] * 4 >> 20} МБ "
+                         f"(больше {MAX_FULL_BYTES >> 20} МБ): задайте --dim")
+    if args.dim and args.dim < mat.shape[1]:
+        projection = fit_projection(mat, min(args.dim, *mat.shape), seed=args.seed)
+        print(f"Проекция {projection.shape[0]}→{projection.shape[1]} за {time.perf_counter() - start:.2f} с")
+    index = build_index(mat, args, projection)
+    build_time = time.perf_counter() - start
+
+    # Атомарная замена: работающие процессы flask_app дочитывают прежний индекс
+    faiss.write_index(index, FAISS_INDEX_FILE + '.tmp')
+    os.replace(FAISS_INDEX_FILE + '.tmp', FAISS_INDEX_FILE)
+    if projection is not None:
+        save_array(PROJECTION_FILE, projection)
+    elif Path(PROJECTION_FILE).exists():
+        Path(PROJECTION_FILE).unlink()
+    # Версия матрицы пишется последней: flask_app не возьмёт индекс, построенный по другой
+    meta = {'matrix_version': matrix_version(mat), 'shape': list(mat.shape), 'dim': int(index.d)}
+    Path(FAISS_META_FILE + '.tmp').write_text(json.dumps(meta), encoding='utf-8')
+    os.replace(FAISS_META_FILE + '.tmp', FAISS_META_FILE)
+    write_index_version()
+
+    rng = np.random.default_rng(args.seed)
+    queries = make_queries(mat, args.queries, args.terms, rng)
+    report = {
+        'type': args.type,
+        'dim': int(index.d),
+        'n_docs': int(index.ntotal),
+        'params': {k: getattr(args, k) for k in ('nlist', 'nprobe', 'pq_m', 'hnsw_m',
+                                                  'ef_construction', 'ef_search')},
+        'build_time_s': build_time,
+        'index_size_bytes': os.path.getsize(FAISS_INDEX_FILE)
+                            + (os.path.getsize(PROJECTION_FILE) if projection is not None else 0),
+        **evaluate(index, mat, queries, args.top_k, projection),
+    }
+    Path(args.report).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    print(f"Сохранено: {FAISS_INDEX_FILE}" + (f", {PROJECTION_FILE}" if projection is not None else ""))
+    print(f"Построение: {build_time:.2f} с, размер: {report['index_size_bytes'] / 1024:.1f} КБ")
+    print(f"Задержка: p50={report['latency_p50_ms']:.3f} мс  p99={report['latency_p99_ms']:.3f} мс")
+    print(f"recall@{args.top_k}: {report[f'recall@{args.top_k}']}")
+    print(f"Отчёт: {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Хранилище текстов документов: текст каждой страницы output/ извлекается
+BeautifulSoup один раз при загрузке (ingest), а этапы конвейера и выдача
+поиска читают его отсюда, не разбирая HTML заново.
+
+Формат — папка docstore/, файлы только дописываются:
+    blocks.bin   блоки zlib; в блоке тексты нескольких документов подряд
+                 (до BLOCK_SIZE байт UTF-8; больший документ — отдельным блоком)
+    docs.idx     запись RECORD на документ: смещение и размер его блока
+                 в blocks.bin, начало и длина текста внутри распакованного блока
+    docs.tsv     строка на документ: doc_id, размер и mtime_ns исходного HTML
+
+Номер документа — номер его записи, поэтому доступ к тексту по номеру —
+одно чтение записи и распаковка одного блока (последние блоки кэшируются).
+Изменённая страница дописывается заново, doc_id указывает на последнюю версию;
+старые версии и удалённые страницы остаются в файлах до --rebuild.
+Записи дописываются после своих блоков, а строки docs.tsv — после записей:
+при обрыве загрузки хвосты без пары отбрасываются при следующем открытии.
+
+Использование:
+    python doc_store.py ingest [--input output/] [--workers N] [--rebuild]
+    python doc_store.py show DOC_ID
+"""
+import argparse
+import functools
+import mmap
+import os
+import shutil
+import struct
+import time
+import zlib
+from multiprocessing import Pool
+
+import numpy as np
+from bs4 import BeautifulSoup
+
+import instrumentation
+
+INPUT_FOLDER = 'output/'
+STORE_DIR = 'docstore'
+BLOCKS_FILE = 'blocks.bin'
+RECORDS_FILE = 'docs.idx'
+DOCS_FILE = 'docs.tsv'
+
+BLOCK_SIZE = 64 * 1024   # байт текста в блоке до сжатия
+ZLIB_LEVEL = 6
+BLOCK_CACHE = 32         # распакованных блоков в памяти процесса
+RECORD = struct.Struct('<QIII')
+RECORD_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u4'), ('start', '<u4'), ('length', '<u4')])
+
+
+def extract_text(path):
+    """Текст HTML-страницы, как его видят все этапы: узлы через пробел"""
+    with open(path, encoding='utf-8') as f:
+        return BeautifulSoup(f, 'html.parser').get_text(separator=' ')
+
+
+def _extract_worker(path):
+    with instrumentation.stage("parse_html"):
+        text = extract_text(path)
+    return text, instrumentation.drain()
+
+
+def _read_docs(folder):
+    """Строки docs.tsv: [(doc_id, size, mtime_ns)]"""
+    path = os.path.join(folder, DOCS_FILE)
+    if not os.path.exists(path):
+        return []
+    docs = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) == 3:
+                docs.append((parts[0], int(parts[1]), int(parts[2])))
+    return docs
+
+
+class DocStoreWriter:
+    """
+    Дописывает документы в хранилище. Тексты копятся до BLOCK_SIZE и
+    сжимаются одним блоком; close() сбрасывает последний неполный блок.
+    """
+    def __init__(self, folder=STORE_DIR):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.docs = _read_docs(folder)
+        records_path = os.path.join(folder, RECORDS_FILE)
+        n_records = os.path.getsize(records_path) // RECORD.size if os.path.exists(records_path) else 0
+        n = min(n_records, len(self.docs))
+        self.docs = self.docs[:n]
+        # Хвосты от оборванной загрузки: записи без строки docs.tsv и блоки без записей
+        self._records = open(records_path, 'ab')
+        self._records.truncate(n * RECORD.size)
+        end = 0
+        if n:
+            with open(records_path, 'rb') as f:
+                f.seek((n - 1) * RECORD.size)
+                offset, size, _, _ = RECORD.unpack(f.read(RECORD.size))
+            end = offset + size
+        self._blocks = open(os.path.join(folder, BLOCKS_FILE), 'ab')
+        self._blocks.truncate(end)
+        self._offset = end
+        self._docs_file = open(os.path.join(folder, DOCS_FILE), 'a', encoding='utf-8')
+        self._docs_file.truncate(sum(len(f"{d}\t{s}\t{m}\n".encode('utf-8')) for d, s, m in self.docs))
+        self._pending = []       # (doc_id, size, mtime_ns, текст в UTF-8)
+        self._pending_bytes = 0
+
+    def add(self, doc_id, text, size=0, mtime_ns=0):
+        data = text.encode('utf-8')
+        if self._pending and self._pending_bytes + len(data) > BLOCK_SIZE:
+            self._flush_block()
+        self._pending.append((doc_id, size, mtime_ns, data))
+        self._pending_bytes += len(data)
+
+    def _flush_block(self):
+        if not self._pending:
+            return
+        with instrumentation.stage("compress"):
+            block = zlib.compress(b''.join(item[3] for item in self._pending), ZLIB_LEVEL)
+        self._blocks.write(block)
+        self._blocks.flush()
+        start = 0
+        for doc_id, size, mtime_ns, data in self._pending:
+            self._records.write(RECORD.pack(self._offset, len(block), start, len(data)))
+            start += len(data)
+        self._records.flush()
+        for doc_id, size, mtime_ns, data in self._pending:
+            self._docs_file.write(f"{doc_id}\t{size}\t{mtime_ns}\n")
+            self.docs.append((doc_id, size, mtime_ns))
+        self._docs_file.flush()
+        self._offset += len(block)
+        self._pending, self._pending_bytes = [], 0
+
+    def close(self):
+        self._flush_block()
+        for f in (self._blocks, self._records, self._docs_file):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DocStore:
+    """Чтение хранилища через mmap: текст по номеру документа или по doc_id"""
+    def __init__(self, folder=STORE_DIR):
+        docs = _read_docs(folder)
+        records = np.fromfile(os.path.join(folder, RECORDS_FILE), dtype=RECORD_DTYPE)
+        n = min(len(records), len(docs))
+        self.records = records[:n]
+        self.doc_ids = [doc_id for doc_id, _, _ in docs[:n]]
+        # Последняя версия документа перекрывает прежние
+        self._nums = {doc_id: num for num, doc_id in enumerate(self.doc_ids)}
+        self._file = open(os.path.join(folder, BLOCKS_FILE), 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if n else b''
+        self._block = functools.lru_cache(maxsize=BLOCK_CACHE)(self._read_block)
+
+    def _read_block(self, offset, size):
+        return zlib.decompress(self._mm[offset:offset + size])
+
+    def text(self, num):
+        """Текст документа с номером num"""
+        offset, size, start, length = self.records[num].tolist()
+        return self._block(offset, size)[start:start + length].decode('utf-8')
+
+    def get(self, doc_id, default=None):
+        """Текст последней версии doc_id или default"""
+        num = self._nums.get(doc_id)
+        return self.text(num) if num is not None else default
+
+    def clear_cache(self):
+        """Сбросить кэш распакованных блоков"""
+        self._block.cache_clear()
+
+    def __contains__(self, doc_id):
+        return doc_id in self._nums
+
+    def __len__(self):
+        return len(self._nums)
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+
+_store = None
+
+
+def read_text(filename, folder=STORE_DIR):
+    """
+    Текст страницы output/<filename> из хранилища. Хранилище открывается
+    при первом обращении в процессе (в том числе в каждом воркере пула).
+    :raises KeyError: страница не загружена в хранилище (нужен ingest)
+    """
+    global _store
+    if _store is None:
+        _store = DocStore(folder)
+    text = _store.get(filename[:-len('.html')] if filename.endswith('.html') else filename)
+    if text is None:
+        raise KeyError(f"{filename}: нет в {folder}, запустите python doc_store.py ingest")
+    return text
+
+
+@instrumentation.timed("ingest")
+def ingest(input_folder=INPUT_FOLDER, folder=STORE_DIR, workers=1, rebuild=False):
+    """
+    Загрузить в хранилище новые и изменённые (по размеру и mtime) страницы.
+    :return: {'docs': загружено страниц, 'html_mb': их объём, 'seconds': время}
+    """
+    global _store
+    start = time.perf_counter()
+    if rebuild:
+        shutil.rmtree(folder, ignore_errors=True)
+    with DocStoreWriter(folder) as writer:
+        latest = {doc_id: (size, mtime) for doc_id, size, mtime in writer.docs}
+        todo = []
+        for name in sorted(os.listdir(input_folder)):
+            if not name.endswith('.html'):
+                continue
+            st = os.stat(os.path.join(input_folder, name))
+            if latest.get(name[:-len('.html')]) != (st.st_size, st.st_mtime_ns):
+                todo.append((name, st))
+        paths = [os.path.join(input_folder, name) for name, _ in todo]
+        if workers > 1 and len(paths) > 1:
+            chunksize = max(1, len(paths) // (workers * 4))
+            with Pool(workers, initializer=instrumentation.init_worker) as pool:
+                for (name, st), (text, timings) in zip(todo, pool.imap(_extract_worker, paths, chunksize=chunksize)):
+                    instrumentation.merge(timings)
+                    writer.add(name[:-len('.html')], text, st.st_size, st.st_mtime_ns)
+        else:
+            for (name, st), path in zip(todo, paths):
+                with instrumentation.stage("parse_html"):
+                    text = extract_text(path)
+                writer.add(name[:-len('.html')], text, st.st_size, st.st_mtime_ns)
+    # Открытое раньше хранилище не видит дописанного
+    if _store is not None:
+        _store.close()
+        _store = None
+    instrumentation.count("documents", len(todo))
+    return {'docs': len(todo), 'html_mb': sum(st.st_size for _, st in todo) / 2**20,
+            'seconds': time.perf_counter() - start}
+
+
+def store_mb(folder=STORE_DIR):
+    """Объём хранилища на диске"""
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in (BLOCKS_FILE, RECORDS_FILE, DOCS_FILE)
+               if os.path.exists(os.path.join(folder, name))) / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('ingest', help="загрузить новые и изменённые страницы")
+    p.add_argument('--input', default=INPUT_FOLDER)
+    p.add_argument('--store', default=STORE_DIR)
+    p.add_argument('--workers', type=int, default=1, help="процессов для разбора HTML")
+    p.add_argument('--rebuild', action='store_true', help="собрать хранилище заново, без старых версий")
+    p.add_argument('--profile', default=None,
+                   help="записать профиль cProfile в файл и этапы для flame graph рядом (.folded)")
+    p = sub.add_parser('show', help="вывести текст документа")
+    p.add_argument('doc_id')
+    p.add_argument('--store', default=STORE_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        text = DocStore(args.store).get(args.doc_id)
+        if text is None:
+            parser.error(f"{args.doc_id}: нет в хранилище")
+        print(' '.join(text.split()))
+        return
+    if args.profile:
+        instrumentation.profile_to(args.profile)
+    stats = ingest(args.input, args.store, args.workers, args.rebuild)
+    rate = stats['html_mb'] / stats['seconds'] if stats['seconds'] else 0.0
+    print(f"Загружено страниц: {stats['docs']} ({stats['html_mb']:.1f} МБ HTML, {rate:.1f} МБ/с); "
+          f"хранилище {store_mb(args.store):.2f} МБ")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,149 @@
 import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+
+OUTPUT_DIR = "output"
+# Коды ответа, при которых запрос стоит повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostRateLimiter:
+    """Вежливость: не чаще одного запроса в min_interval секунд к одному хосту"""
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, host):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
 
-def fetch_and_save(url, index):
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
+def make_session(pool_size):
+    """Сессия с пулом соединений: keep-alive вместо нового соединения на каждый URL"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-        page_id = url.split("//")[-1].replace("/", "_").replace(":", "_").replace("?", "_").replace("=", "_")
-        file_name = f"output/{index}_{page_id}.html"
 
-        os.makedirs("output", exist_ok=True)
+def page_file_name(url, index, output_dir=OUTPUT_DIR):
+    page_id = url.split("//")[-1].replace("/", "_").replace(":", "_").replace("?", "_").replace("=", "_")
+    return f"{output_dir}/{index}_{page_id}.html"
 
-        with open(file_name, "w", encoding="utf-8") as f:
-            f.write(response.text)
 
-        with open("output/index.txt", "a", encoding="utf-8") as index_file:
-            index_file.write(f"{file_name} {url}\n")
+def fetch_and_save(session, url, index, validators, limiter, output_dir=OUTPUT_DIR,
+                   retries=3, backoff=0.5, timeout=10):
+    """
+    Скачивает одну страницу с повторами и условным запросом.
+    :param validators: ETag/Last-Modified с прошлого запуска для этого URL
+    :return: (file_name, статус 'saved' | 'not_modified' | 'failed', новые валидаторы)
+    """
+    file_name = page_file_name(url, index, output_dir)
+    headers = {}
+    if os.path.exists(file_name):
+        # Неизменённые страницы сервер вернёт как 304 без тела
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
 
-        print(f"[+] Saved: {url}")
-    except Exception as e:
-        print(f"[-] Failed: {url}, Error: {e}")
+    host = urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        limiter.wait(host)
+        try:
+            response = session.get(url, timeout=timeout, headers=headers)
+            if response.status_code == 304:
+                return file_name, "not_modified", validators
+            response.raise_for_status()
+
+            # Через временный файл: при ошибке записи прежняя версия страницы остаётся целой
+            with open(file_name + ".tmp", "w", encoding="utf-8") as f:
+                f.write(response.text)
+            os.replace(file_name + ".tmp", file_name)
+            return file_name, "saved", {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        except requests.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            retryable = status is None or status in RETRY_STATUSES
+            if not retryable or attempt == retries:
+                print(f"[-] Failed: {url}, Error: {e}")
+                return file_name, "failed", validators
+            time.sleep(backoff * 2 ** attempt)
+        except (OSError, ValueError) as e:
+            # Ошибки записи файла и декодирования не повторяются, но и не прерывают обход
+            if os.path.exists(file_name + ".tmp"):
+                os.remove(file_name + ".tmp")
+            print(f"[-] Failed: {url}, Error: {e}")
+            return file_name, "failed", validators
+
+
+def crawl(urls, output_dir=OUTPUT_DIR, workers=16, per_host_interval=0.1, retries=3, timeout=10):
+    """
+    Скачивает список URL параллельно и один раз перезаписывает index.txt.
+    Номер страницы — номер строки списка; пустые строки пропускаются, не сдвигая номера.
+    :return: {статус: количество}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    validators_path = os.path.join(output_dir, "validators.json")
+    validators = {}
+    if os.path.exists(validators_path):
+        with open(validators_path, "r", encoding="utf-8") as f:
+            validators = json.load(f)
+
+    session = make_session(workers)
+    limiter = HostRateLimiter(per_host_interval)
+    numbered = [(index, url) for index, url in enumerate(urls) if url]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(fetch_and_save, session, url, index, validators.get(url, {}), limiter,
+                        output_dir, retries, timeout=timeout)
+            for index, url in numbered
+        ]
+        results = [future.result() for future in futures]
+
+    summary = {"saved": 0, "not_modified": 0, "failed": 0}
+    with open(os.path.join(output_dir, "index.txt"), "w", encoding="utf-8") as index_file:
+        for (_, url), (file_name, status, new_validators) in zip(numbered, results):
+            summary[status] += 1
+            validators[url] = new_validators
+            if os.path.exists(file_name):
+                index_file.write(f"{file_name} {url}\n")
+    with open(validators_path, "w", encoding="utf-8") as f:
+        json.dump(validators, f, ensure_ascii=False)
+    return summary
 
 
 def main():
-    with open("urls.txt", "r", encoding="utf-8") as f:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", default="urls.txt", help="файл со списком URL")
+    parser.add_argument("--workers", type=int, default=16, help="число одновременных запросов")
+    parser.add_argument("--per-host-interval", type=float, default=0.1,
+                        help="минимальный интервал между запросами к одному хосту, с")
+    parser.add_argument("--retries", type=int, default=3, help="число повторов при сетевых ошибках и 429/5xx")
+    args = parser.parse_args()
+
+    with open(args.urls, "r", encoding="utf-8") as f:
         urls = [line.strip() for line in f.readlines()]
 
-    for index, url in enumerate(urls):
-        fetch_and_save(url, index)
+    start = time.perf_counter()
+    summary = crawl(urls, workers=args.workers, per_host_interval=args.per_host_interval, retries=args.retries)
+    print(f"[+] Saved: {summary['saved']}, not modified: {summary['not_modified']}, "
+          f"failed: {summary['failed']} ({time.perf_counter() - start:.1f} s)")
 
 
 if __name__ == "__main__":
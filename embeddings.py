@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Плотные векторы документов (sentence-transformers) для гибридного поиска
+
+Текст каждой страницы output/ (из хранилища doc_store.py) кодируется
+моделью пакетами по --batch-size, пакеты распределяются по --workers
+процессам (в каждом своя копия модели).
+Векторы хранятся одним массивом .npy (float32 или float16), который
+flask_app.py открывает через mmap, не читая в память целиком.
+
+Повторный запуск кодирует заново только документы, у которых изменился
+SHA-1 текста; векторы остальных переносятся из прежнего массива.
+
+Модель 'hashing' — встроенный кодировщик без сети и весов (хэширование
+слов в --dim измерений), для проверки конвейера в офлайн-окружении.
+
+Результаты:
+- doc_embeddings.npy     # (N, dim) нормированные векторы документов
+- doc_embeddings.json    # Модель, тип, doc_id строк и хэши текстов
+
+Использование:
+    python embeddings.py [--model NAME|hashing] [--workers W] [--batch-size B]
+                         [--dtype float32|float16] [--dim D] [--rebuild]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import resource
+import time
+import zlib
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import doc_store
+from vector_search import EMBEDDINGS_FILE, EMBEDDINGS_META_FILE, top_k_indices, write_index_version
+
+INPUT_FOLDER = 'output/'
+DEFAULT_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+HASHING_MODEL = 'hashing'
+MAX_TEXT_CHARS = 5000  # модель всё равно обрезает вход до max_seq_length токенов
+WORD_RE = re.compile(r'\w+')
+
+
+class HashingEncoder:
+    """Кодировщик без обучения: слова хэшируются в dim измерений со знаком"""
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def encode(self, texts, batch_size=None, normalize_embeddings=True,
+               convert_to_numpy=True, show_progress_bar=False):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in WORD_RE.findall(text.lower()):
+                h = zlib.crc32(word.encode('utf-8'))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.where(norms > 0, norms, 1.0)
+        return out
+
+
+def load_encoder(model_name, dim=256):
+    if model_name == HASHING_MODEL:
+        return HashingEncoder(dim)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device='cpu')
+
+
+def encode_texts(encoder, texts, batch_size=64):
+    """Нормированные векторы float32 shape (len(texts), dim)"""
+    return np.asarray(encoder.encode(texts, batch_size=batch_size, normalize_embeddings=True,
+                                     convert_to_numpy=True, show_progress_bar=False),
+                      dtype=np.float32)
+
+
+def read_text(filename):
+    return ' '.join(doc_store.read_text(filename).split())[:MAX_TEXT_CHARS]
+
+
+_encoder = None
+
+
+def _init_worker(model_name, dim, threads):
+    """Загружает модель один раз на процесс пула"""
+    global _encoder
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    _encoder = load_encoder(model_name, dim)
+
+
+def _encode_batch(texts):
+    return encode_texts(_encoder, texts, batch_size=len(texts))
+
+
+def load_embeddings(folder='.'):
+    """
+    :param folder: папка с файлами индекса (index_folder опубликованной версии)
+    :return: (векторы через mmap, doc_ids, метаданные) или (None, None, None)
+    """
+    vectors_path, meta_path = Path(folder, EMBEDDINGS_FILE), Path(folder, EMBEDDINGS_META_FILE)
+    if not (vectors_path.exists() and meta_path.exists()):
+        return None, None, None
+    meta = json.loads(meta_path.read_text(encoding='utf-8'))
+    return np.load(vectors_path, mmap_mode='r'), meta['doc_ids'], meta
+
+
+def build_embeddings(model_name, workers=1, batch_size=64, dtype='float32', dim=256, rebuild=False):
+    start = time.perf_counter()
+    doc_store.ingest(INPUT_FOLDER, workers=workers)
+    files = sorted(f for f in os.listdir(INPUT_FOLDER) if f.endswith('.html'))
+    doc_ids = [f[:-len('.html')] for f in files]
+    texts = [read_text(f) for f in files]
+    hashes = [hashlib.sha1(t.encode('utf-8')).hexdigest() for t in texts]
+
+    # Векторы прежней сборки той же модели переиспользуются для неизменённых текстов
+    old, old_ids, old_meta = (None, None, None) if rebuild else load_embeddings()
+    old_rows = {}
+    if (old is not None and old_meta['model'] == model_name and old_meta['dtype'] == dtype
+            and (model_name != HASHING_MODEL or old_meta['dim'] == dim)):
+        old_rows = {(d, h): i for i, (d, h) in enumerate(zip(old_ids, old_meta['hashes']))}
+    todo = [i for i, key in enumerate(zip(doc_ids, hashes)) if key not in old_rows]
+
+    batches = [[texts[i] for i in todo[s:s + batch_size]] for s in range(0, len(todo), batch_size)]
+    encode_start = time.perf_counter()
+    if workers > 1 and len(batches) > 1:
+        threads = max(1, (os.cpu_count() or 1) // workers) if model_name != HASHING_MODEL else 0
+        with Pool(workers, initializer=_init_worker, initargs=(model_name, dim, threads)) as pool:
+            encoded = pool.map(_encode_batch, batches)
+    else:
+        _init_worker(model_name, dim, 0)
+        encoded = [_encode_batch(batch) for batch in batches]
+    encode_time = time.perf_counter() - encode_start
+    new_vecs = np.vstack(encoded) if encoded else None
+
+    dim = new_vecs.shape[1] if new_vecs is not None else old.shape[1]
+    tmp_file = EMBEDDINGS_FILE + '.tmp.npy'
+    out = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=dtype, shape=(len(files), dim))
+    new_pos = {i: pos for pos, i in enumerate(todo)}
+    for i, key in enumerate(zip(doc_ids, hashes)):
+        out[i] = new_vecs[new_pos[i]] if i in new_pos else old[old_rows[key]]
+    out.flush()
+    del out, old
+    os.replace(tmp_file, EMBEDDINGS_FILE)
+    meta = {'model': model_name, 'dim': dim, 'dtype': dtype, 'doc_ids': doc_ids, 'hashes': hashes}
+    Path(EMBEDDINGS_META_FILE + '.tmp').write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+    os.replace(EMBEDDINGS_META_FILE + '.tmp', EMBEDDINGS_META_FILE)
+    write_index_version()
+
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(f"Документов: {len(files)}, закодировано заново: {len(todo)}, "
+          f"взято из прежней сборки: {len(files) - len(todo)}")
+    if todo:
+        print(f"Кодирование: {encode_time:.2f} с, {len(todo) / encode_time:.1f} док/с")
+    print(f"Всего: {time.perf_counter() - start:.2f} с; векторы {len(files)}×{dim} {dtype}: "
+          f"{os.path.getsize(EMBEDDINGS_FILE) / 2**20:.2f} МБ; пик RSS процесса: {peak_kb / 1024:.0f} МБ")
+
+
+def dense_search(embeddings, query_vecs, top_k):
+    """
+    Косинусный поиск по нормированным векторам документов (mmap читается блоками).
+    :return: scores (B, K), idxs (B, K)
+    """
+    sims = np.empty((len(query_vecs), len(embeddings)), dtype=np.float32)
+    for start in range(0, len(embeddings), 65536):
+        block = np.asarray(embeddings[start:start + 65536], dtype=np.float32)
+        sims[:, start:start + len(block)] = query_vecs @ block.T
+    idxs = np.stack([top_k_indices(row, top_k) for row in sims])
+    return np.take_along_axis(sims, idxs, axis=1), idxs
+
+
+def rrf_fuse(rankings, top_k, rrf_k=60):
+    """
+    Reciprocal rank fusion: score(d) = Σ 1 / (rrf_k + ранг d в списке).
+    :param rankings: списки doc_id по убыванию релевантности
+    :return: [(doc_id, score)] длины не больше top_k
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    # sorted устойчив: при равенстве выше документ, раньше встретившийся в списках
+    return sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=DEFAULT_MODEL, help=f"модель sentence-transformers или '{HASHING_MODEL}'")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--dim', type=int, default=256, help='размерность для модели hashing')
+    parser.add_argument('--rebuild', action='store_true', help='закодировать все документы заново')
+    args = parser.parse_args()
+    build_embeddings(args.model, args.workers, args.batch_size, args.dtype, args.dim, args.rebuild)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,495 @@
 # web_search_app.py
-from flask import Flask, render_template, request
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+from flask import Flask, Response, g, jsonify, render_template, request
 import numpy as np
 import faiss
 from pathlib import Path
 
+from vector_search import (FAISS_INDEX_FILE, FAISS_META_FILE, PROJECTION_FILE, load_objects,
+                           query_weights, matrix_version, cosine_search_batch, index_folder, read_index_version,
+                           term_index, PostingsIndex)
+import instrumentation
+from doc_store import RECORDS_FILE, STORE_DIR, DocStore
+from result_cache import ResultCache
+from snippets import QueryHighlighter
+from embeddings import dense_search, encode_texts, load_embeddings, load_encoder, rrf_fuse
+
 # --- Загружаем объекты поиска ---
-MAT_FILE = 'tfidf_matrix.npy'
-DOCIDS_FILE = 'doc_ids.npy'
-INDEX_FILE = 'vector.index'
-VOCAB_FILE = 'vocab.npy'
+INDEX_FILE = FAISS_INDEX_FILE
+# Движок поиска без FAISS: 'dense' (вся матрица) или 'postings' (инвертированные списки)
+ENGINE = 'postings'
+# Микробатчинг /api/search: запросы, пришедшие в пределах BATCH_DELAY секунд,
+# считаются одним умножением матрицы на матрицу запросов
+BATCHING = True
+MAX_BATCH = 64
+BATCH_DELAY = 0.005
+MAX_TOP_K = 100
+# Кэш результатов: сбрасывается сам при смене версии индекса (index_version.txt).
+# RESULT_CACHE_FILE — файл SQLite, общий для нескольких процессов сервера
+RESULT_CACHE_SIZE = 10_000
+RESULT_CACHE_TTL = 3600
+RESULT_CACHE_FILE = None
+# Гибридный поиск: если построены векторы embeddings.py, выдача TF-IDF и плотного
+# поиска объединяется reciprocal rank fusion по RRF_DEPTH первым документам каждой
+HYBRID = True
+RRF_K = 60
+RRF_DEPTH = 100
+# Как часто (с) проверять index_version.txt и подхватывать новую версию индекса
+RELOAD_INTERVAL = 1.0
+# Таймеры этапов и счётчики для /metrics (формат Prometheus)
+METRICS = True
+# Раз в METRICS_FLUSH_INTERVAL секунд процесс записывает снимок метрик в общую
+# папку (share_metrics, её задаёт serve.py), и /metrics любого процесса отдаёт их сумму
+METRICS_FLUSH_INTERVAL = 1.0
+# Сниппеты выдачи из хранилища текстов doc_store.py (если оно собрано)
+SNIPPETS = True
+
+instrumentation.enable(METRICS)
+
+
+def search_vectors(mat, index, projection, postings, vecs, k):
+    """
+    Поиск сразу по пачке запросов (B, V) выбранным движком: FAISS-индексом,
+    инвертированными списками (ENGINE = 'postings', каждый запрос отдельно)
+    или одним умножением разреженной матрицы на матрицу запросов.
+    :return: scores (B, K), idxs (B, K); недобранные места — (-inf, -1)
+    """
+    if index is not None:
+        if projection is not None:
+            with instrumentation.stage("project"):
+                vecs = np.ascontiguousarray(vecs @ projection, dtype=np.float32)
+                faiss.normalize_L2(vecs)
+        with instrumentation.stage("search_faiss"):
+            return index.search(vecs, k)
+    if postings is None:
+        return cosine_search_batch(mat, vecs, k)
+    D = np.full((len(vecs), k), -np.inf, dtype=np.float32)
+    I = np.full((len(vecs), k), -1, dtype=np.int64)
+    with instrumentation.stage("search_postings"):
+        for row, vec in enumerate(vecs):
+            found = np.flatnonzero(vec)
+            sims, idxs = postings.search(dict(zip(found.tolist(), vec[found])), k)
+            D[row, :len(sims)], I[row, :len(idxs)] = sims, idxs
+    return D, I
+
+
+def load_faiss_index(mat, folder='.'):
+    """
+    FAISS-индекс и проекция запросов (или None), если индекс построен по этой
+    версии матрицы. Устаревший индекс — другой размерности или с удалёнными
+    с тех пор строками — пропускается, поиск идёт точно по матрице.
+    :return: (index, projection) или (None, None)
+    """
+    index_path, meta_path, projection_path = (Path(folder, name) for name in (INDEX_FILE, FAISS_META_FILE,
+                                                                              PROJECTION_FILE))
+    if not index_path.exists():
+        return None, None
+    meta = json.loads(meta_path.read_text(encoding='utf-8')) if meta_path.exists() else {}
+    if meta.get('matrix_version') != matrix_version(mat):
+        app.logger.warning("%s построен не по текущей матрице и не используется", INDEX_FILE)
+        return None, None
+    index = faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    # Если индекс строился в пространстве меньшей размерности, запросы проецируются так же
+    projection = np.load(projection_path, mmap_mode='r') if projection_path.exists() else None
+    dim = mat.shape[1] if projection is None else projection.shape[1]
+    if index.d != dim or (projection is not None and projection.shape[0] != mat.shape[1]):
+        app.logger.warning("Размерность %s (%d) не совпадает с матрицей, индекс не используется", INDEX_FILE, index.d)
+        return None, None
+    return index, projection
+
+
+class MicroBatcher:
+    """
+    Объединяет запросы из разных HTTP-запросов в один пакет.
+    Фоновый поток ждёт первый запрос, добирает остальные в течение
+    max_delay секунд (но не больше max_batch) и считает их одним вызовом.
+    """
+    def __init__(self, search_fn, max_batch=MAX_BATCH, max_delay=BATCH_DELAY):
+        self.search_fn = search_fn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, vec, k):
+        """Поставить вектор запроса в очередь, вернуть Future с (scores, idxs)"""
+        future = Future()
+        self._queue.put((vec, k, future))
+        return future
+
+    def close(self):
+        """Остановить поток после обработки уже поставленных запросов"""
+        self._queue.put(None)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # остановка — после этого пакета
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            instrumentation.count("batches")
+            instrumentation.count("batched_queries", len(batch))
+            try:
+                k = max(item[1] for item in batch)
+                D, I = self.search_fn(np.vstack([item[0] for item in batch]), k)
+                for row, (_, item_k, future) in enumerate(batch):
+                    future.set_result((D[row, :item_k], I[row, :item_k]))
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
 
-mat = np.load(MAT_FILE)
-doc_ids = np.load(DOCIDS_FILE).tolist()
-index = faiss.read_index(INDEX_FILE)
-vocab = np.load(VOCAB_FILE, allow_pickle=True).tolist()
-term_to_idx = {t: i for i, t in enumerate(vocab)}
+
+class SearchState:
+    """
+    Все объекты поиска одной версии индекса. Запрос берёт состояние один раз
+    и работает только с ним, поэтому смена версии не смешивает старые и новые файлы.
+    Крупные массивы открыты через mmap: процессы сервера делят страницы файлов
+    в page cache и не держат собственных копий.
+    """
+    def __init__(self, previous=None):
+        # index_version.txt указывает на неизменяемую папку версии: все файлы
+        # читаются из неё, даже если тем временем публикуется следующая
+        self.version = read_index_version()
+        folder = index_folder(self.version)
+        # Матрица TF-IDF хранится разреженно (CSR) и открывается через mmap, словарь —
+        # отсортированная таблица с бинарным поиском: при запуске ничего не разбирается
+        self.mat, self.doc_ids, self.vocab = load_objects(mmap=True, folder=folder)
+        self.term_to_idx = term_index(self.vocab)
+        # FAISS-индекс необязателен (build_faiss_index.py): без него поиск идёт по разреженной матрице
+        self.index, self.projection = load_faiss_index(self.mat, folder)
+        self.postings = PostingsIndex.load(self.mat, folder=folder) if ENGINE == 'postings' else None
+        self.embeddings, self.embedding_doc_ids, meta = load_embeddings(folder) if HYBRID else (None, None, None)
+        self.encoder, self.encoder_key = None, None
+        if self.embeddings is not None:
+            # Модель кодировщика тяжёлая: при той же модели берём её из прежнего состояния
+            self.encoder_key = (meta['model'], meta['dim'])
+            if previous is not None and previous.encoder_key == self.encoder_key:
+                self.encoder = previous.encoder
+            else:
+                self.encoder = load_encoder(meta['model'], meta['dim'])
+        # Пачки батчинга ищутся тем же движком, что и одиночные запросы (search_batch):
+        # с ENGINE = 'postings' запросы пачки обходят списки по одному, общим
+        # умножением на матрицу пачка считается только при ENGINE = 'dense'.
+        # Поток батчинга не держит ссылку на состояние и останавливается вместе с ним
+        self.batcher = MicroBatcher(functools.partial(search_vectors, self.mat, self.index, self.projection,
+                                                      self.postings))
+        weakref.finalize(self, self.batcher.close)
+        # DocStore читает список документов при открытии: после загрузки новых
+        # страниц (изменился docs.idx) хранилище открывается заново
+        self.store, self.store_stamp = None, None
+        records = Path(STORE_DIR, RECORDS_FILE)
+        if SNIPPETS and records.exists():
+            st = records.stat()
+            self.store_stamp = (st.st_size, st.st_mtime_ns)
+            if previous is not None and previous.store is not None and previous.store_stamp == self.store_stamp:
+                self.store = previous.store
+            else:
+                self.store = DocStore(STORE_DIR)
+
+    def search_batch(self, vecs, k):
+        return search_vectors(self.mat, self.index, self.projection, self.postings, vecs, k)
+
+    @instrumentation.timed("snippets")
+    def snippets(self, query, hits):
+        """Сниппеты выдачи {doc_id: HTML} с выделенными терминами запроса; без хранилища — пусто"""
+        if self.store is None or not hits:
+            return {}
+        highlighter = QueryHighlighter(query)
+        result = {}
+        for doc_id, _ in hits:
+            text = self.store.get(doc_id)
+            if text is not None:
+                result[doc_id] = highlighter.snippet(text)
+        return result
+
+    @instrumentation.timed("build_query")
+    def build_query_vector(self, query):
+        """
+        Вектор запроса: веса найденных в словаре терминов, L2-нормированный.
+        Термины выделяет тот же анализатор, что при индексации, шаблоны
+        раскрываются по таблице словаря (query_weights).
+        :return: (вектор shape (1, V), индексы найденных терминов) или (None, [])
+        """
+        weights = query_weights(query, self.term_to_idx)
+        if not weights:
+            return None, []
+        found = list(weights)
+        vec = np.zeros(len(self.vocab), dtype=np.float32)
+        vec[found] = list(weights.values())
+        vec = vec.reshape(1, -1)
+        faiss.normalize_L2(vec)
+        return vec, found
+
+    def fuse_dense(self, queries, rankings, k):
+        """Объединить выдачи TF-IDF [(doc_id, score)] с плотным поиском по тем же запросам"""
+        with instrumentation.stage("encode_query"):
+            query_vecs = encode_texts(self.encoder, queries)
+        with instrumentation.stage("search_embeddings"):
+            scores, idxs = dense_search(self.embeddings, query_vecs, max(k, RRF_DEPTH))
+        fused = []
+        with instrumentation.stage("rrf"):
+            for ranked, row in zip(rankings, idxs):
+                dense_ids = [self.embedding_doc_ids[i] for i in row]
+                fused.append(rrf_fuse([[doc_id for doc_id, _ in ranked], dense_ids], k, RRF_K))
+        return fused
+
+
+_state = None
+_state_lock = threading.Lock()
+_state_checked = 0.0
+
+
+def current_state():
+    """
+    Текущее состояние поиска. Раз в RELOAD_INTERVAL секунд сверяется версия
+    индекса; новую версию загружает один поток, остальные запросы тем
+    временем обслуживаются прежней. Переключение — присваивание одной ссылки.
+    """
+    global _state, _state_checked
+    if _state is not None and time.monotonic() - _state_checked < RELOAD_INTERVAL:
+        return _state
+    if not _state_lock.acquire(blocking=_state is None):
+        return _state
+    try:
+        _state_checked = time.monotonic()
+        if _state is None:
+            _state = SearchState()
+        elif read_index_version() != _state.version:
+            try:
+                with instrumentation.stage("reload_index"):
+                    _state = SearchState(_state)
+                app.logger.info("Загружена версия индекса %s", _state.version)
+            except Exception:
+                # Недописанная или битая версия: продолжаем работать на прежней
+                app.logger.exception("Не удалось загрузить новую версию индекса")
+    finally:
+        _state_lock.release()
+    return _state
+
+
+cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_FILE)
 
 # --- Flask ---
 app = Flask(__name__)
+current_state()
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # Время всего запроса и число ответов по эндпоинту и коду
+    if 'request_start' in g:
+        endpoint = request.endpoint or 'unknown'
+        instrumentation.observe(f"http_{endpoint}", time.perf_counter() - g.request_start)
+        instrumentation.count(f"http_{endpoint}_{response.status_code}")
+    return response
+
 
 @app.route('/', methods=['GET', 'POST'])
 def search():
     results = []
     query = ''
     if request.method == 'POST':
+        state = current_state()
         query = request.form['query']
-        terms = query.strip().split()
-        vec = np.zeros(index.d, dtype=np.float32)
-        count = 0
-        for t in terms:
-            idx = term_to_idx.get(t)
-            if idx is not None:
-                vec[idx] = 1.0
-                count += 1
-        if count > 0:
-            vec /= count
-            vec = vec.reshape(1, -1)
-            faiss.normalize_L2(vec)
-            D, I = index.search(vec, 10)
-            results = [(doc_ids[i], float(score)) for score, i in zip(D[0], I[0])]
-
-    return render_template('index.html', results=results, query=query)
+        terms = query.split()
+        cached = cache.get(terms, 10)
+        vec = state.build_query_vector(query)[0] if cached is None else None
+        depth = max(10, RRF_DEPTH) if state.encoder is not None else 10
+        if cached is not None:
+            results = cached
+        elif vec is not None:
+            D, I = state.search_batch(vec, depth)
+            results = [(state.doc_ids[i], float(score)) for score, i in zip(D[0], I[0])
+                       if i >= 0 and np.isfinite(score)]
+        if cached is None and query.strip() and (vec is not None or state.encoder is not None):
+            if state.encoder is not None:
+                results = state.fuse_dense([query], [results], 10)[0]
+            cache.put(terms, 10, results)
+
+    snippets = state.snippets(query, results) if results else {}
+    with instrumentation.stage("render"):
+        return render_template('index.html', results=results, query=query, snippets=snippets)
+
+
+@app.route('/api/search', methods=['POST'])
+def api_search():
+    """
+    JSON API: {"queries": ["...", ...], "top_k": 10, "offset": 0, "snippets": false}
+    Ответ: {"results": [{"query": ..., "hits": [{"doc_id": ..., "score": ...}]}]};
+    с "snippets": true у каждого документа есть и "snippet" — HTML с <b> вокруг терминов
+    """
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify(error="тело запроса не разобрано как JSON (нужен Content-Type: application/json)"), 400
+    if not isinstance(payload, dict):
+        return jsonify(error="ожидается JSON-объект"), 400
+    queries = payload.get('queries')
+    if queries is None and 'query' in payload:
+        queries = [payload['query']]
+    top_k, offset = payload.get('top_k', 10), payload.get('offset', 0)
+    # Только целые JSON-числа: 1.7 и "3" не приводятся, bool — подкласс int, но не число документов
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in (top_k, offset)):
+        return jsonify(error="top_k и offset должны быть целыми"), 400
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify(error="ожидается список строк queries"), 400
+    if top_k < 1 or offset < 0 or offset + top_k > MAX_TOP_K:
+        return jsonify(error=f"нужно top_k >= 1, offset >= 0, offset + top_k <= {MAX_TOP_K}"), 400
+
+    state = current_state()
+    k = offset + top_k
+    depth = max(k, RRF_DEPTH) if state.encoder is not None else k
+    # Из кэша берём готовые выдачи на k документов, считаем только промахи
+    cached = [cache.get(q.split(), k) for q in queries]
+    vecs = [state.build_query_vector(q)[0] if hits is None else None
+            for q, hits in zip(queries, cached)]
+    known = [vec for vec in vecs if vec is not None]
+    if BATCHING:
+        futures = [state.batcher.submit(vec, depth) for vec in known]
+        # Ожидание включает задержку сбора пачки и сам поиск в потоке батчинга
+        with instrumentation.stage("batch_wait"):
+            batch_hits = [future.result() for future in futures]
+        hits_iter = iter(batch_hits)
+    elif known:
+        D, I = state.search_batch(np.vstack(known), depth)
+        hits_iter = iter(zip(D, I))
+    else:
+        hits_iter = iter(())
+
+    for pos, vec in enumerate(vecs):
+        if vec is not None:
+            scores, idxs = next(hits_iter)
+            cached[pos] = [(state.doc_ids[i], float(score)) for score, i in zip(scores, idxs)
+                           if i >= 0 and np.isfinite(score)]
+    # Плотный поиск находит документы и для запросов без терминов из словаря
+    missed = [pos for pos, (q, vec) in enumerate(zip(queries, vecs))
+              if vec is not None or (state.encoder is not None and cached[pos] is None and q.strip())]
+    if state.encoder is not None and missed:
+        fused = state.fuse_dense([queries[pos] for pos in missed], [cached[pos] or [] for pos in missed], k)
+        for pos, ranked in zip(missed, fused):
+            cached[pos] = ranked
+    for pos in missed:
+        cache.put(queries[pos].split(), k, cached[pos][:k])
+
+    results = []
+    for query, ranked in zip(queries, cached):
+        page = (ranked or [])[offset:k]
+        hits = [{'doc_id': doc_id, 'score': score} for doc_id, score in page]
+        if payload.get('snippets'):
+            snippets = state.snippets(query, page)
+            for hit in hits:
+                hit['snippet'] = snippets.get(hit['doc_id'], '')
+        results.append({'query': query, 'hits': hits})
+    return jsonify(results=results)
+
+
+@app.route('/api/cache/stats')
+def api_cache_stats():
+    """Статистика кэша результатов: попадания, промахи, вытеснения, версия индекса"""
+    return jsonify(cache.stats())
+
+
+_metrics_dir = None
+
+
+def dump_metrics():
+    """Записать снимок метрик и статистики кэша процесса в <папка>/<pid>.json"""
+    if _metrics_dir is not None:
+        instrumentation.dump(os.path.join(_metrics_dir, f'{os.getpid()}.json'), pid=os.getpid(), cache=cache.stats())
+
+
+def share_metrics(folder):
+    """
+    Суммировать /metrics по всем процессам, пишущим в folder. Файлы завершившихся
+    процессов остаются: их счётчики входят в сумму, и она не убывает при
+    перезапуске воркера. Размер кэша (gauge) берётся только у живых процессов.
+    """
+    global _metrics_dir
+    if not instrumentation.enabled():
+        return
+
+    def flush():
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            dump_metrics()
+
+    _metrics_dir = folder
+    dump_metrics()
+    threading.Thread(target=flush, daemon=True).start()
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect_metrics():
+    """Сводка таймеров и статистика кэша: этого процесса или всех процессов папки метрик"""
+    if _metrics_dir is None:
+        return instrumentation.snapshot(), cache.stats()
+    dump_metrics()
+    snapshots = []
+    for path in Path(_metrics_dir).glob('*.json'):
+        try:
+            snapshots.append(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            continue  # файл удалён или заменяется прямо сейчас
+    stats = {key: 0 for key in ('size', 'hits', 'misses', 'evictions', 'invalidations')}
+    for data in snapshots:
+        for key in stats:
+            if key != 'size' or process_alive(data['pid']):
+                stats[key] += data['cache'][key]
+    total = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / total if total else 0.0
+    return instrumentation.combine(snapshots), stats
+
+
+@app.route('/metrics')
+def metrics():
+    """Таймеры этапов, счётчики и состояние кэша в текстовом формате Prometheus"""
+    data, stats = collect_metrics()
+    lines = [instrumentation.prometheus('search', data)]
+    for key, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f"# TYPE search_result_cache_{key} gauge\nsearch_result_cache_{key} {value}\n")
+    return Response(''.join(lines), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Инкрементальная индексация: обрабатываются только новые, изменённые
+и удалённые HTML-документы из output/, без полного прохода по корпусу.
+
+Состояние между запусками:
+- index_manifest.json    # Режим матрицы (terms/lemmas) и для каждого HTML: размер, mtime и SHA-1
+- df_stats.json          # Число документов и частоты документов термов и лемм
+
+Для добавленных и изменённых документов заново создаются файлы токенов,
+лемм и TF-IDF (idf — по обновлённой статистике). Сохранённая матрица
+vector_search дополняется: старая строка документа помечается удалённой
+(tombstone), новая дописывается в конец, новые признаки — в конец vocab.
+Строки остальных документов сохраняют прежние idf; после крупных изменений
+стоит выполнить полную пересборку (vector_search.py --rebuild), она же
+убирает tombstones. Запуск с другим --mode, чем записан в манифесте,
+отклоняется: строки другого TF-IDF испортили бы матрицу. FAISS-индекс
+после обновления матрицы удаляется (save_objects) и строится заново.
+
+Первый запуск только снимает манифест и статистику с текущих файлов,
+поэтому перед ним должна быть выполнена полная сборка.
+
+Использование:
+    python incremental.py [--mode terms|lemmas]
+"""
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+import doc_store
+import tf_idf
+import tfidf_binary
+import tokens_lemmas
+from vector_search import (TFIDF_TERMS_DIR, TFIDF_LEMMAS_DIR, CSRMatrix,
+                           load_objects, read_tfidf_file, rows_to_matrix, save_objects)
+
+MANIFEST_FILE = 'index_manifest.json'
+DF_STATS_FILE = 'df_stats.json'
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def scan_output(manifest):
+    """
+    Текущее состояние output/: {filename: {size, mtime, sha1}}.
+    Хэш пересчитывается только для файлов с изменившимися размером или mtime.
+    """
+    state = {}
+    for filename in os.listdir(tf_idf.output_folder):
+        if not filename.endswith('.html'):
+            continue
+        st = os.stat(os.path.join(tf_idf.output_folder, filename))
+        old = manifest.get(filename)
+        if old and old['size'] == st.st_size and old['mtime'] == st.st_mtime_ns:
+            state[filename] = old
+        else:
+            state[filename] = {'size': st.st_size, 'mtime': st.st_mtime_ns,
+                               'sha1': file_hash(os.path.join(tf_idf.output_folder, filename))}
+    return state
+
+
+def doc_files(filename):
+    """Пути ко всем производным файлам документа"""
+    base = filename.replace('.html', '')
+    return {
+        'tokens': os.path.join(tokens_lemmas.tokens_folder, f"{base}_tokens.txt"),
+        'lemmas': os.path.join(tokens_lemmas.lemmas_folder, f"{base}_lemmas.txt"),
+        'terms_tfidf': os.path.join(tf_idf.tf_idf_terms_folder, f"{base}_tfidf_terms.txt"),
+        'lemmas_tfidf': os.path.join(tf_idf.tf_idf_lemmas_folder, f"{base}_tfidf_lemmas.txt"),
+    }
+
+
+def read_doc_terms(filename):
+    """Множество термов документа по его файлу TF-IDF"""
+    path = doc_files(filename)['terms_tfidf']
+    return set(read_tfidf_file(Path(path))) if os.path.exists(path) else set()
+
+
+def read_doc_lemmas(filename):
+    path = doc_files(filename)['lemmas']
+    return set(tf_idf.read_lemma_file(path)) if os.path.exists(path) else set()
+
+
+def load_json(path):
+    if not Path(path).exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_json(path, obj):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+
+def read_manifest():
+    """
+    :return: (режим матрицы, {filename: {size, mtime, sha1}}) или (None, None) до первого запуска;
+             у манифеста прежнего формата (только файлы) режим None
+    """
+    manifest = load_json(MANIFEST_FILE)
+    if manifest is None or 'files' not in manifest:
+        return None, manifest
+    return manifest['mode'], manifest['files']
+
+
+def save_manifest(mode, files):
+    save_json(MANIFEST_FILE, {'mode': mode, 'files': files})
+
+
+def bootstrap(mode):
+    """Снять манифест и статистику df с уже построенных файлов"""
+    state = scan_output({})
+    token_df, lemma_df = Counter(), Counter()
+    for filename in state:
+        token_df.update(read_doc_terms(filename))
+        lemma_df.update(read_doc_lemmas(filename))
+    save_manifest(mode, state)
+    save_json(DF_STATS_FILE, {'N': len(state), 'token_df': token_df, 'lemma_df': lemma_df})
+    print(f"Снят исходный манифест: {len(state)} документов")
+
+
+def patch_matrix(mode, removed, updated):
+    """
+    Обновить сохранённую матрицу без полной пересборки.
+    :param removed: doc_id, чьи строки помечаются удалёнными
+    :param updated: doc_id, чьи новые строки дописываются в конец
+    """
+    mat, doc_ids, vocab = load_objects()
+    if mat is None:
+        print("Сохранённая матрица не найдена, обновление матрицы пропущено")
+        return
+    row_of = {doc: i for i, doc in enumerate(doc_ids)}  # последняя (живая) строка документа
+    deleted = mat.deleted.copy() if mat.deleted is not None else np.zeros(mat.shape[0], dtype=bool)
+    for doc in removed:
+        if doc in row_of:
+            deleted[row_of[doc]] = True
+
+    folder = Path(TFIDF_TERMS_DIR if mode == 'terms' else TFIDF_LEMMAS_DIR)
+    term_to_idx = {t: i for i, t in enumerate(vocab)}
+    rows = []
+    for doc in updated:
+        path = folder / f"{doc}_tfidf_{mode}.txt"
+        row = read_tfidf_file(path) if path.exists() else {}
+        for term in row:
+            if term not in term_to_idx:
+                term_to_idx[term] = len(vocab)
+                vocab.append(term)
+        rows.append(row)
+
+    mat = CSRMatrix(mat.indptr, mat.indices, mat.data, len(vocab), deleted)
+    mat = mat.append(rows_to_matrix(rows, term_to_idx))
+    save_objects(mat, doc_ids + list(updated), vocab)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['terms','lemmas'], default='terms',
+                        help="какой TF-IDF лежит в сохранённой матрице")
+    args = parser.parse_args()
+
+    mode, manifest = read_manifest()
+    if manifest is None:
+        bootstrap(args.mode)
+        return
+    if mode is not None and mode != args.mode:
+        raise SystemExit(f"Матрица обновлялась с --mode {mode}, а запуск с --mode {args.mode}. "
+                         f"Запустите с --mode {mode} или пересоберите матрицу "
+                         f"(vector_search.py --mode {args.mode} --rebuild) и удалите {MANIFEST_FILE}")
+
+    state = scan_output(manifest)
+    added = sorted(state.keys() - manifest.keys())
+    deleted = sorted(manifest.keys() - state.keys())
+    changed = sorted(f for f in state.keys() & manifest.keys() if state[f]['sha1'] != manifest[f]['sha1'])
+    if not (added or deleted or changed):
+        save_manifest(args.mode, state)
+        print("Изменений нет")
+        return
+
+    stats = load_json(DF_STATS_FILE)
+    token_df, lemma_df = Counter(stats['token_df']), Counter(stats['lemma_df'])
+
+    # Убираем вклад старых версий документов в df
+    for filename in changed + deleted:
+        token_df.subtract(read_doc_terms(filename))
+        lemma_df.subtract(read_doc_lemmas(filename))
+    for filename in deleted:
+        for path in doc_files(filename).values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Токены, леммы и счётчики только для новых версий
+    os.makedirs(tokens_lemmas.tokens_folder, exist_ok=True)
+    os.makedirs(tokens_lemmas.lemmas_folder, exist_ok=True)
+    tf_idf.ensure_directories()
+    doc_store.ingest(tf_idf.output_folder)
+    token_counts, lemma_maps = {}, {}
+    for filename in added + changed:
+        tokens_lemmas.process_document(filename)
+        _, token_counts[filename] = tf_idf.count_tokens(filename)
+        lemma_maps[filename] = tf_idf.read_lemma_file(doc_files(filename)['lemmas'])
+        token_df.update(token_counts[filename].keys())
+        lemma_df.update(lemma_maps[filename].keys())
+    token_df, lemma_df = +token_df, +lemma_df  # убрать нулевые частоты
+    N = stats['N'] + len(added) - len(deleted)
+
+    for filename in added + changed:
+        doc_id = filename.replace('.html', '')
+        tf_idf.write_terms_tfidf(filename, token_counts[filename], N, token_df)
+        tf_idf.write_lemmas_tfidf(doc_id, token_counts[filename], lemma_maps[filename], N, lemma_df)
+    # Бинарный артефакт tf_idf.py --binary обновляется только полным пересчётом
+    for kind in ('terms', 'lemmas'):
+        tfidf_binary.remove(os.path.join(tf_idf.tf_idf_binary_folder, kind))
+
+    patch_matrix(args.mode,
+                 removed=[f.replace('.html', '') for f in changed + deleted],
+                 updated=[f.replace('.html', '') for f in added + changed])
+
+    save_manifest(args.mode, state)
+    save_json(DF_STATS_FILE, {'N': N, 'token_df': token_df, 'lemma_df': lemma_df})
+    print(f"Добавлено: {len(added)}, изменено: {len(changed)}, удалено: {len(deleted)}")
+
+
+if __name__ == '__main__':
+    main()
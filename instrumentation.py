@@ -0,0 +1,260 @@
+"""
+Лёгкие таймеры и счётчики этапов конвейера и поиска.
+
+По умолчанию выключены: stage() возвращает общий пустой контекстный
+менеджер, count() и observe() сразу выходят, обёртка timed() вызывает
+функцию напрямую, поэтому в горячих циклах остаётся только вызов
+функции. Включаются enable() или флагом --profile у скриптов
+(profile_to), в flask_app — константой METRICS.
+
+Этапы вкладываются друг в друга: для каждого потока ведётся стек имён,
+и собственное время этапа (без вложенных) накапливается по пути стека.
+Из этого получается файл в свёрнутом формате flame graph
+(«a;b;c <микросекунды>», читают flamegraph.pl, speedscope, inferno).
+
+Воркеры multiprocessing.Pool копируют состояние родителя при fork: в
+инициализаторе пула вызывается init_worker(), а накопленное воркером
+возвращается вместе с результатом через drain() и сводится merge().
+Независимые процессы (воркеры serve.py) пишут снимки в файлы dump(),
+а их сумму даёт combine().
+"""
+import atexit
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+# Границы корзин гистограмм /metrics, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_worker = False
+_profiler = None
+_lock = threading.Lock()
+_local = threading.local()
+_timers = {}    # этап -> [число вызовов, сумма секунд, счётчики корзин]
+_stacks = {}    # 'внешний;вложенный' -> собственное время, секунды
+_counters = {}  # имя -> значение
+_NULL = nullcontext()
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _stacks.clear()
+        _counters.clear()
+
+
+class _Stage:
+    __slots__ = ('name', 'start', 'children')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.children = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        path = ';'.join(s.name for s in stack)
+        stack.pop()
+        if stack:
+            stack[-1].children += elapsed
+        with _lock:
+            _record(self.name, elapsed)
+            _stacks[path] = _stacks.get(path, 0.0) + elapsed - self.children
+        return False
+
+
+def _record(name, seconds):
+    timer = _timers.get(name)
+    if timer is None:
+        timer = _timers[name] = [0, 0.0, [0] * (len(BUCKETS) + 1)]
+    timer[0] += 1
+    timer[1] += seconds
+    timer[2][bisect_left(BUCKETS, seconds)] += 1
+
+
+def stage(name):
+    """Контекстный менеджер, измеряющий этап name (пустой, если выключено)"""
+    return _Stage(name) if _enabled else _NULL
+
+
+def timed(name):
+    """Декоратор: вызов функции — этап name (выключено — лишь одна проверка флага)"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name, seconds):
+    """Длительность, измеренная снаружи (например, всего HTTP-запроса)"""
+    if _enabled:
+        with _lock:
+            _record(name, seconds)
+
+
+def count(name, value=1):
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    with _lock:
+        return {'timers': {name: [t[0], t[1], list(t[2])] for name, t in _timers.items()},
+                'stacks': dict(_stacks), 'counters': dict(_counters)}
+
+
+def init_worker():
+    """Инициализатор воркера пула: сбросить копию данных родителя и его профилировщик"""
+    global _worker
+    _worker = True
+    reset()
+    if _profiler is not None:
+        _profiler.disable()
+
+
+def drain():
+    """
+    В воркере пула — накопленное с прошлого вызова (и обнулить), в основном
+    процессе — None: там данные и так попадают в общий реестр.
+    """
+    if not (_enabled and _worker):
+        return None
+    data = snapshot()
+    reset()
+    return data
+
+
+def _add(timers, stacks, counters, data):
+    for name, (calls, total, buckets) in data['timers'].items():
+        timer = timers.setdefault(name, [0, 0.0, [0] * (len(BUCKETS) + 1)])
+        timer[0] += calls
+        timer[1] += total
+        timer[2] = [a + b for a, b in zip(timer[2], buckets)]
+    for path, seconds in data['stacks'].items():
+        stacks[path] = stacks.get(path, 0.0) + seconds
+    for name, value in data['counters'].items():
+        counters[name] = counters.get(name, 0) + value
+
+
+def merge(data):
+    """Добавить данные, полученные от воркера через drain()"""
+    if not data:
+        return
+    with _lock:
+        _add(_timers, _stacks, _counters, data)
+
+
+def dump(path, **extra):
+    """
+    Атомарно записать snapshot() процесса (и extra) в JSON-файл path.
+    Процесс перезаписывает свой файл целиком, поэтому читатель видит
+    последний полный снимок.
+    """
+    data = snapshot()
+    data.update(extra)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def combine(snapshots):
+    """Сумма снимков нескольких процессов (dump) в формате snapshot()"""
+    timers, stacks, counters = {}, {}, {}
+    for data in snapshots:
+        _add(timers, stacks, counters, data)
+    return {'timers': timers, 'stacks': stacks, 'counters': counters}
+
+
+def format_report():
+    """Таблица этапов по убыванию суммарного времени и значения счётчиков"""
+    data = snapshot()
+    lines = [f"{'этап':<24} {'вызовов':>9} {'всего, с':>10} {'среднее, мс':>12}"]
+    for name, (calls, total, _) in sorted(data['timers'].items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name:<24} {calls:>9} {total:>10.3f} {total / calls * 1000:>12.3f}")
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f"{name:<24} {value:>9}")
+    return '\n'.join(lines)
+
+
+def write_folded(path):
+    """Собственное время путей стека в микросекундах, формат flamegraph.pl"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, seconds in sorted(snapshot()['stacks'].items()):
+            micros = int(round(seconds * 1e6))
+            if micros > 0:
+                f.write(f"{stack.replace(' ', '_')} {micros}\n")
+
+
+def prometheus(prefix='search', data=None):
+    """
+    Метрики в текстовом формате Prometheus: гистограммы этапов и счётчики
+    этого процесса или data — например, сводки combine()
+    """
+    if data is None:
+        data = snapshot()
+    name = f'{prefix}_stage_seconds'
+    lines = [f'# HELP {name} Длительность этапов обработки', f'# TYPE {name} histogram']
+    for stage_name, (calls, total, buckets) in sorted(data['timers'].items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ('+Inf',), buckets):
+            cumulative += n
+            lines.append(f'{name}_bucket{{stage="{stage_name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{stage="{stage_name}"}} {total:.6f}')
+        lines.append(f'{name}_count{{stage="{stage_name}"}} {calls}')
+    for counter, value in sorted(data['counters'].items()):
+        lines += [f'# TYPE {prefix}_{counter}_total counter', f'{prefix}_{counter}_total {value}']
+    return '\n'.join(lines) + '\n'
+
+
+def profile_to(path):
+    """
+    Включает таймеры и cProfile до конца процесса. При выходе пишет path
+    (статистика cProfile: pstats, snakeviz, flameprof), рядом — path
+    с расширением .folded (этапы для flame graph) и печатает таблицу этапов
+    в stderr. cProfile видит только основной процесс, таймеры — и воркеров.
+    """
+    global _profiler
+    enable()
+    profiler = _profiler = cProfile.Profile()
+
+    def finish():
+        profiler.disable()
+        profiler.dump_stats(path)
+        folded = os.path.splitext(path)[0] + '.folded'
+        write_folded(folded)
+        print(format_report(), file=sys.stderr)
+        print(f"Профиль: {path}, этапы для flame graph: {folded}", file=sys.stderr)
+
+    atexit.register(finish)
+    profiler.enable()
@@ -0,0 +1,95 @@
+"""
+Кэш лемматизации: словоформа -> нормальная форма (pymorphy2).
+
+Одни и те же словоформы повторяются по всему корпусу, поэтому разбор
+pymorphy2 нужен только при первом появлении формы. В памяти держится
+ограниченный LRU-кэш; при указании файла найденные формы сохраняются
+в SQLite и переиспользуются следующими запусками и поиском по запросам.
+"""
+import sqlite3
+from collections import Counter, OrderedDict
+
+import pymorphy2
+
+
+class LemmaCache:
+    def __init__(self, maxsize=100_000, path=None, morph=None, flush_every=1000):
+        """
+        :param maxsize: максимальное число форм в памяти
+        :param path: файл SQLite для хранения между запусками (None — только память)
+        :param morph: готовый pymorphy2.MorphAnalyzer (иначе создаётся при первом промахе)
+        :param flush_every: сколько новых форм копить перед записью на диск
+        """
+        self.maxsize = maxsize
+        self.flush_every = flush_every
+        self._morph = morph
+        self._cache = OrderedDict()
+        self._pending = []
+        self._db = None
+        self.hits = 0       # найдено в памяти
+        self.disk_hits = 0  # найдено в SQLite
+        self.misses = 0     # потребовался разбор pymorphy2
+        if path:
+            self._db = sqlite3.connect(path, timeout=30)
+            self._db.execute("CREATE TABLE IF NOT EXISTS lemmas (form TEXT PRIMARY KEY, lemma TEXT NOT NULL)")
+            self._db.commit()
+
+    @property
+    def morph(self):
+        if self._morph is None:
+            self._morph = pymorphy2.MorphAnalyzer()
+        return self._morph
+
+    def normal_form(self, word):
+        """Нормальная форма слова с учётом кэша"""
+        lemma = self._cache.get(word)
+        if lemma is not None:
+            self._cache.move_to_end(word)
+            self.hits += 1
+            return lemma
+
+        lemma = self._lookup_disk(word)
+        if lemma is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            lemma = self.morph.parse(word)[0].normal_form
+            if self._db is not None:
+                self._pending.append((word, lemma))
+                if len(self._pending) >= self.flush_every:
+                    self.flush()
+
+        self._cache[word] = lemma
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return lemma
+
+    def _lookup_disk(self, word):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT lemma FROM lemmas WHERE form = ?", (word,)).fetchone()
+        return row[0] if row else None
+
+    def flush(self):
+        """Записать накопленные формы в SQLite"""
+        if self._db is None or not self._pending:
+            return
+        self._db.executemany("INSERT OR IGNORE INTO lemmas (form, lemma) VALUES (?, ?)", self._pending)
+        self._db.commit()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        return Counter(hits=self.hits, disk_hits=self.disk_hits, misses=self.misses)
+
+
+def format_stats(stats):
+    total = sum(stats.values())
+    ratio = (stats['hits'] + stats['disk_hits']) / total if total else 0.0
+    return (f"Кэш лемм: в памяти {stats['hits']}, с диска {stats['disk_hits']}, "
+            f"промахов {stats['misses']} (доля попаданий {ratio:.1%})")
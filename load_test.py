@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест /api/search: QPS и хвостовые задержки с микробатчингом
+и без него.
+
+Приложение поднимается в этом же процессе (многопоточный сервер werkzeug),
+клиенты — потоки с отдельными HTTP-сессиями. Нужны файлы матрицы,
+doc_ids.npy и vocab.npy (см. vector_search.py).
+
+Использование:
+    python load_test.py [--requests N] [--concurrency C] [--queries-per-request Q] [--top-k K]
+"""
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+
+import flask_app
+
+
+def run_mode(url, batching, payloads, concurrency):
+    flask_app.BATCHING = batching
+    local = threading.local()
+
+    def call(payload):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.post(url, json=payload, timeout=30)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(call, payloads))
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    return len(payloads) / elapsed, np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--queries-per-request', type=int, default=1)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vocab = flask_app.current_state().vocab
+
+    def random_query():
+        return ' '.join(vocab[i] for i in rng.integers(0, len(vocab), size=rng.integers(1, 4)))
+
+    payloads = [{'queries': [random_query() for _ in range(args.queries_per_request)], 'top_k': args.top_k}
+                for _ in range(args.requests)]
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/api/search'
+    try:
+        engine = 'faiss' if flask_app.current_state().index is not None else flask_app.ENGINE
+        print(f"{args.requests} запросов, {args.concurrency} клиентов, "
+              f"{args.queries_per_request} запрос(ов) в каждом, движок {engine}")
+        for name, batching in (('без батчинга', False), ('микробатчинг', True)):
+            qps, p50, p99 = run_mode(url, batching, payloads, args.concurrency)
+            print(f"{name:>13}: {qps:8.1f} req/s  p50={p50:.2f} мс  p99={p99:.2f} мс")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Кэш результатов поиска с учётом версии индекса.
+
+Ключ — нормализованный запрос (отсортированные уникальные токены, которые
+выделяет из запроса поиск: анализатор analyzer и шаблоны с * или ?) и top_k.
+Версия индекса (хэш содержимого файлов) записывается vector_search при
+сохранении и входит в ключ, поэтому после пересборки старые записи
+перестают находиться, а локальный кэш очищается при смене версии.
+
+В памяти держится LRU с ограничением по размеру и времени жизни записей.
+При указании файла SQLite записи разделяются между процессами
+(например, воркерами веб-сервера). Таблица ограничена так же: каждые
+PRUNE_EVERY записей удаляются устаревшие по ttl и самые старые сверх maxsize.
+Записи прежних версий уходят тем же путём, а не разом при смене версии:
+во время переключения часть воркеров ещё отвечает по прежней версии и
+пользуется её записями.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import analyzer
+from binary_index import is_pattern
+from vector_search import VERSION_FILE, read_index_version
+
+PRUNE_EVERY = 100  # записей в SQLite между очистками таблицы
+
+
+def normalize_query(terms):
+    """
+    Нормализованный вид запроса из тех же токенов, что берёт query_weights:
+    слова через analyzer.query_tokens и шаблоны в нижнем регистре. Запросы,
+    которые поиск не различает («Река», «река,», «и река»), дают один ключ.
+    Запрос без таких токенов (одни стоп-слова, латиница) находит только
+    плотный поиск по исходному тексту, поэтому ключом служит сам текст.
+    """
+    patterns = {word.lower() for word in terms if is_pattern(word)}
+    tokens = patterns.union(analyzer.query_tokens(' '.join(word for word in terms if not is_pattern(word))))
+    return ' '.join(sorted(tokens)) if tokens else ' '.join(terms).lower()
+
+
+class ResultCache:
+    def __init__(self, maxsize=10_000, ttl=3600, path=None, version_file=VERSION_FILE):
+        """
+        :param maxsize: число записей в памяти
+        :param ttl: время жизни записи, с
+        :param path: файл SQLite для общего кэша процессов (None — только память)
+        :param version_file: файл с версией индекса
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_file = version_file
+        self._entries = OrderedDict()  # key -> (created, value)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, created REAL NOT NULL, value TEXT NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+            self._db.commit()
+        self._puts = 0
+        self._version_mtime = None
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self):
+        """Сбросить локальный кэш, если файл версии изменился (stat на каждый вызов)"""
+        try:
+            mtime = os.stat(self.version_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._version_mtime:
+            return
+        self._version_mtime = mtime
+        version = read_index_version(self.version_file)
+        if version != self.version:
+            if self.version is not None:
+                self.invalidations += 1
+            self.version = version
+            self._entries.clear()
+
+    def _key(self, terms, top_k):
+        return f"{self.version}|{top_k}|{normalize_query(terms)}"
+
+    def get(self, terms, top_k):
+        """Сохранённый результат или None"""
+        with self._lock:
+            self._check_version()
+            key = self._key(terms, top_k)
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if self._db is not None:
+                row = self._db.execute("SELECT created, value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[0] <= self.ttl:
+                    value = json.loads(row[1])
+                    self._store(key, row[0], value)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, terms, top_k, value):
+        """Сохранить результат (value должен сериализоваться в JSON для общего кэша)"""
+        with self._lock:
+            self._check_version()
+            key = self._key(terms, top_k)
+            now = time.time()
+            self._store(key, now, value)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO results (key, created, value) VALUES (?, ?, ?)",
+                                 (key, now, json.dumps(value, ensure_ascii=False)))
+                self._puts += 1
+                if self._puts % PRUNE_EVERY == 0:
+                    self._prune(now)
+                self._db.commit()
+
+    def _prune(self, now):
+        """Удалить из SQLite записи старше ttl и самые старые сверх maxsize"""
+        self._db.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        self._db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results "
+                         "ORDER BY created DESC LIMIT -1 OFFSET ?)", (self.maxsize,))
+
+    def _store(self, key, created, value):
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'version': self.version,
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -1,16 +1,134 @@
 import re
+import heapq
+import argparse
+from array import array
+from bisect import bisect_left
 from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+import analyzer
+import instrumentation
+from binary_index import MAX_EXPANSIONS, MIN_PREFIX, BinaryIndex, is_pattern, split_pattern, write_binary_index
+from vector_search import TFIDF_LEMMAS_DIR, PostingsIndex, build_matrix, load_tfidf
+
+QUERY_TOKEN_RE = re.compile(r'\(|\)|[\w*?]+')
+
+
+class _QueryParser:
+    """
+    Рекурсивный спуск по грамматике:
+        or_expr  := and_expr (OR and_expr)*
+        and_expr := unary ((AND | NOT | <пусто>) unary)*
+        unary    := NOT unary | atom
+        atom     := слово | шаблон | '(' or_expr ')'
+    Шаблон — слово с * (любая строка) или ? (один символ): «технолог*».
+    """
+    def __init__(self, query):
+        self.tokens = QUERY_TOKEN_RE.findall(query)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos >= len(self.tokens):
+            return None
+        token = self.tokens[self.pos]
+        return token.upper() if token.upper() in ('AND', 'OR', 'NOT') else token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise ValueError("Лишняя закрывающая скобка в запросе")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.pos += 1
+            children.append(self.parse_and())
+        return _combine('or', children)
+
+    def parse_and(self):
+        children = [self.parse_unary()]
+        while True:
+            token = self.peek()
+            if token == 'AND':
+                self.pos += 1
+            elif token is None or token in ('OR', ')'):
+                break
+            # 'x NOT y' и соседние слова — это тоже AND
+            children.append(self.parse_unary())
+        return _combine('and', children)
+
+    def parse_unary(self):
+        if self.peek() == 'NOT':
+            self.pos += 1
+            operand = self.parse_unary()
+            return ('not', operand) if operand is not None else None
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.peek()
+        if token is None or token in ('AND', 'OR', ')'):
+            # Оператор без операнда игнорируется
+            return None
+        self.pos += 1
+        if token == '(':
+            node = self.parse_or()
+            if self.peek() != ')':
+                raise ValueError("Незакрытая скобка в запросе")
+            self.pos += 1
+            return node
+        return ('pattern' if is_pattern(token) else 'term', token.lower())
+
+
+def _combine(kind, children):
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else (kind, children)
+
+
+def positive_terms(node):
+    """Термины запроса, не стоящие под NOT — только они влияют на ранжирование"""
+    if node is None or node[0] == 'not':
+        return []
+    if node[0] == 'term':
+        return [node[1]]
+    return [term for child in node[1] for term in positive_terms(child)]
+
+
+@instrumentation.timed("parse_query")
+def parse_query(query):
+    """
+    Разбирает булев запрос в дерево с приоритетом NOT > AND > OR.
+    'x NOT y' означает 'x AND NOT y', соседние слова соединяются AND.
+    :param query: поисковый запрос с операторами
+    :return: узел ('term', слово) | ('pattern', шаблон) | ('not', узел) | ('and', [узлы]) | ('or', [узлы])
+             или None
+    :raises ValueError: при несбалансированных скобках
+    """
+    return _QueryParser(query).parse()
+
 
 class BooleanSearchEngine:
     """
     Класс для реализации булева поиска по инвертированному индексу.
     Поддерживает операторы AND, OR, NOT и сложные запросы со скобками.
+
+    Документам присваиваются плотные номера, списки документов хранятся как
+    отсортированные массивы целых (array('I')) и пересекаются без множеств.
     """
     def __init__(self):
-        # Инвертированный индекс: слово -> множество документов
-        self.index = defaultdict(set)
+        # Инвертированный индекс: слово -> отсортированные номера документов
+        self.index = defaultdict(lambda: array('I'))
         # Хранилище документов: doc_id -> текст документа
         self.documents = {}
+        # Номер документа -> doc_id и обратно
+        self.doc_ids = []
+        self._doc_nums = {}
+        # Отсортированный словарь для шаблонов; строится при первом шаблоне
+        self._sorted_terms = None
     
     def add_document(self, doc_id, text):
         """
@@ -19,9 +137,21 @@ class BooleanSearchEngine:
         :param text: текст документа для индексации
         """
         self.documents[doc_id] = text
+        num = self._doc_nums.get(doc_id)
+        if num is None:
+            num = self._doc_nums[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+        self._sorted_terms = None
         # Разбиваем текст на слова и добавляем в индекс
-        for word in self._tokenize(text):
-            self.index[word].add(doc_id)
+        for word in set(self._tokenize(text)):
+            postings = self.index[word]
+            if not postings or postings[-1] < num:
+                postings.append(num)
+            else:
+                # Повторное добавление уже известного документа: сохраняем порядок
+                i = bisect_left(postings, num)
+                if i == len(postings) or postings[i] != num:
+                    postings.insert(i, num)
     
     def _tokenize(self, text):
         """
@@ -31,82 +161,168 @@ class BooleanSearchEngine:
         """
         return re.findall(r'\w+', text.lower())
     
+    @instrumentation.timed("boolean_search")
     def search(self, query):
         """
         Выполняет булев поиск по запросу.
+        Индекс при вычислении не изменяется, поэтому поиск можно
+        вызывать из нескольких потоков одновременно.
         :param query: поисковый запрос с операторами
         :return: множество doc_id соответствующих документов
+        :raises ValueError: при несбалансированных скобках
         """
-        # Обработка вложенных скобок рекурсивно
-        while '(' in query:
-            query = re.sub(r'\(([^()]+)\)', lambda m: self._process_group(m.group(1)), query)
-        
-        # Разбиваем запрос на токены (операторы и слова)
-        tokens = re.findall(r'AND|OR|NOT|\w+', query, re.IGNORECASE)
-        
-        if not tokens:
+        node = parse_query(query)
+        if node is None:
             return set()
-        
-        # Обработка NOT в начале запроса
-        if tokens[0].upper() == 'NOT':
-            if len(tokens) < 2:
-                return set()
-            return self._not_operation(self._get_docs(tokens[1]))
-        
-        # Начинаем с первого термина
-        result = self._get_docs(tokens[0])
-        
-        # Обрабатываем последующие операторы и термины
-        for i in range(1, len(tokens), 2):
-            if i+1 >= len(tokens):
-                break
-                
-            operator = tokens[i].upper()
-            term = tokens[i+1]
-            docs = self._get_docs(term)
-            
-            if operator == 'AND':
-                result = self._and_operation(result, docs)
-            elif operator == 'OR':
-                result = self._or_operation(result, docs)
-            elif operator == 'NOT':
-                result = self._and_operation(result, self._not_operation(docs))
-        
-        return result
-    
-    def _process_group(self, group_query):
+        node = self._expand_patterns(node)
+        return {self._doc_id(num) for num in self._evaluate(node)}
+
+    def ranked_search(self, query, ranker, top_k=10):
         """
-        Обрабатывает подзапрос в скобках.
-        :param group_query: подзапрос внутри скобок
-        :return: временный ключ для замены группы
+        Булев запрос отбирает документы, веса TF-IDF ранжируют их.
+        Результаты выдаются лениво, по убыванию score.
+        :param query: поисковый запрос с операторами
+        :param ranker: объект TfidfRanker
+        :param top_k: максимальное число результатов
+        :return: генератор пар (doc_id, score)
         """
-        group_result = self.search(group_query)
-        key = f"GROUP_{abs(hash(group_query))}"
-        self.index[key] = group_result
-        return key
-    
-    def _get_docs(self, term):
+        node = parse_query(query)
+        if node is None:
+            return
+        node = self._expand_patterns(node)
+        # Этап не охватывает yield: иначе стек этапов потока зависел бы от потребителя
+        with instrumentation.stage("boolean_search"):
+            candidates = [self._doc_id(num) for num in self._evaluate(node)]
+        yield from ranker.rank(candidates, positive_terms(node), top_k)
+
+    def _expand_patterns(self, node):
         """
-        Возвращает документы для термина или группы.
-        :param term: слово или ключ группы
-        :return: множество doc_id
+        Заменяет шаблоны дерева запроса на OR подходящих термов словаря.
+        Раскрытые термы ранжируются как обычные термины запроса.
         """
-        if term.startswith('GROUP_'):
-            return self.index.get(term, set())
-        return self.index.get(term.lower(), set())
-    
-    def _and_operation(self, set1, set2):
-        """Логическое И (пересечение множеств)"""
-        return set1 & set2
+        kind = node[0]
+        if kind == 'term':
+            return node
+        if kind == 'pattern':
+            with instrumentation.stage("expand_pattern"):
+                return ('or', [('term', term) for term in self._expand(node[1])])
+        if kind == 'not':
+            return ('not', self._expand_patterns(node[1]))
+        return (kind, [self._expand_patterns(child) for child in node[1]])
+
+    def _expand(self, pattern, limit=MAX_EXPANSIONS):
+        """
+        Термы словаря под шаблон: диапазон литерального префикса ищется
+        бинарным поиском в отсортированном словаре, из подходящих остаются
+        limit самых частых (при равном df — раньше по алфавиту).
+        """
+        prefix, regex = split_pattern(pattern)
+        if len(prefix) < MIN_PREFIX:
+            return []
+        terms = self._sorted_terms
+        if terms is None:
+            terms = self._sorted_terms = sorted(term for term, nums in self.index.items() if nums)
+        lo = bisect_left(terms, prefix)
+        # '\U0010ffff' — наибольший символ: все термы с префиксом меньше prefix + он
+        hi = bisect_left(terms, prefix + '\U0010ffff', lo)
+        matched = [term for term in terms[lo:hi] if regex is None or regex.fullmatch(term)]
+        if len(matched) > limit:
+            matched = sorted(heapq.nsmallest(limit, matched, key=lambda term: -self._df(term)))
+        return matched
+
+    def _evaluate(self, node):
+        """
+        Вычисляет узел дерева запроса над номерами документов.
+        :return: отсортированный массив номеров документов
+        """
+        kind = node[0]
+        if kind == 'term':
+            return self._postings(node[1])
+        if kind == 'not':
+            return self._not_operation(self._evaluate(node[1]))
+        if kind == 'or':
+            result = self._empty()
+            for child in node[1]:
+                result = self._or_operation(result, self._evaluate(child))
+            return result
+
+        # AND: сначала самые короткие списки, отрицания — в конце как фильтр
+        positive = [child for child in node[1] if child[0] != 'not']
+        negative = [child[1] for child in node[1] if child[0] == 'not']
+        if not positive:
+            # NOT a AND NOT b = NOT (a OR b)
+            return self._not_operation(self._evaluate(('or', negative)))
+        positive.sort(key=self._estimate)
+        result = self._evaluate(positive[0])
+        for child in positive[1:]:
+            if len(result) == 0:
+                return result
+            result = self._and_operation(result, self._evaluate(child))
+        for child in negative:
+            if len(result) == 0:
+                break
+            result = self._and_not_operation(result, self._evaluate(child))
+        return result
+
+    def _estimate(self, node):
+        """Оценка размера результата узла для упорядочивания AND"""
+        kind = node[0]
+        if kind == 'term':
+            return self._df(node[1])
+        if kind == 'not':
+            return self._n_docs() - self._estimate(node[1])
+        sizes = [self._estimate(child) for child in node[1]]
+        return min(sizes) if kind == 'and' else min(sum(sizes), self._n_docs())
+
+    def _df(self, term):
+        """Число документов терма"""
+        return len(self.index.get(term, ()))
+
+    def _postings(self, term):
+        """Список документов терма как массив NumPy без копирования"""
+        postings = self.index.get(term)
+        if not postings:
+            return self._empty()
+        return np.frombuffer(postings, dtype=np.uint32)
+
+    def _doc_id(self, num):
+        return self.doc_ids[num]
+
+    def _n_docs(self):
+        return len(self.doc_ids)
+
+    @staticmethod
+    def _empty():
+        return np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def _contains(haystack, needles):
+        """
+        Маска needles, найденных в отсортированном haystack.
+        Двоичный поиск каждого элемента: O(m log n) вместо O(m + n).
+        """
+        if len(haystack) == 0:
+            return np.zeros(len(needles), dtype=bool)
+        pos = np.searchsorted(haystack, needles)
+        pos[pos == len(haystack)] = 0
+        return haystack[pos] == needles
+
+    def _and_operation(self, docs1, docs2):
+        """Логическое И: элементы меньшего списка ищутся в большем"""
+        small, large = (docs1, docs2) if len(docs1) <= len(docs2) else (docs2, docs1)
+        return small[self._contains(large, small)]
     
-    def _or_operation(self, set1, set2):
-        """Логическое ИЛИ (объединение множеств)"""
-        return set1 | set2
+    def _or_operation(self, docs1, docs2):
+        """Логическое ИЛИ (слияние отсортированных списков)"""
+        return np.union1d(docs1, docs2)
+
+    def _and_not_operation(self, docs1, docs2):
+        """docs1 AND NOT docs2 без построения дополнения"""
+        return docs1[~self._contains(docs2, docs1)]
     
     def _not_operation(self, docs):
-        """Логическое НЕ (дополнение множества)"""
-        all_docs = set(self.documents.keys())
-        return all_docs - docs
+        """Логическое НЕ (дополнение) — только для NOT в начале запроса"""
+        return np.setdiff1d(np.arange(self._n_docs()), docs, assume_unique=True)
     
     def save_index_to_file(self, filename):
         """
@@ -115,9 +331,175 @@ class BooleanSearchEngine:
         """
         with open(filename, 'w', encoding='utf-8') as f:
             for term in sorted(self.index.keys()):
-                docs = ','.join(sorted(self.index[term]))
+                docs = ','.join(sorted(self.doc_ids[num] for num in self.index[term]))
                 f.write(f"{term}:{docs}\n")
 
+    @instrumentation.timed("save")
+    def save_index_binary(self, filename):
+        """
+        Сохраняет инвертированный индекс в компактном бинарном формате
+        (см. binary_index.py), который открывается load_index без перестроения.
+        :param filename: имя файла для сохранения
+        """
+        postings = {term: [self.doc_ids[num] for num in nums] for term, nums in self.index.items()}
+        write_binary_index(filename, postings, self.doc_ids)
+
+
+class BinaryBooleanSearchEngine(BooleanSearchEngine):
+    """
+    Булев поиск поверх BinaryIndex: списки документов декодируются
+    из mmap только для термов запроса. Индекс доступен только для чтения.
+    """
+    def __init__(self, binary):
+        super().__init__()
+        self.binary = binary
+
+    def add_document(self, doc_id, text):
+        """:raises TypeError: бинарный индекс открыт только для чтения"""
+        raise TypeError(f"{type(self).__name__} открыт из файла только для чтения: добавьте документ "
+                        f"в BooleanSearchEngine и сохраните индекс заново (save_index_binary)")
+
+    def _postings(self, term):
+        return self.binary.postings(term)
+
+    def _expand(self, pattern, limit=MAX_EXPANSIONS):
+        return self.binary.expand(pattern, limit)
+
+    def _df(self, term):
+        i = self.binary.find(term)
+        return int(self.binary.doc_freqs[i]) if i >= 0 else 0
+
+    def _doc_id(self, num):
+        return self.binary.doc_id(num)
+
+    def _n_docs(self):
+        return self.binary.n_docs
+
+
+@instrumentation.timed("load_index")
+def load_index(filename):
+    """
+    Открывает бинарный индекс через mmap, не перечитывая файлы лемм.
+    :param filename: файл, записанный save_index_binary
+    :return: объект BinaryBooleanSearchEngine, готовый к поиску
+    """
+    return BinaryBooleanSearchEngine(BinaryIndex(filename))
+
+class TfidfRanker:
+    """
+    Ранжирование отобранных документов по сумме нормированных весов TF-IDF
+    терминов запроса. Списки документов терминов упорядочены по убыванию
+    веса, поэтому работает пороговый алгоритм: документы проверяются в
+    порядке убывания весов, и результат выдаётся, как только его score не
+    меньше верхней границы для всех ещё не просмотренных документов.
+    """
+    def __init__(self, mat, doc_ids, vocab):
+        """
+        :param mat: нормированная CSRMatrix из vector_search.build_matrix
+        :param doc_ids: doc_id строк матрицы
+        :param vocab: признаки столбцов матрицы
+        """
+        self.mat = mat
+        self.postings = PostingsIndex.from_matrix(mat)
+        self.doc_ids = doc_ids
+        self.row_of = {doc: i for i, doc in enumerate(doc_ids)}
+        self.term_to_idx = {t: i for i, t in enumerate(vocab)}
+
+    @classmethod
+    def from_folder(cls, folder=TFIDF_LEMMAS_DIR):
+        """Построить веса из файлов tfidf_lemmas (или tfidf_terms)"""
+        doc_ids, vocab, tfidf_data = load_tfidf(Path(folder))
+        return cls(build_matrix(doc_ids, vocab, tfidf_data), doc_ids, vocab)
+
+    def _column(self, term):
+        """
+        Столбец термина запроса. Термины берутся из запроса как есть, а в весах
+        по леммам хранятся только нормальные формы — тогда термин ищется по лемме.
+        """
+        idx = self.term_to_idx.get(term)
+        return idx if idx is not None else self.term_to_idx.get(analyzer.lemmatize(term))
+
+    def _score(self, row, cols):
+        """Сумма весов документа по признакам cols (строки CSR отсортированы по столбцам)"""
+        start, end = self.mat.indptr[row], self.mat.indptr[row + 1]
+        row_cols = self.mat.indices[start:end]
+        pos = np.searchsorted(row_cols, cols)
+        score = 0.0
+        for p, col in zip(pos, cols):
+            if p < len(row_cols) and row_cols[p] == col:
+                score += float(self.mat.data[start + p])
+        return score
+
+    def rank(self, candidates, terms, top_k):
+        """
+        :param candidates: doc_id, прошедшие булев фильтр (в порядке выдачи при равных score)
+        :param terms: термины, по которым считается score
+        :return: генератор пар (doc_id, score), не более top_k
+        """
+        if top_k <= 0:
+            return
+        rows = np.array(sorted(self.row_of[doc] for doc in candidates if doc in self.row_of), dtype=np.int64)
+        cols = sorted({col for col in map(self._column, terms) if col is not None})
+        lists = [self.postings.postings(col) for col in cols]
+        emitted = set()
+
+        heap = []  # (-score, row) просмотренных документов из фильтра
+        seen = set()
+        if rows.size * len(cols) <= sum(len(docs) for docs, _ in lists):
+            # Фильтр уже списков: дешевле сразу оценить всех кандидатов
+            heap = [(-self._score(row, cols), int(row)) for row in rows]
+            heapq.heapify(heap)
+        else:
+            for depth in range(max((len(docs) for docs, _ in lists), default=0)):
+                # Непросмотренный документ наберёт не больше суммы весов на этой глубине
+                threshold = 0.0
+                for docs, weights in lists:
+                    if depth >= len(docs):
+                        continue
+                    threshold += float(weights[depth])
+                    row = int(docs[depth])
+                    if row in seen:
+                        continue
+                    seen.add(row)
+                    i = np.searchsorted(rows, row)
+                    if i < len(rows) and rows[i] == row:
+                        heapq.heappush(heap, (-self._score(row, cols), row))
+                while heap and -heap[0][0] >= threshold:
+                    score, row = heapq.heappop(heap)
+                    emitted.add(self.doc_ids[row])
+                    yield self.doc_ids[row], -score
+                    if len(emitted) == top_k:
+                        return
+
+        while heap and len(emitted) < top_k:
+            score, row = heapq.heappop(heap)
+            emitted.add(self.doc_ids[row])
+            yield self.doc_ids[row], -score
+        # Документы фильтра без весов по терминам запроса
+        for doc in candidates:
+            if len(emitted) >= top_k:
+                return
+            if doc not in emitted:
+                emitted.add(doc)
+                yield doc, 0.0
+
+
+@instrumentation.timed("build_index")
+def build_document_index(lemmas_folder='lemmas_per_doc'):
+    """
+    Строит индекс, в котором документ — целая страница, а не отдельная лемма:
+    doc_id совпадает с doc_id файлов TF-IDF, что нужно для ranked_search.
+    :param lemmas_folder: папка с файлами <doc_id>_lemmas.txt
+    :return: объект BooleanSearchEngine
+    """
+    engine = BooleanSearchEngine()
+    for path in sorted(Path(lemmas_folder).glob('*_lemmas.txt')):
+        lemmas = load_lemmas(path)
+        text = ' '.join(f"{lemma} {forms}" for lemma, forms in lemmas.items())
+        engine.add_document(path.stem[:-len('_lemmas')], text)
+    return engine
+
+@instrumentation.timed("read_lemmas")
 def load_lemmas(file_path):
     """
     Загружает леммы из файла.
@@ -132,6 +514,7 @@ def load_lemmas(file_path):
                 lemmas[lemma] = forms.strip()
     return lemmas
 
+@instrumentation.timed("build_index")
 def build_index(lemma_files):
     """
     Строит инвертированный индекс из файлов с леммами.
@@ -181,12 +564,20 @@ def demonstrate_search(engine):
             print("Тест не пройден")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', default=None,
+                        help="записать профиль cProfile в файл и этапы для flame graph рядом (.folded)")
+    args = parser.parse_args()
+    if args.profile:
+        instrumentation.profile_to(args.profile)
+
     # 1. Строим индекс из файлов
     engine = build_index(['lemmas_1.txt', 'lemmas_2.txt'])
     
     # 2. Сохраняем инвертированный индекс
     engine.save_index_to_file('inverted_index.txt')
-    print("Инвертированный индекс сохранен в inverted_index.txt")
+    engine.save_index_binary('inverted_index.bin')
+    print("Инвертированный индекс сохранен в inverted_index.txt и inverted_index.bin")
     
     # 3. Демонстрация работы поиска
     demonstrate_search(engine)
\ No newline at end of file
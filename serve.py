@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Многопроцессный сервер flask_app (pre-fork).
+
+Главный процесс открывает сокет и запускает --workers процессов, каждый
+принимает соединения с общего сокета своим многопоточным сервером werkzeug.
+flask_app импортируется уже в дочерних процессах: у каждого свои потоки
+батчинга, а матрица, списки, словарь, FAISS-индекс и векторы открываются
+через mmap и делят одни и те же страницы page cache.
+
+Новая версия индекса публикуется пересборкой (vector_search.py,
+build_faiss_index.py, incremental.py, embeddings.py) в неизменяемую папку
+index/<версия>/, после чего атомарно заменяется единственный указатель
+index_version.txt. Воркеры сами переключаются на новую версию без
+перезапуска и открывают все её файлы из её папки. Упавший воркер перезапускается.
+
+Соединения с общего сокета достаются случайному воркеру, поэтому метрики
+сводятся: каждый воркер пишет свой снимок в папку --metrics-dir
+(по умолчанию временную), и /metrics любого воркера отдаёт их сумму.
+
+Использование:
+    python serve.py [--workers N] [--host HOST] [--port PORT] [--metrics-dir DIR]
+"""
+import argparse
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def worker(sock, metrics_dir):
+    from werkzeug.serving import make_server
+    import flask_app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    flask_app.share_metrics(metrics_dir)
+    server = make_server(*sock.getsockname()[:2], flask_app.app, threaded=True, fd=sock.fileno())
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        flask_app.dump_metrics()
+
+
+def spawn(sock, metrics_dir):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            worker(sock, metrics_dir)
+        except SystemExit:
+            pass
+        except BaseException:
+            logging.exception("Воркер завершился с ошибкой")
+            code = 1
+        os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--metrics-dir', help='папка снимков метрик воркеров (по умолчанию временная)')
+    args = parser.parse_args()
+
+    if args.metrics_dir:
+        metrics_dir = args.metrics_dir
+        Path(metrics_dir).mkdir(parents=True, exist_ok=True)
+        # Снимки прошлого запуска не должны попасть в сумму
+        for path in Path(metrics_dir).glob('*.json'):
+            path.unlink()
+    else:
+        metrics_dir = tempfile.mkdtemp(prefix='serve-metrics-')
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    workers = {spawn(sock, metrics_dir) for _ in range(args.workers)}
+    print(f"Слушаю http://{args.host}:{sock.getsockname()[1]}, воркеров: {len(workers)} "
+          f"(pid {', '.join(map(str, sorted(workers)))})", flush=True)
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"Воркер {pid} завершился (код {os.waitstatus_to_exitcode(status)}), перезапуск", flush=True)
+            time.sleep(0.5)
+            workers.add(spawn(sock, metrics_dir))
+    sock.close()
+    if not args.metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Шардированный индекс и поиск scatter-gather.
+
+Сборка делит строки матрицы TF-IDF (индекс vector_search.py) на N шардов
+непрерывными диапазонами с примерно равным числом ненулевых элементов.
+Каждый шард — папка shards/<i>/ со своей CSR-матрицей, инвертированными
+списками и локальными doc_ids. Словарь общий (shards/vocab_table.bin), а веса
+посчитаны tf_idf.py с idf по всему корпусу: оценки шардов сравнимы между
+собой, и слияние их топ-K даёт тот же топ-K, что поиск по целому индексу.
+
+Каждый шард обслуживает отдельный процесс (multiprocessing.connection:
+unix-сокет на этой машине или host:port на другой). Координатор
+ShardedSearch рассылает запрос всем шардам сразу, ждёт ответы не дольше
+таймаута и сливает отсортированные выдачи кучей (heapq.merge). Шарды,
+не успевшие ответить, пропускаются, их номера возвращаются вместе с
+выдачей; запоздавший ответ отбрасывается по номеру запроса.
+
+Использование:
+    python shards.py build --shards N          # из сохранённого индекса vector_search.py
+    python shards.py search [--top-k K] [--timeout S] [--address HOST:PORT ...]
+    python shards.py serve --shard I --address HOST:PORT
+"""
+import argparse
+import heapq
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from itertools import islice
+from multiprocessing import AuthenticationError, Process
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+import instrumentation
+from binary_index import TermTable, write_term_table
+from vector_search import (DOCIDS_FILE, MAT_DATA_FILE, MAT_INDICES_FILE, MAT_INDPTR_FILE, POSTINGS_DOCS_FILE,
+                           POSTINGS_PTR_FILE, POSTINGS_WEIGHTS_FILE, TOMBSTONES_FILE, VOCAB_TABLE_FILE,
+                           CSRMatrix, PostingsIndex, cosine_search, load_objects, query_weights,
+                           read_index_version, save_array)
+
+SHARDS_DIR = 'shards'
+MANIFEST_FILE = 'manifest.json'
+SHARD_TIMEOUT = 1.0    # с, ожидание ответа шарда на запрос
+CONNECT_TIMEOUT = 30.0  # с, ожидание запуска процесса шарда
+
+
+def shard_bounds(indptr, n_shards):
+    """Границы строк шардов: диапазоны с примерно равным числом ненулевых элементов"""
+    D = len(indptr) - 1
+    n_shards = max(1, min(n_shards, D))
+    cuts = np.searchsorted(indptr, np.linspace(0, indptr[-1], n_shards + 1)[1:-1])
+    # В каждом шарде хотя бы одна строка, даже если строка тяжелее доли шарда
+    k = np.arange(1, n_shards)
+    cuts = np.maximum.accumulate(np.maximum(cuts, k) - k) + k
+    cuts = np.minimum(cuts, D - n_shards + k)
+    return np.concatenate([[0], cuts, [D]]).astype(np.int64)
+
+
+@instrumentation.timed("build_shards")
+def build_shards(mat, doc_ids, vocab, n_shards, folder=SHARDS_DIR):
+    """
+    Разбить индекс на шарды в folder (прежнее содержимое удаляется).
+    :return: манифест {'shards', 'n_docs', 'offsets', 'authkey', 'version'}
+    """
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    bounds = shard_bounds(mat.indptr, n_shards)
+    for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+        shard_dir = os.path.join(folder, str(i))
+        os.makedirs(shard_dir)
+        start, end = mat.indptr[lo], mat.indptr[hi]
+        deleted = np.asarray(mat.deleted[lo:hi]) if mat.deleted is not None else None
+        shard = CSRMatrix(np.asarray(mat.indptr[lo:hi + 1]) - start, np.asarray(mat.indices[start:end]),
+                          np.asarray(mat.data[start:end]), mat.shape[1], deleted)
+        postings = PostingsIndex.from_matrix(shard)
+        arrays = {MAT_INDPTR_FILE: shard.indptr, MAT_INDICES_FILE: shard.indices, MAT_DATA_FILE: shard.data,
+                  POSTINGS_PTR_FILE: postings.term_ptr, POSTINGS_DOCS_FILE: postings.docs,
+                  POSTINGS_WEIGHTS_FILE: postings.weights, DOCIDS_FILE: np.array(doc_ids[lo:hi])}
+        if deleted is not None:
+            arrays[TOMBSTONES_FILE] = deleted
+        for name, arr in arrays.items():
+            save_array(os.path.join(shard_dir, name), arr)
+    write_term_table(os.path.join(folder, VOCAB_TABLE_FILE), vocab, np.bincount(mat.indices, minlength=mat.shape[1]))
+    # Манифест пишется последним: по нему видно, что сборка завершена
+    manifest = {'shards': len(bounds) - 1, 'n_docs': int(bounds[-1]), 'offsets': bounds[:-1].tolist(),
+                'vocab_size': len(vocab), 'authkey': secrets.token_hex(16), 'version': read_index_version()}
+    tmp = os.path.join(folder, f'{MANIFEST_FILE}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(folder, MANIFEST_FILE))
+    return manifest
+
+
+def load_manifest(folder=SHARDS_DIR):
+    with open(os.path.join(folder, MANIFEST_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+class Shard:
+    """Поиск по одному шарду; массивы открыты через mmap"""
+    def __init__(self, folder, index, engine='postings'):
+        manifest = load_manifest(folder)
+        shard_dir = os.path.join(folder, str(index))
+        self.offset = manifest['offsets'][index]
+        self.doc_ids = np.load(os.path.join(shard_dir, DOCIDS_FILE)).tolist()
+        load = lambda name: np.load(os.path.join(shard_dir, name), mmap_mode='r')
+        deleted = load(TOMBSTONES_FILE) if os.path.exists(os.path.join(shard_dir, TOMBSTONES_FILE)) else None
+        self.mat = CSRMatrix(load(MAT_INDPTR_FILE), load(MAT_INDICES_FILE), load(MAT_DATA_FILE),
+                             manifest['vocab_size'], deleted)
+        self.postings = None
+        if engine == 'postings':
+            self.postings = PostingsIndex(load(POSTINGS_PTR_FILE), load(POSTINGS_DOCS_FILE),
+                                          load(POSTINGS_WEIGHTS_FILE), self.mat.shape[0], deleted)
+
+    def search(self, weights, top_k):
+        """
+        :param weights: {столбец: вес} нормированного вектора запроса
+        :return: [(-score, глобальный номер, doc_id)] по возрастанию — порядок слияния
+        """
+        if self.postings is not None:
+            scores, idxs = self.postings.search(weights, top_k)
+        else:
+            vec = np.zeros(self.mat.shape[1], dtype=np.float32)
+            vec[list(weights)] = list(weights.values())
+            scores, idxs = cosine_search(self.mat, vec.reshape(1, -1), top_k)
+        return [(-float(score), self.offset + int(i), self.doc_ids[i]) for score, i in zip(scores, idxs)]
+
+
+def _handle(shard, conn):
+    """Запросы одного координатора: (номер, веса, top_k) -> (номер, выдача)"""
+    with conn:
+        while True:
+            try:
+                request_id, weights, top_k = conn.recv()
+            except (EOFError, OSError):
+                return
+            conn.send((request_id, shard.search(weights, top_k)))
+
+
+def serve_shard(folder, index, address, engine='postings'):
+    """Процесс шарда: на каждое соединение координатора — свой поток"""
+    shard = Shard(folder, index, engine)
+    authkey = bytes.fromhex(load_manifest(folder)['authkey'])
+    with Listener(address, authkey=authkey) as listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError):
+                continue  # чужой клиент не должен останавливать шард
+            threading.Thread(target=_handle, args=(shard, conn), daemon=True).start()
+
+
+def parse_address(value):
+    """'host:port' -> (host, port); иначе путь unix-сокета"""
+    host, sep, port = value.rpartition(':')
+    return (host, int(port)) if sep and port.isdigit() else value
+
+
+def connect(address, authkey, deadline):
+    """Подключиться к шарду, ожидая, пока его процесс начнёт слушать"""
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+class ShardedSearch:
+    """
+    Координатор scatter-gather. Без addresses запускает процессы шардов на
+    этой машине (unix-сокеты во временной папке) и завершает их в close().
+    Запросы одного координатора выполняются по очереди; шарды внутри запроса — параллельно.
+    """
+    def __init__(self, folder=SHARDS_DIR, addresses=None, timeout=SHARD_TIMEOUT, engine='postings'):
+        self.manifest = load_manifest(folder)
+        self.vocab = TermTable(os.path.join(folder, VOCAB_TABLE_FILE))
+        self.timeout = timeout
+        self.processes = []
+        self._socket_dir = None
+        if addresses is None:
+            self._socket_dir = tempfile.mkdtemp(prefix='shards_')
+            addresses = [os.path.join(self._socket_dir, f'{i}.sock') for i in range(self.manifest['shards'])]
+            for i, address in enumerate(addresses):
+                process = Process(target=serve_shard, args=(folder, i, address, engine), daemon=True)
+                process.start()
+                self.processes.append(process)
+        if len(addresses) != self.manifest['shards']:
+            raise ValueError(f"Нужно {self.manifest['shards']} адресов шардов, передано {len(addresses)}")
+        authkey = bytes.fromhex(self.manifest['authkey'])
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        try:
+            self.conns = [connect(address, authkey, deadline) for address in addresses]
+        except BaseException:
+            self.close()
+            raise
+        self._lock = threading.Lock()
+        self._request_id = 0
+        self.timeouts = [0] * len(self.conns)  # пропущенных ответов по шардам
+
+    def search_weights(self, weights, top_k):
+        """
+        :param weights: {столбец: вес} нормированного вектора запроса
+        :return: ([(doc_id, score)] топ-K, номера шардов без ответа)
+        """
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+            pending = {}
+            with instrumentation.stage("scatter"):
+                for i, conn in enumerate(self.conns):
+                    if conn is None:
+                        continue
+                    try:
+                        conn.send((request_id, weights, top_k))
+                        pending[conn] = i
+                    except OSError:
+                        self.conns[i] = None
+            replies, answered = [], set()
+            deadline = time.monotonic() + self.timeout
+            with instrumentation.stage("gather"):
+                while pending:
+                    remaining = deadline - time.monotonic()
+                    ready = wait(list(pending), remaining) if remaining > 0 else []
+                    if not ready:
+                        break
+                    for conn in ready:
+                        try:
+                            reply_id, hits = conn.recv()
+                        except (EOFError, OSError):
+                            # Процесс шарда завершился: дальше он не опрашивается
+                            self.conns[pending.pop(conn)] = None
+                            continue
+                        if reply_id == request_id:
+                            replies.append(hits)
+                            answered.add(pending.pop(conn))
+            for i in pending.values():
+                self.timeouts[i] += 1
+            instrumentation.count("shard_timeouts", len(pending))
+        with instrumentation.stage("merge"):
+            hits = [(doc_id, -neg_score) for neg_score, _, doc_id in islice(heapq.merge(*replies), top_k)]
+        return hits, [i for i in range(len(self.conns)) if i not in answered]
+
+    def search(self, query, top_k):
+        """Запрос текстом: веса терминов и шаблонов — как в vector_search, L2-нормированные"""
+        weights = query_weights(query, self.vocab)
+        if not weights:
+            return [], []
+        norm = np.sqrt(sum(w * w for w in weights.values()))
+        return self.search_weights({i: w / norm for i, w in weights.items()}, top_k)
+
+    def close(self):
+        for conn in getattr(self, 'conns', []):
+            if conn is not None:
+                conn.close()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['build', 'search', 'serve'])
+    parser.add_argument('--folder', default=SHARDS_DIR, help="папка шардов")
+    parser.add_argument('--shards', type=int, default=os.cpu_count() or 1, help="число шардов (build)")
+    parser.add_argument('--shard', type=int, help="номер обслуживаемого шарда (serve)")
+    parser.add_argument('--address', nargs='*', default=None,
+                        help="HOST:PORT или путь сокета: для serve — свой, для search — всех шардов по порядку")
+    parser.add_argument('--engine', choices=['dense', 'postings'], default='postings')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=SHARD_TIMEOUT, help="ожидание ответа шарда, с")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        mat, doc_ids, vocab = load_objects()
+        if mat is None:
+            parser.error("индекс не найден: сначала запустите vector_search.py")
+        manifest = build_shards(mat, doc_ids, vocab, args.shards, args.folder)
+        sizes = np.diff(manifest['offsets'] + [manifest['n_docs']])
+        print(f"Шардов: {manifest['shards']} в {args.folder}/, документов по шардам: {', '.join(map(str, sizes))}")
+    elif args.command == 'serve':
+        if args.shard is None or not args.address:
+            parser.error("для serve нужны --shard и --address")
+        serve_shard(args.folder, args.shard, parse_address(args.address[0]), args.engine)
+    else:
+        addresses = [parse_address(a) for a in args.address] if args.address else None
+        with ShardedSearch(args.folder, addresses, args.timeout, args.engine) as search:
+            print("Введите запрос: список терминов через пробел:")
+            while True:
+                line = input('> ').strip()
+                if not line:
+                    break
+                hits, missing = search.search(line, args.top_k)
+                if missing:
+                    print(f"Нет ответа от шардов: {', '.join(map(str, missing))} — выдача неполная")
+                for doc_id, score in hits:
+                    print(f"[{score:.4f}] {doc_id}")
+                print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Сниппеты выдачи: фрагмент текста документа вокруг терминов запроса,
+термины выделены <b>. Текст берётся из хранилища doc_store.py — на
+документ распаковывается один блок, а не весь корпус.
+
+Термин запроса находит в тексте свои формы: совпадение слова, его леммы
+или шаблона («технолог*»). Чтобы не лемматизировать каждое слово
+документа, текст просматривается одним регулярным выражением по началам
+терминов (PREFIX_CHARS букв); лемматизируются только найденные им слова.
+Из всех окон длиной SNIPPET_CHARS выбирается то, где больше разных
+терминов запроса.
+
+Использование:
+    highlighter = QueryHighlighter('технолог* инновации')
+    html = highlighter.snippet(store.get(doc_id))
+"""
+import html
+import re
+
+import analyzer
+from binary_index import is_pattern, split_pattern
+
+SNIPPET_CHARS = 240
+PREFIX_CHARS = 3        # букв начала термина, по которым ищутся кандидаты
+HIGHLIGHT = ('<b>', '</b>')
+SPACE_RE = re.compile(r'\s+')
+
+
+class QueryHighlighter:
+    """Поиск форм терминов одного запроса в текстах документов выдачи"""
+    def __init__(self, query, width=SNIPPET_CHARS):
+        self.width = width
+        words = query.split()
+        self.forms = set(analyzer.query_tokens(' '.join(w for w in words if not is_pattern(w))))
+        self.lemmas = {analyzer.lemmatize(form) for form in self.forms}
+        self.patterns = [split_pattern(w.lower()) for w in dict.fromkeys(words) if is_pattern(w)]
+        prefixes = {form[:PREFIX_CHARS] for form in self.forms | self.lemmas}
+        prefixes.update(prefix for prefix, _ in self.patterns if prefix)
+        self._candidates = None
+        if prefixes:
+            alternatives = '|'.join(sorted(map(re.escape, prefixes), key=len, reverse=True))
+            # Левая граница слова проверяется после совпадения: с ретроспективной
+            # проверкой в начале шаблона re пробует её в каждой позиции текста
+            self._candidates = re.compile(rf'(?:{alternatives})[а-яё]*(?![\w-])')
+        self._keys = {}
+
+    def _key(self, word):
+        """Термин запроса, к которому относится слово (для подсчёта разных), или None"""
+        if word not in self._keys:
+            key = None
+            if word in self.forms:
+                key = analyzer.lemmatize(word)
+            else:
+                for i, (prefix, regex) in enumerate(self.patterns):
+                    if word.startswith(prefix) and (regex is None or regex.fullmatch(word)):
+                        key = i
+                        break
+                if key is None and word not in analyzer.stopword_set():
+                    lemma = analyzer.lemmatize(word)
+                    key = lemma if lemma in self.lemmas else None
+            self._keys[word] = key
+        return self._keys[word]
+
+    def hits(self, text):
+        """Вхождения терминов запроса: [(начало, конец, термин)]"""
+        if self._candidates is None:
+            return []
+        lower = text.lower()
+        if len(lower) != len(text):
+            # Редкие символы меняют длину при lower(), и позиции бы разошлись
+            lower = ''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+        found = []
+        for match in self._candidates.finditer(lower):
+            start = match.start()
+            if start and (lower[start - 1].isalnum() or lower[start - 1] in '_-'):
+                continue
+            key = self._key(match.group())
+            if key is not None:
+                found.append((start, match.end(), key))
+        return found
+
+    def _best_window(self, hits):
+        """Первое и последнее вхождения окна не длиннее width с наибольшим числом разных терминов"""
+        best, best_count = (0, 0), 0
+        j = 0
+        for i in range(len(hits)):
+            j = max(j, i)
+            while j + 1 < len(hits) and hits[j + 1][1] - hits[i][0] <= self.width:
+                j += 1
+            count = len({key for _, _, key in hits[i:j + 1]})
+            if count > best_count:
+                best, best_count = (i, j), count
+        return best
+
+    def snippet(self, text):
+        """
+        Фрагмент текста с выделенными терминами, HTML-экранированный.
+        Без вхождений — начало текста.
+        """
+        hits = self.hits(text)
+        if hits:
+            i, j = self._best_window(hits)
+            span_start, span_end = hits[i][0], hits[j][1]
+            start = max(0, span_start - (self.width - (span_end - span_start)) // 2)
+            hits = hits[i:j + 1]
+        else:
+            start = 0
+        end = min(len(text), start + self.width)
+        # Границы окна сдвигаются к пробелам, чтобы не резать слова
+        if start > 0:
+            space = text.find(' ', start, hits[0][0] if hits else end)
+            if space < 0:
+                space = text.rfind(' ', max(0, start - 20), start)
+            start = space + 1 if space >= 0 else start
+        if end < len(text):
+            space = text.rfind(' ', hits[-1][1] if hits else start, end)
+            end = space if space >= 0 else end
+        parts, pos = [], start
+        for hit_start, hit_end, _ in hits:
+            if hit_end > end:
+                break
+            parts.append(html.escape(text[pos:hit_start]))
+            parts.append(HIGHLIGHT[0] + html.escape(text[hit_start:hit_end]) + HIGHLIGHT[1])
+            pos = hit_end
+        parts.append(html.escape(text[pos:end]))
+        body = SPACE_RE.sub(' ', ''.join(parts)).strip()
+        return ('… ' if start > 0 else '') + body + (' …' if end < len(text) else '')
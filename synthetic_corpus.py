@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетического корпуса HTML-страниц на «русском» языке.
+
+Словарь — выдуманные основы из русских слогов с падежными окончаниями
+(несколько словоформ на лемму), частоты лемм распределены по Ципфу.
+В текст подмешиваются стоп-слова, числа и латиница, чтобы работали те же
+фильтры, что на настоящих страницах. Страницы пишутся в формате
+downloader.py: <output>/<номер>_<id>.html и index.txt со строками
+«файл URL». Корпус детерминирован при одинаковом --seed.
+
+Использование:
+    python synthetic_corpus.py [--docs N] [--vocab V] [--words W] [--zipf S] [--output DIR]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+CONSONANTS = 'бвгджзклмнпрстфхцчшщ'
+VOWELS = 'аеиоуыэюяё'
+ENDINGS = ('', 'а', 'у', 'ом', 'е', 'ы', 'ов', 'ам', 'ами', 'ах')
+STOPWORDS = ('и', 'в', 'не', 'на', 'что', 'с', 'по', 'как', 'это', 'для', 'из', 'к', 'о', 'от', 'же')
+NOISE = ('2025', '1917', 'html', 'wiki', 'ISBN', 'i18n', '10км')
+STOPWORD_SHARE = 0.25
+NOISE_SHARE = 0.02
+URL_PREFIX = 'http://synthetic.ru/wiki/'
+
+
+def make_stems(vocab_size, rng):
+    """Уникальные основы из 2–4 слогов вида согласная+гласная (+согласная в конце)"""
+    syllables = np.array([c + v for c in CONSONANTS for v in VOWELS], dtype=object)
+    tails = np.array(list(CONSONANTS), dtype=object)
+    stems = {}  # dict сохраняет порядок появления
+    while len(stems) < vocab_size:
+        batch = vocab_size - len(stems) + 16
+        lengths = rng.integers(2, 5, size=batch)
+        parts = syllables[rng.integers(len(syllables), size=(batch, 4))]
+        ends = tails[rng.integers(len(tails), size=batch)]
+        for row, n, end in zip(parts, lengths, ends):
+            stems.setdefault(''.join(row[:n]) + end, None)
+    return list(stems)[:vocab_size]
+
+
+class CorpusGenerator:
+    """
+    Потоковая генерация документов: словоформы выбираются по Ципфу через
+    searchsorted по накопленным вероятностям, без цикла по словарю.
+    """
+    def __init__(self, vocab_size=50_000, words=300, zipf=1.1, seed=0):
+        """
+        :param vocab_size: число лемм
+        :param words: средняя длина документа в словах
+        :param zipf: показатель распределения Ципфа (частота ~ 1 / rank^zipf)
+        """
+        self.rng = np.random.default_rng(seed)
+        self.words = words
+        stems = make_stems(vocab_size, self.rng)
+        # Словоформа = основа + окончание; у каждой леммы все окончания
+        self.forms = np.array([stem + ending for stem in stems for ending in ENDINGS], dtype=object)
+        weights = 1.0 / np.arange(1, vocab_size + 1) ** zipf
+        self.cdf = np.cumsum(weights / weights.sum())
+        self.extra = np.array(STOPWORDS + NOISE, dtype=object)
+        self.extra_cdf = np.cumsum([STOPWORD_SHARE / len(STOPWORDS)] * len(STOPWORDS)
+                                   + [NOISE_SHARE / len(NOISE)] * len(NOISE)) / (STOPWORD_SHARE + NOISE_SHARE)
+
+    def document_words(self):
+        """Слова одного документа, длина ~ экспоненциальная со средним words"""
+        n = max(20, int(self.rng.exponential(self.words)))
+        lemmas = np.minimum(np.searchsorted(self.cdf, self.rng.random(n)), len(self.cdf) - 1)
+        words = self.forms[lemmas * len(ENDINGS) + self.rng.integers(len(ENDINGS), size=n)]
+        extra = self.rng.random(n) < STOPWORD_SHARE + NOISE_SHARE
+        words[extra] = self.extra[np.searchsorted(self.extra_cdf, self.rng.random(int(extra.sum())))]
+        return words
+
+    def html(self, doc_num):
+        words = self.document_words()
+        title = ' '.join(words[:4]).capitalize()
+        # Абзацы по 40–80 слов
+        bounds = np.cumsum(self.rng.integers(40, 81, size=len(words) // 40 + 1))
+        paragraphs = [' '.join(part) for part in np.split(words, bounds[bounds < len(words)]) if len(part)]
+        body = '\n'.join(f'<p>{p.capitalize()}.</p>' for p in paragraphs)
+        return (f'<!DOCTYPE html>\n<html lang="ru">\n<head>\n<meta charset="UTF-8">\n'
+                f'<title>{title} — Синтетика</title>\n</head>\n<body>\n'
+                f'<h1>{title}</h1>\n{body}\n<div class="footer">Страница {doc_num}</div>\n'
+                f'</body>\n</html>\n')
+
+
+def generate(output_dir, docs, vocab_size=50_000, words=300, zipf=1.1, seed=0):
+    """
+    Записывает docs страниц и index.txt в output_dir.
+    :return: суммарный размер страниц, байт
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    gen = CorpusGenerator(vocab_size, words, zipf, seed)
+    total = 0
+    with open(os.path.join(output_dir, 'index.txt'), 'w', encoding='utf-8') as index_file:
+        for i in range(docs):
+            url = f'{URL_PREFIX}Страница_{i}'
+            file_name = f'{output_dir}/{i}_synthetic.ru_wiki_Страница_{i}.html'
+            data = gen.html(i).encode('utf-8')
+            with open(file_name, 'wb') as f:
+                f.write(data)
+            total += len(data)
+            index_file.write(f'{file_name} {url}\n')
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=1000, help="число страниц")
+    parser.add_argument('--vocab', type=int, default=50_000, help="число лемм в словаре")
+    parser.add_argument('--words', type=int, default=300, help="средняя длина страницы в словах")
+    parser.add_argument('--zipf', type=float, default=1.1, help="показатель распределения Ципфа")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='output', help="папка для страниц")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    total = generate(args.output, args.docs, args.vocab, args.words, args.zipf, args.seed)
+    print(f"Сгенерировано {args.docs} страниц, {total / 2**20:.1f} МБ за {time.perf_counter() - start:.1f} с "
+          f"в {args.output}/")
+
+
+if __name__ == '__main__':
+    main()
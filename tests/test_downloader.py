@@ -0,0 +1,107 @@
+"""Обход downloader.crawl против локального http.server"""
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import downloader
+
+PAGES = {'/a': 'река', '/b': 'озеро'}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Страницы PAGES с ETag и 304; пути из server.flaky сначала отвечают 503"""
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.server.flaky.get(self.path, 0) > 0:
+            self.server.flaky[self.path] -= 1
+            self.send_error(503)
+            return
+        text = PAGES.get(self.path)
+        if text is None:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.sha1(text.encode('utf-8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = f"<html><body><p>{text}</p></body></html>".encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    httpd.requests, httpd.flaky = [], {}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def crawl(urls, folder):
+    return downloader.crawl(urls, str(folder), workers=4, per_host_interval=0, retries=2, timeout=5)
+
+
+def read_index(folder):
+    return [line.split(' ', 1) for line in (folder / 'index.txt').read_text(encoding='utf-8').splitlines()]
+
+
+def test_crawl_saves_pages_and_keeps_line_numbers(server, tmp_path):
+    folder = tmp_path / 'output'
+    urls = [url(server, '/a'), '', url(server, '/missing'), url(server, '/b')]
+    assert crawl(urls, folder) == {'saved': 2, 'not_modified': 0, 'failed': 1}
+
+    # Пустая строка не запрашивается, но номер страницы — номер строки списка
+    index = read_index(folder)
+    assert index == [[downloader.page_file_name(urls[0], 0, str(folder)), urls[0]],
+                     [downloader.page_file_name(urls[3], 3, str(folder)), urls[3]]]
+    assert 'река' in open(index[0][0], encoding='utf-8').read()
+    validators = json.loads((folder / 'validators.json').read_text(encoding='utf-8'))
+    assert validators[urls[0]]['etag'].startswith('"')
+    assert validators[urls[2]] == {}
+    assert '' not in validators
+
+
+def test_recrawl_uses_conditional_requests(server, tmp_path):
+    folder = tmp_path / 'output'
+    urls = [url(server, '/a'), url(server, '/b')]
+    crawl(urls, folder)
+    server.requests.clear()
+    assert crawl(urls, folder) == {'saved': 0, 'not_modified': 2, 'failed': 0}
+    assert all(etag is not None for _, etag in server.requests)
+    assert len(read_index(folder)) == 2
+
+
+def test_retries_transient_errors(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader.time, 'sleep', lambda seconds: None)
+    server.flaky['/a'] = 2
+    assert crawl([url(server, '/a')], tmp_path / 'output') == {'saved': 1, 'not_modified': 0, 'failed': 0}
+    assert [path for path, _ in server.requests] == ['/a'] * 3
+
+
+def test_write_error_fails_only_its_page(server, tmp_path):
+    folder = tmp_path / 'output'
+    urls = [url(server, '/a'), url(server, '/b')]
+    # На месте файла второй страницы — папка: запись упадёт с OSError
+    (folder / downloader.page_file_name(urls[1], 1, '.')).mkdir(parents=True)
+    assert crawl(urls, folder) == {'saved': 1, 'not_modified': 0, 'failed': 1}
+    assert (folder / 'validators.json').exists()
+    assert read_index(folder)[0][1] == urls[0]
+    assert not list(folder.glob('*.tmp'))
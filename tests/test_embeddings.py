@@ -0,0 +1,100 @@
+"""Плотные векторы embeddings.py без сети: кодировщик hashing"""
+import numpy as np
+import pytest
+
+import embeddings
+
+DIM = 32
+
+
+def write_page(folder, doc_id, text):
+    (folder / f"{doc_id}.html").write_text(f"<html><body><p>{text}</p></body></html>", encoding='utf-8')
+
+
+@pytest.fixture
+def output(tmp_path, monkeypatch):
+    """Папка output/ с тремя страницами; сборка идёт во временной папке"""
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / 'output'
+    folder.mkdir()
+    for i, text in enumerate(['река течёт на север', 'озеро у леса', 'город на реке']):
+        write_page(folder, f"{i}_doc", text)
+    return folder
+
+
+@pytest.fixture
+def encoded(monkeypatch):
+    """Тексты, переданные кодировщику, в порядке кодирования"""
+    texts = []
+    encode_batch = embeddings._encode_batch
+
+    def recording(batch):
+        texts.extend(batch)
+        return encode_batch(batch)
+
+    monkeypatch.setattr(embeddings, '_encode_batch', recording)
+    return texts
+
+
+def test_hashing_encoder_is_deterministic_and_normalized():
+    vecs = embeddings.HashingEncoder(DIM).encode(['река течёт', 'Река  течёт', ''])
+    assert vecs.shape == (3, DIM)
+    np.testing.assert_array_equal(vecs[0], vecs[1])
+    np.testing.assert_allclose(np.linalg.norm(vecs[:2], axis=1), 1.0, rtol=1e-6)
+    assert not vecs[2].any()
+
+
+def test_build_reencodes_only_changed_documents(output, encoded):
+    embeddings.build_embeddings(embeddings.HASHING_MODEL, dim=DIM)
+    assert len(encoded) == 3
+    first, _, _ = embeddings.load_embeddings()
+    first = np.array(first)
+
+    encoded.clear()
+    write_page(output, '1_doc', 'озеро у старого леса')
+    write_page(output, '3_doc', 'новая страница')
+    embeddings.build_embeddings(embeddings.HASHING_MODEL, dim=DIM)
+    assert encoded == ['озеро у старого леса', 'новая страница']
+
+    vecs, doc_ids, meta = embeddings.load_embeddings()
+    assert doc_ids == ['0_doc', '1_doc', '2_doc', '3_doc']
+    assert meta['dim'] == DIM
+    np.testing.assert_array_equal(vecs[[0, 2]], first[[0, 2]])
+    expected = embeddings.HashingEncoder(DIM).encode(['озеро у старого леса', 'новая страница'])
+    np.testing.assert_allclose(vecs[[1, 3]], expected)
+
+    encoded.clear()
+    embeddings.build_embeddings(embeddings.HASHING_MODEL, dim=DIM)
+    assert encoded == []
+
+
+def test_build_with_other_dim_reencodes_everything(output, encoded):
+    embeddings.build_embeddings(embeddings.HASHING_MODEL, dim=DIM)
+    encoded.clear()
+    embeddings.build_embeddings(embeddings.HASHING_MODEL, dim=DIM * 2)
+    assert len(encoded) == 3
+    assert embeddings.load_embeddings()[0].shape == (3, DIM * 2)
+
+
+def test_rrf_fuse_orders_by_reciprocal_rank():
+    fused = embeddings.rrf_fuse([['a', 'b', 'c'], ['c', 'a', 'd']], top_k=3, rrf_k=60)
+    # a: 1/61 + 1/62, c: 1/63 + 1/61, b: 1/62, d: 1/63
+    assert [doc_id for doc_id, _ in fused] == ['a', 'c', 'b']
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[2][1] == pytest.approx(1 / 62)
+
+
+def test_rrf_fuse_keeps_first_seen_on_ties():
+    fused = embeddings.rrf_fuse([['a', 'b'], ['b', 'a']], top_k=5)
+    assert [doc_id for doc_id, _ in fused] == ['a', 'b']
+    assert fused[0][1] == pytest.approx(fused[1][1])
+
+
+def test_dense_search_matches_full_sort():
+    rng = np.random.default_rng(0)
+    docs = embeddings.HashingEncoder(DIM).encode([f"слово{i} слово{i % 7}" for i in range(50)])
+    queries = docs[[3, 10]] + rng.normal(0, 0.01, (2, DIM)).astype(np.float32)
+    scores, idxs = embeddings.dense_search(docs, queries, 5)
+    expected = np.argsort(-(queries @ docs.T), axis=1, kind='stable')[:, :5]
+    np.testing.assert_array_equal(idxs, expected)
+    assert idxs[0, 0] == 3 and idxs[1, 0] == 10
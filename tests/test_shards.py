@@ -0,0 +1,81 @@
+"""Шардированный поиск shards.py: локальные процессы шардов против PostingsIndex целого индекса"""
+import numpy as np
+import pytest
+
+from shards import ShardedSearch, build_shards, shard_bounds
+from vector_search import PostingsIndex, rows_to_matrix
+
+N_DOCS, N_TERMS = 60, 40
+
+
+@pytest.fixture(scope='module')
+def index():
+    """Случайная нормированная матрица с двумя удалёнными строками"""
+    rng = np.random.default_rng(0)
+    vocab = [f"терм{i:02d}" for i in range(N_TERMS)]
+    rows = []
+    for _ in range(N_DOCS):
+        terms = rng.choice(N_TERMS, size=rng.integers(1, 8), replace=False)
+        rows.append({vocab[t]: float(rng.random()) + 0.01 for t in terms})
+    mat = rows_to_matrix(rows, {t: i for i, t in enumerate(vocab)})
+    mat.deleted = np.zeros(N_DOCS, dtype=bool)
+    mat.deleted[[5, 40]] = True
+    doc_ids = [f"doc{i}" for i in range(N_DOCS)]
+    return mat, doc_ids, vocab
+
+
+@pytest.fixture(scope='module')
+def sharded(index, tmp_path_factory):
+    mat, doc_ids, vocab = index
+    folder = str(tmp_path_factory.mktemp('shards'))
+    manifest = build_shards(mat, doc_ids, vocab, 3, folder)
+    assert manifest['shards'] == 3 and manifest['n_docs'] == N_DOCS
+    with ShardedSearch(folder, timeout=10) as search:
+        yield search
+
+
+def queries(n, rng):
+    for _ in range(n):
+        cols = rng.choice(N_TERMS, size=rng.integers(1, 4), replace=False)
+        yield {int(c): 1.0 / np.sqrt(len(cols)) for c in cols}
+
+
+def test_shard_bounds_cover_all_rows():
+    indptr = np.array([0, 5, 6, 7, 20, 21, 30])
+    bounds = shard_bounds(indptr, 3)
+    assert bounds[0] == 0 and bounds[-1] == 6
+    assert np.all(np.diff(bounds) > 0)
+    assert len(shard_bounds(indptr, 100)) == 7  # шардов не больше, чем строк
+
+
+def test_merged_top_k_matches_whole_index(index, sharded):
+    mat, doc_ids, _ = index
+    postings = PostingsIndex.from_matrix(mat)
+    rng = np.random.default_rng(1)
+    for weights in queries(30, rng):
+        scores, idxs = postings.search(weights, 5)
+        expected = [(doc_ids[i], float(s)) for s, i in zip(scores, idxs) if s > 0]
+        hits, missing = sharded.search_weights(weights, 5)
+        assert missing == []
+        hits = [(doc_id, score) for doc_id, score in hits if score > 0]
+        assert [doc_id for doc_id, _ in hits] == [doc_id for doc_id, _ in expected]
+        np.testing.assert_allclose([s for _, s in hits], [s for _, s in expected], rtol=1e-6)
+
+
+def test_deleted_rows_are_not_returned(index, sharded):
+    mat, _, _ = index
+    cols = mat.indices[mat.indptr[5]:mat.indptr[6]]
+    hits, _ = sharded.search_weights({int(c): 1.0 for c in cols}, N_DOCS)
+    assert 'doc5' not in {doc_id for doc_id, _ in hits}
+
+
+def test_dead_shard_is_reported_missing(index, tmp_path):
+    mat, doc_ids, vocab = index
+    build_shards(mat, doc_ids, vocab, 2, str(tmp_path))
+    with ShardedSearch(str(tmp_path), timeout=5) as search:
+        search.processes[1].terminate()
+        search.processes[1].join()
+        hits, missing = search.search_weights({0: 1.0}, 10)
+    assert missing == [1]
+    offset = search.manifest['offsets'][1]
+    assert all(int(doc_id[3:]) < offset for doc_id, _ in hits)
@@ -1,113 +1,424 @@
 import os
 import math
-import re
+import argparse
+import pickle
+import resource
+import tempfile
+from array import array
+from itertools import chain, count, repeat
+from multiprocessing import Pool
 from collections import defaultdict, Counter
-from bs4 import BeautifulSoup
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
+import numpy as np
+
+import analyzer
+import doc_store
+import instrumentation
+import tfidf_binary
 
 output_folder = "output/"
 lemmas_folder = "lemmas_per_doc/"
 tf_idf_terms_folder = "tfidf_terms/"
 tf_idf_lemmas_folder = "tfidf_lemmas/"
-
-russian_stopwords = set(stopwords.words("russian"))
+tf_idf_binary_folder = "tfidf_bin/"
 
 def ensure_directories():
     os.makedirs(tf_idf_terms_folder, exist_ok=True)
     os.makedirs(tf_idf_lemmas_folder, exist_ok=True)
 
-def extract_text_from_html(filepath):
-    with open(filepath, "r", encoding="utf-8") as f:
-        soup = BeautifulSoup(f, "html.parser")
-        return soup.get_text()
-
-def tokenize(text):
-    words = word_tokenize(text.lower())
-    tokens = list()
-    for word in words:
-        if (word.isalpha() and # Только буквы
-            word not in russian_stopwords and
-            not re.search(r'\d', word) and # Без цифр
-            re.fullmatch(r'^[А-Яа-яЁё]+$', word)): # Только русские слова
-            tokens.append(word)
-    return tokens
+def read_lemma_file(path):
+    lemma_map = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().split(":")
+            if len(parts) == 2:
+                lemma, forms = parts
+                forms_list = forms.strip().split()
+                lemma_map[lemma] = forms_list
+    return lemma_map
+
+def lemma_files():
+    return sorted(f for f in os.listdir(lemmas_folder) if f.endswith("_lemmas.txt"))
+
+def count_lemma_df():
+    """DF лемм одним проходом по файлам, без хранения словарей документов"""
+    lemma_df = defaultdict(int)
+    for filename in lemma_files():
+        for lemma in read_lemma_file(os.path.join(lemmas_folder, filename)):
+            lemma_df[lemma] += 1
+    return lemma_df
 
 def load_lemmas():
     lemma_forms = {}
     lemma_df = defaultdict(int)
     for filename in os.listdir(lemmas_folder):
         if filename.endswith("_lemmas.txt"):
-            with open(os.path.join(lemmas_folder, filename), "r", encoding="utf-8") as f:
-                lemma_map = {}
-                for line in f:
-                    parts = line.strip().split(":")
-                    if len(parts) == 2:
-                        lemma, forms = parts
-                        forms_list = forms.strip().split()
-                        lemma_map[lemma] = forms_list
-                lemma_forms[filename.replace("_lemmas.txt", "")] = lemma_map
-                for lemma in lemma_map:
-                    lemma_df[lemma] += 1
+            lemma_map = read_lemma_file(os.path.join(lemmas_folder, filename))
+            lemma_forms[filename.replace("_lemmas.txt", "")] = lemma_map
+            for lemma in lemma_map:
+                lemma_df[lemma] += 1
     return lemma_forms, lemma_df
 
-def compute_tf_idf():
+def count_tokens(filename):
+    """Счётчик токенов документа по его тексту из хранилища doc_store"""
+    with instrumentation.stage("read_text"):
+        text = doc_store.read_text(filename)
+    with instrumentation.stage("tokenize"):
+        counts = Counter(analyzer.iter_tokens(text))
+    instrumentation.count("documents")
+    return filename, counts
+
+def count_tokens_worker(filename):
+    """count_tokens в воркере пула: вместе со счётчиками — его таймеры"""
+    return count_tokens(filename), instrumentation.drain()
+
+def iter_token_counts(filenames, workers=1):
+    """Счётчики токенов документов по мере готовности (порядок — как в filenames)"""
+    if workers > 1:
+        chunksize = max(1, len(filenames) // (workers * 4))
+        with Pool(workers, initializer=instrumentation.init_worker) as pool:
+            for result, timings in pool.imap(count_tokens_worker, filenames, chunksize=chunksize):
+                instrumentation.merge(timings)
+                yield result
+    else:
+        yield from map(count_tokens, filenames)
+
+class TfidfOutput:
+    """
+    Куда записываются веса: текстовые файлы на документ (text) и/или
+    бинарные артефакты tfidf_bin/terms, tfidf_bin/lemmas (binary)
+    """
+    def __init__(self, text=True, binary=False):
+        self.text = text
+        self.folders = {kind: os.path.join(tf_idf_binary_folder, kind) for kind in ('terms', 'lemmas')}
+        self.writers = {}
+        for kind, folder in self.folders.items():
+            # Артефакт от прошлого запуска не должен расходиться с текстовыми файлами
+            tfidf_binary.remove(folder)
+            if binary:
+                self.writers[kind] = tfidf_binary.TfidfBinaryWriter(folder)
+
+    def terms(self, filename, term_counts, N, token_df):
+        with instrumentation.stage("tfidf_terms"):
+            rows = terms_tfidf(term_counts, N, token_df)
+        self.write_terms(filename, rows)
+
+    def lemmas(self, doc_id, term_counts, lemma_map, N, lemma_df):
+        with instrumentation.stage("tfidf_lemmas"):
+            rows = lemmas_tfidf(term_counts, lemma_map, N, lemma_df)
+        self.write_lemmas(doc_id, rows)
+
+    def write_terms(self, filename, rows):
+        with instrumentation.stage("write"):
+            if self.text:
+                write_tfidf_file(terms_tfidf_path(filename), rows)
+            if 'terms' in self.writers:
+                self.writers['terms'].add(filename.replace(".html", ""), rows)
+
+    def write_lemmas(self, doc_id, rows):
+        with instrumentation.stage("write"):
+            if self.text:
+                write_tfidf_file(lemmas_tfidf_path(doc_id), rows)
+            if 'lemmas' in self.writers:
+                self.writers['lemmas'].add(doc_id, rows)
+
+    def close(self):
+        with instrumentation.stage("write"):
+            for writer in self.writers.values():
+                writer.close()
+
+def compute_tf_idf(workers=1, output=None):
     ensure_directories()
+    output = output or TfidfOutput()
 
-    token_docs = {}
+    token_counts = {}
     token_df = defaultdict(int)
     filenames = [f for f in os.listdir(output_folder) if f.endswith(".html")]
 
     # TF and DF collection for terms
-    for filename in filenames:
-        full_path = os.path.join(output_folder, filename)
-        text = extract_text_from_html(full_path)
-        tokens = tokenize(text)
-        token_docs[filename] = tokens
-        for token in set(tokens):
+    results = iter_token_counts(filenames, workers)
+    # DF сводится в родительском процессе
+    for filename, counts in results:
+        token_counts[filename] = counts
+        for token in counts:
             token_df[token] += 1
 
-    N = len(token_docs)
+    N = len(token_counts)
 
     # Calculate TF-IDF for terms
-    for filename, tokens in token_docs.items():
-        term_counts = Counter(tokens)
-        total_terms = sum(term_counts.values())
-        output_path = os.path.join(tf_idf_terms_folder, filename.replace(".html", "_tfidf_terms.txt"))
-        with open(output_path, "w", encoding="utf-8") as out:
-            for term, count in term_counts.items():
-                tf = count / total_terms
-                idf = math.log((1 + N) / (1 + token_df[term]))
-                tfidf = tf * idf
-                out.write(f"{term} {idf:.6f} {tfidf:.6f}\n")
+    for filename, term_counts in token_counts.items():
+        output.terms(filename, term_counts, N, token_df)
 
     # Load lemmas
-    lemma_forms, lemma_df = load_lemmas()
+    with instrumentation.stage("read_lemmas"):
+        lemma_forms, lemma_df = load_lemmas()
 
     # Calculate TF-IDF for lemmas
     for filename in filenames:
         doc_id = filename.replace(".html", "")
         if doc_id not in lemma_forms:
             continue
+        output.lemmas(doc_id, token_counts[filename], lemma_forms[doc_id], N, lemma_df)
+    output.close()
+
+def dense_ids(table, sparse):
+    """
+    Номера, выданные через table.setdefault(ключ, next(count())), в плотные
+    0..len(table)-1 по порядку вставки: значение ключа — порядковый номер
+    его первой вставки, так что хватает одной таблицы перекодировки.
+    """
+    inserted = np.fromiter(table.values(), np.int64, len(table))
+    remap = np.zeros(inserted[-1] + 1 if len(inserted) else 0, dtype=np.int64)
+    remap[inserted] = np.arange(len(inserted))
+    return remap[sparse]
+
+class VectorizedTfidf:
+    """
+    TF-IDF всего корпуса на массивах NumPy. Термы один раз переводятся в
+    целые номера, пары (документ, терм) хранятся как CSR, а df, idf, длины
+    документов и tf-idf считаются сразу по всем парам: df — np.bincount по
+    номерам термов, tf леммы — сложение частот её форм через np.bincount с весами.
+    Циклы Python остаются только по документам: термы, леммы и формы
+    документа переводятся в номера через map() целиком.
+    Арифметика та же, что в terms_tfidf и lemmas_tfidf, порядок строк документа тоже.
+    """
+    def __init__(self, doc_counts):
+        """
+        :param doc_counts: счётчики токенов документов (Counter, термы в порядке первого появления)
+        """
+        lengths = np.fromiter((len(counts) for counts in doc_counts), dtype=np.int64, count=len(doc_counts))
+        self.doc_ptr = np.zeros(len(doc_counts) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.doc_ptr[1:])
+        self.ids = np.empty(self.doc_ptr[-1], dtype=np.int64)
+        self.counts = np.empty(self.doc_ptr[-1], dtype=np.int64)
+        term_ids, numbers = {}, count()
+        for d, counts in enumerate(doc_counts):
+            # Новый терм получает номер своей пары, известный берётся из словаря
+            start, end = self.doc_ptr[d], self.doc_ptr[d + 1]
+            self.ids[start:end] = np.fromiter(map(term_ids.setdefault, counts, numbers), np.int64, end - start)
+            self.counts[start:end] = np.fromiter(counts.values(), np.int64, end - start)
+        self.ids = dense_ids(term_ids, self.ids)
+        self.terms = list(term_ids)  # номер -> терм
+        self.term_ids = dict(zip(self.terms, range(len(self.terms))))
+
+        self.N = len(doc_counts)
+        self.rows = np.repeat(np.arange(self.N), lengths)
+        self.totals = np.bincount(self.rows, weights=self.counts, minlength=self.N)
+        self.df = np.bincount(self.ids, minlength=len(self.terms))
+        self.idf = np.log((1 + self.N) / (1 + self.df))
+        self.tfidf = self.counts / self.totals[self.rows] * self.idf[self.ids]
+
+    def term_rows(self, d):
+        """[(term, idf, tfidf)] документа d, как terms_tfidf"""
+        start, end = self.doc_ptr[d], self.doc_ptr[d + 1]
+        ids = self.ids[start:end]
+        return list(zip(map(self.terms.__getitem__, ids.tolist()), self.idf[ids].tolist(),
+                        self.tfidf[start:end].tolist()))
+
+    def add_lemmas(self, lemma_maps, other_maps=()):
+        """
+        TF-IDF лемм, как lemmas_tfidf для каждого документа.
+        :param lemma_maps: {лемма: формы} документов в том же порядке (None — файла лемм нет)
+        :param other_maps: словари лемм файлов без HTML-документа, учитываются только в df
+        """
+        lemma_maps = list(lemma_maps)
+        lemma_ids, numbers = {}, count()
+        get_term = self.term_ids.get
+        # Строка файла лемм — запись (документ, лемма, число форм); формы всех записей подряд
+        entries = np.zeros(self.N, dtype=np.int64)
+        entry_lemma, entry_len, pair_form, other_lemmas = array('q'), array('q'), array('q'), array('q')
+        for d, lemma_map in enumerate(lemma_maps):
+            if lemma_map is None:
+                continue
+            entries[d] = len(lemma_map)
+            entry_lemma.extend(map(lemma_ids.setdefault, lemma_map, numbers))
+            entry_len.extend(map(len, lemma_map.values()))
+            # Формы, не встретившиеся в токенах, получают -1 и нулевую частоту
+            pair_form.extend(map(get_term, chain.from_iterable(lemma_map.values()), repeat(-1)))
+        for lemma_map in other_maps:
+            other_lemmas.extend(map(lemma_ids.setdefault, lemma_map, numbers))
+        self.lemmas = list(lemma_ids)
+        self.has_lemmas = np.array([m is not None for m in lemma_maps], dtype=bool)
+
+        entry_lemma = dense_ids(lemma_ids, np.frombuffer(entry_lemma, dtype=np.int64))
+        other_lemmas = dense_ids(lemma_ids, np.frombuffer(other_lemmas, dtype=np.int64))
+        entry_len = np.frombuffer(entry_len, dtype=np.int64)
+        pair_form = np.frombuffer(pair_form, dtype=np.int64)
+        entry_doc = np.repeat(np.arange(self.N), entries)
+        pair_entry = np.repeat(np.arange(len(entry_lemma)), entry_len)
+
+        # Частота формы в документе: поиск ключа (документ, терм) среди пар документа
+        V = max(len(self.terms), 1)
+        keys = self.rows * V + self.ids
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        wanted = entry_doc[pair_entry] * V + pair_form
+        pair_counts = np.zeros(len(wanted), dtype=np.int64)
+        if len(sorted_keys):
+            pos = np.minimum(np.searchsorted(sorted_keys, wanted), len(sorted_keys) - 1)
+            found = (pair_form >= 0) & (sorted_keys[pos] == wanted)
+            pair_counts[found] = self.counts[order[pos[found]]]
+
+        # tf леммы — сумма частот форм её записи; записи уже в порядке файлов лемм
+        lemma_counts = np.bincount(pair_entry, weights=pair_counts, minlength=len(entry_lemma))
+        keep = lemma_counts > 0
+        docs, self.lemma_ids, lemma_counts = entry_doc[keep], entry_lemma[keep], lemma_counts[keep]
+        self.lemma_ptr = np.searchsorted(docs, np.arange(self.N + 1))
+
+        self.lemma_df = np.bincount(np.concatenate([entry_lemma, other_lemmas]), minlength=len(self.lemmas))
+        self.lemma_idf = np.log((1 + self.N) / (1 + self.lemma_df))
+        self.lemma_tfidf = lemma_counts / self.totals[docs] * self.lemma_idf[self.lemma_ids]
+
+    def lemma_rows(self, d):
+        """[(lemma, idf, tfidf)] документа d, как lemmas_tfidf"""
+        start, end = self.lemma_ptr[d], self.lemma_ptr[d + 1]
+        ids = self.lemma_ids[start:end]
+        return list(zip(map(self.lemmas.__getitem__, ids.tolist()), self.lemma_idf[ids].tolist(),
+                        self.lemma_tfidf[start:end].tolist()))
+
+def compute_tf_idf_vectorized(workers=1, output=None):
+    """Тот же результат, что у compute_tf_idf, но idf и tf-idf считаются векторно (VectorizedTfidf)"""
+    ensure_directories()
+    output = output or TfidfOutput()
+    filenames = [f for f in os.listdir(output_folder) if f.endswith(".html")]
+    names, doc_counts = [], []
+    for filename, counts in iter_token_counts(filenames, workers):
+        names.append(filename)
+        doc_counts.append(counts)
+
+    with instrumentation.stage("tfidf_terms"):
+        tfidf = VectorizedTfidf(doc_counts)
+    del doc_counts
+    for d, filename in enumerate(names):
+        output.write_terms(filename, tfidf.term_rows(d))
+
+    with instrumentation.stage("read_lemmas"):
+        lemma_forms, _ = load_lemmas()
+    doc_ids = [filename.replace(".html", "") for filename in names]
+    with instrumentation.stage("tfidf_lemmas"):
+        known = set(doc_ids)
+        tfidf.add_lemmas([lemma_forms.get(doc_id) for doc_id in doc_ids],
+                         [lemma_map for doc_id, lemma_map in lemma_forms.items() if doc_id not in known])
+    for d, doc_id in enumerate(doc_ids):
+        if tfidf.has_lemmas[d]:
+            output.write_lemmas(doc_id, tfidf.lemma_rows(d))
+    output.close()
+
+def compute_tf_idf_streaming(workers=1, output=None):
+    """
+    Двухпроходный расчёт с ограниченной памятью.
+    Проход 1: DF термов, счётчики документов сбрасываются во временный файл
+    как массивы номеров термов и частот. Проход 2: счётчики читаются обратно
+    по одному документу, словарь лемм документа читается только перед записью.
+    В памяти держатся только словарь термов и DF, а не весь корпус.
+    """
+    ensure_directories()
+    output = output or TfidfOutput()
+    filenames = [f for f in os.listdir(output_folder) if f.endswith(".html")]
+    term_ids = {}
+    df = array('I')
+
+    with tempfile.TemporaryFile(prefix="tfidf_counts_") as spill:
+        N = 0
+        for filename, counts in iter_token_counts(filenames, workers):
+            ids = array('I', (term_ids.setdefault(term, len(term_ids)) for term in counts))
+            df.extend([0] * (len(term_ids) - len(df)))
+            for i in ids:
+                df[i] += 1
+            pickle.dump((filename, ids, array('I', counts.values())), spill, pickle.HIGHEST_PROTOCOL)
+            N += 1
+
+        terms = list(term_ids)  # номер -> терм, порядок вставки совпадает с номерами
+        del term_ids
+        token_df = dict(zip(terms, df))
+        with instrumentation.stage("read_lemmas"):
+            lemma_df = count_lemma_df()
+
+        spill.seek(0)
+        for _ in range(N):
+            filename, ids, counts = pickle.load(spill)
+            term_counts = dict(zip((terms[i] for i in ids), counts))
+            output.terms(filename, term_counts, N, token_df)
+            doc_id = filename.replace(".html", "")
+            lemma_path = os.path.join(lemmas_folder, f"{doc_id}_lemmas.txt")
+            if os.path.exists(lemma_path):
+                with instrumentation.stage("read_lemmas"):
+                    lemma_map = read_lemma_file(lemma_path)
+                output.lemmas(doc_id, term_counts, lemma_map, N, lemma_df)
+    output.close()
+
+def peak_rss_mb():
+    """Пиковый RSS процесса и его завершившихся дочерних процессов, МБ"""
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+def terms_tfidf(term_counts, N, token_df):
+    """[(term, idf, tfidf)] документа"""
+    total_terms = sum(term_counts.values())
+    rows = []
+    for term, count in term_counts.items():
+        tf = count / total_terms
+        idf = math.log((1 + N) / (1 + token_df[term]))
+        rows.append((term, idf, tf * idf))
+    return rows
+
+def lemmas_tfidf(term_counts, lemma_map, N, lemma_df):
+    """[(lemma, idf, tfidf)] документа; tf леммы — сумма частот её форм"""
+    total_terms = sum(term_counts.values())
+    rows = []
+    for lemma, forms in lemma_map.items():
+        total_lemma_count = sum(term_counts.get(form, 0) for form in forms)
+        if total_lemma_count == 0:
+            continue
+        tf = total_lemma_count / total_terms
+        idf = math.log((1 + N) / (1 + lemma_df[lemma]))
+        rows.append((lemma, idf, tf * idf))
+    return rows
+
+def terms_tfidf_path(filename):
+    return os.path.join(tf_idf_terms_folder, filename.replace(".html", "_tfidf_terms.txt"))
+
+def lemmas_tfidf_path(doc_id):
+    return os.path.join(tf_idf_lemmas_folder, f"{doc_id}_tfidf_lemmas.txt")
+
+def write_tfidf_file(output_path, rows):
+    with open(output_path, "w", encoding="utf-8") as out:
+        out.write("".join(f"{term} {idf:.6f} {tfidf:.6f}\n" for term, idf, tfidf in rows))
+
+def write_terms_tfidf(filename, term_counts, N, token_df):
+    write_tfidf_file(terms_tfidf_path(filename), terms_tfidf(term_counts, N, token_df))
 
-        tokens = token_docs[filename]
-        term_counts = Counter(tokens)
-        total_terms = sum(term_counts.values())
-
-        output_path = os.path.join(tf_idf_lemmas_folder, f"{doc_id}_tfidf_lemmas.txt")
-        with open(output_path, "w", encoding="utf-8") as out:
-            for lemma, forms in lemma_forms[doc_id].items():
-                total_lemma_count = sum(term_counts.get(form, 0) for form in forms)
-                if total_lemma_count == 0:
-                    continue
-                tf = total_lemma_count / total_terms
-                idf = math.log((1 + N) / (1 + lemma_df[lemma]))
-                tfidf = tf * idf
-                out.write(f"{lemma} {idf:.6f} {tfidf:.6f}\n")
+def write_lemmas_tfidf(doc_id, term_counts, lemma_map, N, lemma_df):
+    write_tfidf_file(lemmas_tfidf_path(doc_id), lemmas_tfidf(term_counts, lemma_map, N, lemma_df))
 
 def main():
-    compute_tf_idf()
-    print("TF-IDF по HTML-документам успешно рассчитан.")
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1, help="число процессов (по умолчанию 1)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--streaming', action='store_true',
+                      help="двухпроходный режим с памятью, не растущей с размером корпуса")
+    mode.add_argument('--vectorized', action='store_true',
+                      help="idf и tf-idf всего корпуса на массивах NumPy (быстрее на больших корпусах)")
+    parser.add_argument('--binary', action='store_true',
+                        help=f"записать бинарный артефакт в {tf_idf_binary_folder} (читается vector_search через mmap)")
+    parser.add_argument('--no-text', action='store_true',
+                        help="не записывать текстовые файлы (нужны для incremental.py и отладки)")
+    parser.add_argument('--profile', default=None,
+                        help="записать профиль cProfile в файл и этапы для flame graph рядом (.folded)")
+    args = parser.parse_args()
+    if args.profile:
+        instrumentation.profile_to(args.profile)
+    if args.no_text and not args.binary:
+        parser.error("--no-text имеет смысл только вместе с --binary")
+    output = TfidfOutput(text=not args.no_text, binary=args.binary)
+    doc_store.ingest(output_folder, workers=args.workers)
+    if args.streaming:
+        compute_tf_idf_streaming(args.workers, output)
+    elif args.vectorized:
+        compute_tf_idf_vectorized(args.workers, output)
+    else:
+        compute_tf_idf(args.workers, output)
+    print("TF-IDF по документам успешно рассчитан.")
+    print(f"Пиковый RSS: {peak_rss_mb():.0f} МБ")
 
 if __name__ == "__main__":
     main()
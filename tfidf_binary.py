@@ -0,0 +1,102 @@
+"""
+Бинарный столбцовый формат TF-IDF (вместо текстовых файлов на документ).
+
+Артефакт — папка с массивами .npy, числовые массивы открываются через
+np.load(mmap_mode='r') без разбора текста и без копирования:
+    doc_ids.npy   str[D]         идентификаторы документов (отсортированы)
+    vocab.npy     str[V]         термы в порядке первого появления
+    idf.npy       float64[V]     idf терма
+    indptr.npy    int64[D + 1]   CSR: границы строк документов
+    indices.npy   int32[nnz]     CSR: номера термов (по возрастанию внутри строки)
+    data.npy      float64[nnz]   CSR: tf-idf без округления и нормализации
+
+Порядок документов и словаря совпадает с тем, что строит
+vector_search.load_tfidf по текстовым файлам.
+"""
+import shutil
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+FILES = ('doc_ids.npy', 'vocab.npy', 'idf.npy', 'indptr.npy', 'indices.npy', 'data.npy')
+
+
+class TfidfBinaryWriter:
+    """Накапливает строки документов в компактных массивах и сохраняет их в close()"""
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.term_ids = {}
+        self.idf = array('d')
+        self.doc_ids = []
+        self.lengths = array('q')
+        self.indices = array('i')
+        self.data = array('d')
+
+    def add(self, doc_id, rows):
+        """
+        :param rows: [(term, idf, tfidf)] одного документа
+        """
+        n = 0
+        for term, idf, tfidf in rows:
+            j = self.term_ids.get(term)
+            if j is None:
+                j = self.term_ids[term] = len(self.term_ids)
+                self.idf.append(idf)
+            self.indices.append(j)
+            self.data.append(tfidf)
+            n += 1
+        self.doc_ids.append(doc_id)
+        self.lengths.append(n)
+
+    def close(self):
+        lengths = np.frombuffer(self.lengths, dtype=np.int64)
+        indices = np.frombuffer(self.indices, dtype=np.int32)
+        data = np.frombuffer(self.data, dtype=np.float64)
+
+        # Строки — в порядке сортировки doc_id
+        order = np.array(sorted(range(len(self.doc_ids)), key=self.doc_ids.__getitem__), dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        new_lengths = lengths[order]
+        indptr = np.concatenate([[0], np.cumsum(new_lengths)]).astype(np.int64)
+        pos = np.repeat(starts[order] - indptr[:-1], new_lengths) + np.arange(indptr[-1])
+        indices, data = indices[pos], data[pos]
+
+        # Словарь — в порядке первого появления терма в отсортированных документах
+        uniq, first = np.unique(indices, return_index=True)
+        term_order = uniq[np.argsort(first, kind='stable')]
+        remap = np.empty(len(self.term_ids), dtype=np.int32)
+        remap[term_order] = np.arange(len(term_order), dtype=np.int32)
+        indices = remap[indices]
+        rows = np.repeat(np.arange(len(order)), new_lengths)
+        srt = np.lexsort((indices, rows))
+
+        terms = np.array(list(self.term_ids), dtype=str)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        np.save(self.folder / 'doc_ids.npy', np.array([self.doc_ids[i] for i in order], dtype=str))
+        np.save(self.folder / 'vocab.npy', terms[term_order])
+        np.save(self.folder / 'idf.npy', np.frombuffer(self.idf, dtype=np.float64)[term_order])
+        np.save(self.folder / 'indptr.npy', indptr)
+        np.save(self.folder / 'indices.npy', indices[srt])
+        np.save(self.folder / 'data.npy', data[srt])
+
+
+def exists(folder):
+    return all((Path(folder) / name).exists() for name in FILES)
+
+
+def remove(folder):
+    """Удалить устаревший артефакт (например, после изменения текстовых файлов)"""
+    if Path(folder).exists():
+        shutil.rmtree(folder)
+
+
+def load_tfidf_binary(folder):
+    """
+    :return: doc_ids, vocab, idf, indptr, indices, data — числовые массивы через mmap
+    """
+    folder = Path(folder)
+    doc_ids = np.load(folder / 'doc_ids.npy').tolist()
+    vocab = np.load(folder / 'vocab.npy').tolist()
+    arrays = [np.load(folder / name, mmap_mode='r') for name in ('idf.npy', 'indptr.npy', 'indices.npy', 'data.npy')]
+    return (doc_ids, vocab, *arrays)
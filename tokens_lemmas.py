@@ -1,69 +1,95 @@
 import os
-import re
-from bs4 import BeautifulSoup
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-import pymorphy2
+import argparse
+from collections import Counter
+from multiprocessing import Pool
 import nltk
 
-nltk.download('punkt')
-nltk.download('punkt_tab')
-nltk.download('stopwords')
-
-morph = pymorphy2.MorphAnalyzer()
-russian_stopwords = set(stopwords.words("russian"))
-
-def clean_text_from_html(file_path):
-    with open(file_path, "r", encoding="utf-8") as file:
-        soup = BeautifulSoup(file, "html.parser")
-        return soup.get_text(separator=' ')
-
-def tokenize(text):
-    words = word_tokenize(text.lower())
-    tokens = set()
-    for word in words:
-        if (word.isalpha() and # Только буквы
-            word not in russian_stopwords and
-            not re.search(r'\d', word) and # Без цифр
-            re.fullmatch(r'^[А-Яа-яЁё]+$', word)): # Только русские слова
-            tokens.add(word)
-    return tokens
+import analyzer
+import doc_store
+import instrumentation
+from lemma_cache import format_stats
 
-def lemmatize_tokens(tokens):
-    lemmas = {}
-    for token in tokens:
-        lemma = morph.parse(token)[0].normal_form
-        if lemma not in lemmas:
-            lemmas[lemma] = []
-        lemmas[lemma].append(token)
-    return lemmas
+nltk.download('stopwords')
 
-def main():
-    input_folder = "output/"
-    tokens_folder = "tokens_per_doc/"
-    lemmas_folder = "lemmas_per_doc/"
+input_folder = "output/"
+tokens_folder = "tokens_per_doc/"
+lemmas_folder = "lemmas_per_doc/"
 
-    os.makedirs(tokens_folder, exist_ok=True)
-    os.makedirs(lemmas_folder, exist_ok=True)
+def init_worker(cache_path, cache_size):
+    instrumentation.init_worker()
+    analyzer.init_lemma_cache(cache_path, cache_size)
 
-    for filename in os.listdir(input_folder):
-        if filename.endswith(".html"):
-            filepath = os.path.join(input_folder, filename)
-            base_name = os.path.splitext(filename)[0]
+def process_document(filename):
+    """
+    Токенизирует и лемматизирует один документ, записывает его файлы.
+    Текст страницы берётся из хранилища doc_store, HTML не разбирается.
+    Возвращает статистику кэша лемм, накопленную на этом документе.
+    """
+    stats_before = analyzer.lemma_cache.stats()
+    base_name = os.path.splitext(filename)[0]
 
-            text = clean_text_from_html(filepath)
-            tokens = tokenize(text)
+    with instrumentation.stage("document"):
+        with instrumentation.stage("read_text"):
+            text = doc_store.read_text(filename)
+        with instrumentation.stage("tokenize"):
+            tokens = set(analyzer.iter_tokens(text))
 
+        with instrumentation.stage("write"):
             with open(os.path.join(tokens_folder, f"{base_name}_tokens.txt"), "w", encoding="utf-8") as f:
                 for token in sorted(tokens):
                     f.write(token + "\n")
 
-            lemmas = lemmatize_tokens(tokens)
+        # Сортировка делает порядок строк детерминированным при любом числе процессов
+        with instrumentation.stage("lemmatize"):
+            lemmas = analyzer.group_by_lemma(sorted(tokens))
+        with instrumentation.stage("write"):
             with open(os.path.join(lemmas_folder, f"{base_name}_lemmas.txt"), "w", encoding="utf-8") as f:
                 for lemma, forms in lemmas.items():
                     f.write(f"{lemma}: {' '.join(sorted(set(forms)))}\n")
+            analyzer.lemma_cache.flush()
+    instrumentation.count("documents")
+    instrumentation.count("tokens", len(tokens))
+    return analyzer.lemma_cache.stats() - stats_before
+
+def process_document_worker(filename):
+    """process_document в воркере пула: вместе со статистикой — его таймеры"""
+    return process_document(filename), instrumentation.drain()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1, help="число процессов (по умолчанию 1)")
+    parser.add_argument('--lemma-cache', default=None, help="файл SQLite для кэша лемм между запусками")
+    parser.add_argument('--cache-size', type=int, default=100_000, help="размер кэша лемм в памяти")
+    parser.add_argument('--profile', default=None,
+                        help="записать профиль cProfile в файл и этапы для flame graph рядом (.folded)")
+    args = parser.parse_args()
+    if args.profile:
+        instrumentation.profile_to(args.profile)
+
+    os.makedirs(tokens_folder, exist_ok=True)
+    os.makedirs(lemmas_folder, exist_ok=True)
+
+    # Новые и изменённые страницы попадают в хранилище текстов; остальные там уже есть
+    doc_store.ingest(input_folder, workers=args.workers)
+    filenames = [f for f in os.listdir(input_folder) if f.endswith(".html")]
+    if args.workers > 1:
+        # Словари pymorphy2 загружаются до fork, воркеры пула делят их страницы
+        analyzer.init_lemma_cache(maxsize=args.cache_size)
+        # Документы независимы: каждый процесс лемматизирует свою часть
+        chunksize = max(1, len(filenames) // (args.workers * 4))
+        with Pool(args.workers, initializer=init_worker,
+                  initargs=(args.lemma_cache, args.cache_size)) as pool:
+            results = []
+            for stats, timings in pool.imap_unordered(process_document_worker, filenames, chunksize=chunksize):
+                results.append(stats)
+                instrumentation.merge(timings)
+    else:
+        analyzer.init_lemma_cache(args.lemma_cache, args.cache_size)
+        results = [process_document(filename) for filename in filenames]
+        analyzer.lemma_cache.close()
 
     print("Файлы токенов и лемм сохранены по документам.")
+    print(format_stats(sum(results, Counter())))
 
 if __name__ == "__main__":
     main()
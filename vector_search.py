@@ -9,32 +9,83 @@ Vector Search Engine на основе TF-IDF и ручного вычислен
 - output/                # HTML-документы (для извлечения идентификаторов)
 - tfidf_terms/           # Файлы <doc_id>_tfidf_terms.txt
 - tfidf_lemmas/          # Файлы <doc_id>_tfidf_lemmas.txt
+- tfidf_bin/terms|lemmas # Бинарный артефакт tf_idf.py --binary (если есть, читается вместо текста)
 
 Результаты:
-- tfidf_matrix.npy       # Документы × признаки (нормализованный TF-IDF)
+- tfidf_indptr.npy       # CSR: границы строк документов
+- tfidf_indices.npy      # CSR: индексы признаков ненулевых элементов
+- tfidf_data.npy         # CSR: значения нормализованного TF-IDF
+- tfidf_deleted.npy      # Маска удалённых строк (tombstones), только после incremental.py
 - doc_ids.npy            # Список doc_id
 - vocab.npy              # Словарь признаков
+- postings_*.npy         # Инвертированные списки PostingsIndex (открываются через mmap)
+- vocab_table.bin        # Тот же словарь, отсортированный для бинарного поиска через mmap
+- vector.index           # FAISS-индекс (строится build_faiss_index.py, необязателен)
+- vector_projection.npy  # Проекция признаков в пространство меньшей размерности для vector.index
+- vector_index.json      # Версия и размеры матрицы, по которой построен vector.index
+- index/<версия>/        # Опубликованные версии: жёсткие ссылки на все файлы индекса
+- index_version.txt      # Хэш содержимого файлов индекса — указатель на текущую версию
+
+Сборка пишет файлы в рабочую папку, заменяя их атомарно (запись во временный
+файл и os.replace). Публикация (write_index_version) связывает их жёсткими
+ссылками в неизменяемую папку index/<версия>/ и последним шагом заменяет
+index_version.txt. Сервер читает версию и открывает все файлы из её папки,
+поэтому никогда не смешивает файлы разных версий; процессы, открывшие прежнюю
+версию через mmap, дочитывают её, даже когда её папка уже удалена.
 
 Использование:
-    python vector_search_engine.py [--mode terms|lemmas] [--rebuild] [--top-k N]
+    python vector_search_engine.py [--mode terms|lemmas] [--rebuild] [--top-k N] [--engine dense|postings]
 
 Опции:
     --mode       : использовать 'terms' или 'lemmas' TF-IDF (по умолчанию 'terms')
     --rebuild    : пересоздать матрицу (по умолчанию загружает существующие)
     --top-k N    : число выдаваемых документов (по умолчанию 5)
+    --engine     : 'dense' — умножение всей матрицы на вектор запроса,
+                   'postings' — обход инвертированных списков только по термам запроса
+    --profile F  : профиль cProfile в F и этапы для flame graph в F.folded
 """
 import argparse
+import functools
+import hashlib
+import os
+import shutil
 import numpy as np
 from pathlib import Path
 
+import analyzer
+import instrumentation
+import tfidf_binary
+from binary_index import MAX_EXPANSIONS, TermTable, is_pattern, write_term_table
+
 # Константы папок и файлов
 TFIDF_TERMS_DIR = 'tfidf_terms'
 TFIDF_LEMMAS_DIR = 'tfidf_lemmas'
-MAT_FILE = 'tfidf_matrix.npy'
+TFIDF_BINARY_DIR = 'tfidf_bin'
+MAT_INDPTR_FILE = 'tfidf_indptr.npy'
+MAT_INDICES_FILE = 'tfidf_indices.npy'
+MAT_DATA_FILE = 'tfidf_data.npy'
+TOMBSTONES_FILE = 'tfidf_deleted.npy'
 DOCIDS_FILE = 'doc_ids.npy'
 VOCAB_FILE = 'vocab.npy'
+VOCAB_TABLE_FILE = 'vocab_table.bin'
+POSTINGS_PTR_FILE = 'postings_ptr.npy'
+POSTINGS_DOCS_FILE = 'postings_docs.npy'
+POSTINGS_WEIGHTS_FILE = 'postings_weights.npy'
+FAISS_INDEX_FILE = 'vector.index'
+PROJECTION_FILE = 'vector_projection.npy'
+FAISS_META_FILE = 'vector_index.json'
+EMBEDDINGS_FILE = 'doc_embeddings.npy'
+EMBEDDINGS_META_FILE = 'doc_embeddings.json'
+VERSION_FILE = 'index_version.txt'
+PUBLISH_DIR = 'index'
+KEEP_VERSIONS = 3  # опубликованных версий на диске, включая текущую
+# Файлы, которые входят в опубликованную версию индекса
+PUBLISHED_FILES = [MAT_INDPTR_FILE, MAT_INDICES_FILE, MAT_DATA_FILE, TOMBSTONES_FILE, DOCIDS_FILE,
+                   VOCAB_FILE, VOCAB_TABLE_FILE, POSTINGS_PTR_FILE, POSTINGS_DOCS_FILE, POSTINGS_WEIGHTS_FILE,
+                   FAISS_INDEX_FILE, PROJECTION_FILE, FAISS_META_FILE, EMBEDDINGS_FILE, EMBEDDINGS_META_FILE]
 
 
+@instrumentation.timed("read_tfidf")
 def load_tfidf(folder: Path):
     """Загрузить TF-IDF: возвращает doc_ids, vocab, tfidf_data"""
     tfidf_data = {}  # doc_id -> {term: tfidf}
@@ -43,86 +94,527 @@ def load_tfidf(folder: Path):
     for path in sorted(folder.glob('*_tfidf_*.txt')):
         doc_id = path.stem.replace('_tfidf_terms','').replace('_tfidf_lemmas','')
         doc_ids.append(doc_id)
-        with path.open('r', encoding='utf-8') as f:
-            for line in f:
-                term, *_ = line.strip().split()
-                tfidf_val = float(line.strip().split()[-1])
-                if term not in vocab:
-                    vocab[term] = len(vocab)
-                tfidf_data.setdefault(doc_id, {})[term] = tfidf_val
+        tfidf_data[doc_id] = read_tfidf_file(path)
+        for term in tfidf_data[doc_id]:
+            if term not in vocab:
+                vocab[term] = len(vocab)
     return doc_ids, list(vocab.keys()), tfidf_data
 
 
+def read_tfidf_file(path: Path):
+    """Прочитать файл одного документа: {term: tfidf}"""
+    row = {}
+    with path.open('r', encoding='utf-8') as f:
+        for line in f:
+            term, *_ = line.strip().split()
+            row[term] = float(line.strip().split()[-1])
+    return row
+
+
+class CSRMatrix:
+    """
+    Разреженная матрица документов × признаков в формате CSR.
+    Память пропорциональна числу ненулевых элементов, а не D × V.
+    Удалённые строки не вырезаются, а помечаются в маске deleted (tombstones).
+    """
+    def __init__(self, indptr, indices, data, n_cols, deleted=None):
+        self.indptr = indptr    # (D + 1,) границы строк
+        self.indices = indices  # (nnz,) номера столбцов
+        self.data = data        # (nnz,) значения
+        self.shape = (len(indptr) - 1, n_cols)
+        self.deleted = deleted  # (D,) bool или None
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def _row_sums(self, values):
+        """Суммы значений по строкам (корректно и для пустых строк)"""
+        acc = np.zeros(len(values) + 1, dtype=np.float64)
+        np.cumsum(values, out=acc[1:])
+        return (acc[self.indptr[1:]] - acc[self.indptr[:-1]]).astype(np.float32)
+
+    def dot(self, vec):
+        """Произведение разреженной матрицы на плотный вектор, shape (D,)"""
+        return self._row_sums(self.data * vec[self.indices])
+
+    def dot_many(self, vecs):
+        """
+        Произведение на пачку плотных векторов (B, V), результат shape (B, D).
+        Ненулевые элементы матрицы просматриваются один раз на всю пачку,
+        дальше считаются только столбцы, встречающиеся в запросах.
+        """
+        B, D = vecs.shape[0], self.shape[0]
+        out = np.zeros((D, B), dtype=np.float32)
+        used = np.flatnonzero(vecs.any(axis=0))
+        sel = np.flatnonzero(np.isin(self.indices, used))
+        if len(sel):
+            rows = np.searchsorted(self.indptr, sel, side='right') - 1
+            contrib = self.data[sel, None] * vecs[:, self.indices[sel]].T  # (len(sel), B)
+            uniq_rows, starts = np.unique(rows, return_index=True)
+            out[uniq_rows] = np.add.reduceat(contrib, starts, axis=0)
+        return out.T
+
+    def row_norms(self):
+        return np.sqrt(self._row_sums(self.data * self.data))
+
+    def append(self, other):
+        """Новая матрица: строки self, затем строки other (число столбцов — по other)"""
+        indptr = np.concatenate([self.indptr, self.indptr[-1] + other.indptr[1:]])
+        deleted = None
+        if self.deleted is not None or other.deleted is not None:
+            deleted = np.concatenate([
+                self.deleted if self.deleted is not None else np.zeros(self.shape[0], dtype=bool),
+                other.deleted if other.deleted is not None else np.zeros(other.shape[0], dtype=bool),
+            ])
+        return CSRMatrix(indptr, np.concatenate([self.indices, other.indices]),
+                         np.concatenate([self.data, other.data]), max(self.shape[1], other.shape[1]), deleted)
+
+    def toarray(self, start=0, stop=None):
+        """Плотное представление строк [start, stop) (целиком — только для небольших корпусов)"""
+        stop = self.shape[0] if stop is None else stop
+        lo, hi = self.indptr[start], self.indptr[stop]
+        dense = np.zeros((stop - start, self.shape[1]), dtype=np.float32)
+        rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+        dense[rows, self.indices[lo:hi]] = self.data[lo:hi]
+        return dense
+
+
 def build_matrix(doc_ids, vocab, tfidf_data):
-    """Построить и нормализовать матрицу (D, V)"""
-    D, V = len(doc_ids), len(vocab)
-    mat = np.zeros((D, V), dtype=np.float32)
+    """Построить и нормализовать разреженную матрицу (D, V) в формате CSR"""
     term_to_idx = {t:i for i,t in enumerate(vocab)}
-    for i, doc in enumerate(doc_ids):
-        for term, val in tfidf_data.get(doc, {}).items():
-            j = term_to_idx[term]
-            mat[i, j] = val
+    return rows_to_matrix([tfidf_data.get(doc, {}) for doc in doc_ids], term_to_idx)
+
+
+@instrumentation.timed("read_tfidf")
+def build_matrix_binary(folder):
+    """
+    Матрица из бинарного артефакта tf_idf.py: indptr и indices берутся
+    через mmap без копирования, копируются только нормированные значения.
+    :return: (mat, doc_ids, vocab)
+    """
+    doc_ids, vocab, _, indptr, indices, data = tfidf_binary.load_tfidf_binary(folder)
+    mat = CSRMatrix(indptr, indices, data, len(vocab))
+    norms = mat.row_norms()
+    norms[norms == 0] = 1.0
+    mat.data = (data / np.repeat(norms, np.diff(indptr))).astype(np.float32)
+    return mat, doc_ids, vocab
+
+
+def load_tfidf_matrix(mode):
+    """Матрица по режиму terms|lemmas: из бинарного артефакта, если он есть, иначе из текстовых файлов"""
+    binary = Path(TFIDF_BINARY_DIR) / mode
+    if tfidf_binary.exists(binary):
+        return build_matrix_binary(binary)
+    doc_ids, vocab, tfidf_data = load_tfidf(Path(TFIDF_TERMS_DIR if mode == 'terms' else TFIDF_LEMMAS_DIR))
+    return build_matrix(doc_ids, vocab, tfidf_data), doc_ids, vocab
+
+
+@instrumentation.timed("build_matrix")
+def rows_to_matrix(rows, term_to_idx):
+    """Собрать CSR-матрицу из строк {term: tfidf} с L2-нормализацией строк"""
+    D, V = len(rows), len(term_to_idx)
+    indptr = np.zeros(D + 1, dtype=np.int64)
+    indices, data = [], []
+    for i, terms in enumerate(rows):
+        row = sorted((term_to_idx[term], val) for term, val in terms.items())
+        indices.extend(j for j, _ in row)
+        data.extend(val for _, val in row)
+        indptr[i + 1] = len(indices)
+    mat = CSRMatrix(indptr, np.array(indices, dtype=np.int32), np.array(data, dtype=np.float32), V)
     # L2-нормализация по строкам
-    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms = mat.row_norms()
     norms[norms == 0] = 1.0
-    mat = mat / norms
+    mat.data /= np.repeat(norms, np.diff(indptr))
     return mat
 
 
+def save_array(path, arr):
+    """np.save с атомарной заменой: открытые через mmap копии файла остаются целыми"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def matrix_version(mat):
+    """
+    Отпечаток матрицы для производных от неё файлов (vector.index): размеры,
+    границы строк и маска удалённых. Считается за O(числа документов).
+    """
+    h = hashlib.sha1(np.asarray(mat.shape, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(mat.indptr).tobytes())
+    if mat.deleted is not None:
+        h.update(np.packbits(mat.deleted).tobytes())
+    return h.hexdigest()
+
+
+def drop_faiss_index():
+    """Удалить FAISS-индекс и его проекцию: после пересборки матрицы они устарели"""
+    dropped = False
+    for name in [FAISS_META_FILE, FAISS_INDEX_FILE, PROJECTION_FILE]:
+        if Path(name).exists():
+            Path(name).unlink()
+            dropped = True
+    if dropped:
+        print(f"{FAISS_INDEX_FILE} удалён: матрица изменилась, постройте его заново build_faiss_index.py")
+
+
+@instrumentation.timed("save")
 def save_objects(mat, doc_ids, vocab):
-    np.save(MAT_FILE, mat)
-    np.save(DOCIDS_FILE, np.array(doc_ids))
-    np.save(VOCAB_FILE, np.array(vocab))
-    print(f"Сохранено: {MAT_FILE}, {DOCIDS_FILE}, {VOCAB_FILE}")
+    drop_faiss_index()
+    save_array(MAT_INDPTR_FILE, mat.indptr)
+    save_array(MAT_INDICES_FILE, mat.indices)
+    save_array(MAT_DATA_FILE, mat.data)
+    if mat.deleted is not None:
+        save_array(TOMBSTONES_FILE, mat.deleted)
+    elif Path(TOMBSTONES_FILE).exists():
+        Path(TOMBSTONES_FILE).unlink()
+    save_array(DOCIDS_FILE, np.array(doc_ids))
+    save_array(VOCAB_FILE, np.array(vocab))
+    postings = PostingsIndex.from_matrix(mat)
+    write_term_table(VOCAB_TABLE_FILE, vocab, np.diff(postings.term_ptr))
+    postings.save()
+    write_index_version()
+    print(f"Сохранено: {MAT_INDPTR_FILE}, {MAT_INDICES_FILE}, {MAT_DATA_FILE}, {DOCIDS_FILE}, {VOCAB_FILE}")
+
+
+def write_index_version():
+    """
+    Опубликовать версию индекса: SHA-1 содержимого всех его файлов. Файлы
+    связываются в index/<версия>/, затем index_version.txt атомарно
+    переключается на неё; старые версии сверх KEEP_VERSIONS удаляются.
+    """
+    h = hashlib.sha1()
+    for name in [MAT_INDPTR_FILE, MAT_INDICES_FILE, MAT_DATA_FILE, TOMBSTONES_FILE,
+                 DOCIDS_FILE, VOCAB_FILE, FAISS_INDEX_FILE, PROJECTION_FILE,
+                 EMBEDDINGS_FILE]:
+        if not Path(name).exists():
+            continue
+        h.update(name.encode())
+        with open(name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    version = h.hexdigest()
+    publish_version(version)
+    tmp = f"{VERSION_FILE}.tmp"
+    Path(tmp).write_text(version, encoding='utf-8')
+    os.replace(tmp, VERSION_FILE)
+    prune_versions(version)
+
+
+def publish_version(version):
+    """
+    Неизменяемая копия файлов индекса в index/<версия>/. Жёсткие ссылки не
+    копируют данные: сборка заменяет файлы через os.replace, и ссылка
+    продолжает указывать на прежнее содержимое.
+    """
+    folder = Path(PUBLISH_DIR, version)
+    if folder.exists():
+        return
+    tmp = Path(PUBLISH_DIR, f"{version}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name in PUBLISHED_FILES:
+        if not Path(name).exists():
+            continue
+        try:
+            os.link(name, tmp / name)
+        except OSError:
+            shutil.copy2(name, tmp / name)  # файловая система без жёстких ссылок
+    try:
+        os.replace(tmp, folder)
+    except OSError:
+        # Ту же версию уже опубликовал другой процесс
+        shutil.rmtree(tmp, ignore_errors=True)
 
 
-def load_objects():
-    if not (Path(MAT_FILE).exists() and Path(DOCIDS_FILE).exists() and Path(VOCAB_FILE).exists()):
+def prune_versions(current):
+    """Удалить опубликованные версии сверх KEEP_VERSIONS, начиная с самых старых"""
+    folders = sorted((p for p in Path(PUBLISH_DIR).iterdir()
+                      if p.is_dir() and p.name != current and not p.name.endswith('.tmp')),
+                     key=lambda p: p.stat().st_mtime)
+    for folder in folders[:max(0, len(folders) - KEEP_VERSIONS + 1)]:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def read_index_version(path=VERSION_FILE):
+    path = Path(path)
+    return path.read_text(encoding='utf-8').strip() if path.exists() else None
+
+
+def index_folder(version):
+    """
+    Папка опубликованной версии индекса; до первой публикации — рабочая папка.
+    :raises FileNotFoundError: версия уже удалена как устаревшая
+    """
+    if version is None or not Path(PUBLISH_DIR).is_dir():
+        return Path('.')
+    folder = Path(PUBLISH_DIR, version)
+    if not folder.is_dir():
+        raise FileNotFoundError(f"Версия индекса {version} не найдена в {PUBLISH_DIR}/")
+    return folder
+
+
+def load_objects(mmap=False, folder='.'):
+    """
+    :param mmap: открыть массивы матрицы и doc_ids через mmap (только чтение), а словарь —
+                 таблицей vocab_table.bin, без списков строк и dict в памяти процесса
+    :param folder: папка с файлами индекса (index_folder опубликованной версии)
+    """
+    path = functools.partial(os.path.join, folder)
+    files = [MAT_INDPTR_FILE, MAT_INDICES_FILE, MAT_DATA_FILE, DOCIDS_FILE, VOCAB_FILE]
+    if not all(os.path.exists(path(f)) for f in files):
         return None, None, None
-    mat = np.load(MAT_FILE)
-    doc_ids = np.load(DOCIDS_FILE).tolist()
-    vocab = np.load(VOCAB_FILE, allow_pickle=True).tolist()
+    mmap_mode = 'r' if mmap else None
+    doc_ids = np.load(path(DOCIDS_FILE), mmap_mode=mmap_mode)
+    if not mmap:
+        doc_ids = doc_ids.tolist()
+    if mmap and os.path.exists(path(VOCAB_TABLE_FILE)):
+        vocab = TermTable(path(VOCAB_TABLE_FILE))
+    else:
+        vocab = np.load(path(VOCAB_FILE)).tolist()
+    deleted = np.load(path(TOMBSTONES_FILE), mmap_mode=mmap_mode) if os.path.exists(path(TOMBSTONES_FILE)) else None
+    mat = CSRMatrix(np.load(path(MAT_INDPTR_FILE), mmap_mode=mmap_mode),
+                    np.load(path(MAT_INDICES_FILE), mmap_mode=mmap_mode),
+                    np.load(path(MAT_DATA_FILE), mmap_mode=mmap_mode), len(vocab), deleted)
     print("Загружены матрица TF-IDF, doc_ids и словарь vocab")
     return mat, doc_ids, vocab
 
 
+def term_index(vocab):
+    """Отображение терм -> столбец: таблица словаря отвечает сама, для списка строится dict"""
+    return vocab if isinstance(vocab, TermTable) else {t: i for i, t in enumerate(vocab)}
+
+
+def query_weights(query, term_to_idx, max_expansions=MAX_EXPANSIONS):
+    """
+    Веса столбцов словаря для терминов запроса. Запрос разбирается тем же
+    анализатором, что документы; токен, которого нет в словаре, ищется по
+    лемме — в индексе по леммам хранятся только нормальные формы.
+    Шаблон с * или ? («технолог*», «ко?ка») раскрывается таблицей словаря
+    (TermTable.expand) в самые частые подходящие термы; их общий вес — как у
+    одного термина, по 1/sqrt(n) на каждый, чтобы шаблон не перевешивал
+    остальной запрос. У словаря-dict шаблоны не раскрываются.
+    :return: {столбец: вес} в порядке терминов запроса
+    """
+    words = query.split()
+    patterns = list(dict.fromkeys(w.lower() for w in words if is_pattern(w)))
+    weights = {}
+    for token in analyzer.query_tokens(' '.join(w for w in words if not is_pattern(w))):
+        idx = term_to_idx.get(token)
+        if idx is None:
+            idx = term_to_idx.get(analyzer.lemmatize(token))
+        if idx is not None:
+            weights.setdefault(idx, 1.0)
+    if not hasattr(term_to_idx, 'expand'):
+        return weights
+    for pattern in patterns:
+        columns = term_to_idx.expand(pattern, max_expansions)
+        for idx in columns:
+            weights.setdefault(idx, 1.0 / len(columns) ** 0.5)
+    return weights
+
+
+def top_k_indices(scores, top_k):
+    """
+    Индексы топ-K по убыванию score без полной сортировки.
+    При равных значениях выше документ с меньшим номером.
+    """
+    k = min(top_k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+    above = np.flatnonzero(scores > kth)
+    equal = np.flatnonzero(scores == kth)[:k - len(above)]
+    idxs = np.concatenate([above, equal])
+    return idxs[np.lexsort((idxs, -scores[idxs]))]
+
+
+@instrumentation.timed("search_dense")
 def cosine_search(mat, query_vec, top_k):
     """Вычислить косинусное сходство вручную и вернуть индексы топ-K"""
-    # query_vec уже нормирован
+    # query_vec уже нормирован, mat — CSRMatrix
     sims = mat.dot(query_vec.flatten())  # shape (D,)
+    if mat.deleted is not None:
+        sims[mat.deleted] = -np.inf
     # Получаем top_k индексы по убыванию
-    idxs = np.argsort(-sims)[:top_k]
+    idxs = top_k_indices(sims, top_k)
     return sims[idxs], idxs
 
 
-def search_loop(mat, doc_ids, vocab, top_k):
+@instrumentation.timed("search_dense")
+def cosine_search_batch(mat, query_vecs, top_k):
+    """
+    Пакетный вариант cosine_search для матрицы запросов (B, V).
+    :return: scores (B, K), idxs (B, K)
+    """
+    sims = mat.dot_many(query_vecs)  # shape (B, D)
+    if mat.deleted is not None:
+        sims[:, mat.deleted] = -np.inf
+    idxs = np.stack([top_k_indices(row, top_k) for row in sims])
+    return np.take_along_axis(sims, idxs, axis=1), idxs
+
+
+class PostingsIndex:
+    """
+    Инвертированные списки (doc, weight) для каждого признака,
+    упорядоченные по убыванию веса (impact-ordered).
+
+    Поиск складывает вклады только признаков запроса (term-at-a-time)
+    и отсекает документы в стиле max-score: если документ, ещё не
+    попавший в кандидаты, уже не может обогнать текущий K-й результат,
+    оставшиеся списки лишь дополняют оценки существующих кандидатов.
+    Ранжирование совпадает с cosine_search.
+    """
+    def __init__(self, term_ptr, docs, weights, n_docs, deleted=None):
+        self.term_ptr = term_ptr  # (V + 1,) границы списков
+        self.docs = docs          # (nnz,) номера документов
+        self.weights = weights    # (nnz,) веса, по убыванию внутри списка
+        self.n_docs = n_docs
+        # Номера удалённых документов: в списки не входят, но исключаются и из добивки нулями
+        self.deleted_docs = np.flatnonzero(deleted) if deleted is not None else np.empty(0, dtype=np.int64)
+        nonempty = term_ptr[1:] > term_ptr[:-1]
+        self.max_weights = np.zeros(len(term_ptr) - 1, dtype=np.float32)
+        self.max_weights[nonempty] = weights[term_ptr[:-1][nonempty]]
+
+    @classmethod
+    @instrumentation.timed("build_postings")
+    def from_matrix(cls, mat):
+        """Транспонировать CSR-матрицу в списки по признакам"""
+        D, V = mat.shape
+        rows = np.repeat(np.arange(D, dtype=np.int32), np.diff(mat.indptr))
+        indices, data = mat.indices, mat.data
+        if mat.deleted is not None:
+            live = ~mat.deleted[rows]
+            rows, indices, data = rows[live], indices[live], data[live]
+        order = np.lexsort((rows, -data, indices))
+        term_ptr = np.zeros(V + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=V), out=term_ptr[1:])
+        return cls(term_ptr, rows[order], data[order], D, mat.deleted)
+
+    def save(self):
+        save_array(POSTINGS_PTR_FILE, self.term_ptr)
+        save_array(POSTINGS_DOCS_FILE, self.docs)
+        save_array(POSTINGS_WEIGHTS_FILE, self.weights)
+
+    @classmethod
+    def load(cls, mat, mmap=True, folder='.'):
+        """Списки, сохранённые save_objects (через mmap); если их нет — строятся по матрице"""
+        files = [os.path.join(folder, f) for f in (POSTINGS_PTR_FILE, POSTINGS_DOCS_FILE, POSTINGS_WEIGHTS_FILE)]
+        if not all(Path(f).exists() for f in files):
+            return cls.from_matrix(mat)
+        mmap_mode = 'r' if mmap else None
+        ptr, docs, weights = (np.load(f, mmap_mode=mmap_mode) for f in files)
+        return cls(ptr, docs, weights, mat.shape[0], mat.deleted)
+
+    def postings(self, term_idx):
+        start, end = self.term_ptr[term_idx], self.term_ptr[term_idx + 1]
+        return self.docs[start:end], self.weights[start:end]
+
+    @staticmethod
+    def _add_existing(cand, scores, docs, contrib):
+        """Добавить вклады только тем документам, что уже есть среди кандидатов"""
+        if len(cand) == 0 or len(docs) == 0:
+            return
+        pos = np.searchsorted(cand, docs)
+        pos[pos == len(cand)] = 0
+        hit = cand[pos] == docs
+        scores[pos[hit]] += contrib[hit]
+
+    @instrumentation.timed("search_postings")
+    def search(self, query, top_k):
+        """
+        :param query: {индекс признака: вес} нормированного вектора запроса
+        :return: (scores, doc_idxs) топ-K, как у cosine_search
+        """
+        terms = []
+        for t, q in query.items():
+            q = np.float32(q)
+            if q > 0 and self.term_ptr[t + 1] > self.term_ptr[t]:
+                terms.append((float(q * self.max_weights[t]), t, q))
+        # Сначала признаки с наибольшим возможным вкладом
+        terms.sort(key=lambda x: (-x[0], x[1]))
+
+        cand = np.empty(0, dtype=np.int32)
+        scores = np.empty(0, dtype=np.float64)
+        # rests[i] — верхняя граница суммарного вклада признаков после i-го
+        rests = [sum(ub for ub, _, _ in terms[i + 1:]) for i in range(len(terms))]
+        for (ub, t, q), rest in zip(terms, rests):
+            docs, weights = self.postings(t)
+            contrib = q * weights
+            # Нижняя граница K-го результата: оценки кандидатов только растут
+            theta = np.partition(scores, len(scores) - top_k)[len(scores) - top_k] if len(cand) >= top_k else -np.inf
+            # Новый документ из позиции i наберёт не больше contrib[i] + rest;
+            # веса убывают, поэтому подходящие позиции образуют префикс списка
+            n_new = int(np.searchsorted(-(contrib + rest), -theta, side='left'))
+            if n_new:
+                all_docs = np.concatenate([cand, docs[:n_new]])
+                all_scores = np.concatenate([scores, contrib[:n_new]])
+                cand, inverse = np.unique(all_docs, return_inverse=True)
+                scores = np.bincount(inverse, weights=all_scores)
+            self._add_existing(cand, scores, docs[n_new:], contrib[n_new:])
+
+        scores = scores.astype(np.float32)
+        positive = scores > 0
+        cand, scores = cand[positive], scores[positive]
+        idxs = top_k_indices(scores, top_k)
+        out_docs, out_scores = cand[idxs].astype(np.int64), scores[idxs]
+        if len(out_docs) < top_k:
+            # Дополняем нулевыми документами в порядке номеров, как плотный поиск
+            limit = min(self.n_docs, top_k + len(cand) + len(self.deleted_docs))
+            taken = np.concatenate([cand, self.deleted_docs])
+            fill = np.setdiff1d(np.arange(limit), taken)[:top_k - len(out_docs)]
+            out_docs = np.concatenate([out_docs, fill])
+            out_scores = np.concatenate([out_scores, np.zeros(len(fill), dtype=np.float32)])
+        return out_scores, out_docs
+
+
+def search_loop(mat, doc_ids, vocab, top_k, engine='dense'):
+    from result_cache import ResultCache
+
     print("Введите запрос: список терминов через пробел:")
-    term_to_idx = {t:i for i,t in enumerate(vocab)}
+    # Таблица словаря нужна для шаблонов; save_objects пишет её вместе с матрицей
+    term_to_idx = TermTable(VOCAB_TABLE_FILE) if Path(VOCAB_TABLE_FILE).exists() else term_index(vocab)
+    postings = PostingsIndex.from_matrix(mat) if engine == 'postings' else None
+    cache = ResultCache()
     while True:
         line = input('> ').strip()
         if not line:
             break
         q_terms = line.split()
-        vec = np.zeros((mat.shape[1],), dtype=np.float32)
-        count = 0
-        for t in q_terms:
-            idx = term_to_idx.get(t)
-            if idx is not None:
-                vec[idx] = 1.0
-                count += 1
-        if count == 0:
+        results = cache.get(q_terms, top_k)
+        if results is not None:
+            print_results(results, top_k)
+            continue
+        weights = query_weights(line, term_to_idx)
+        if not weights:
             print("Ни один термин не найден в словаре")
             continue
-        vec /= count  # среднее
+        found = list(weights)
+        vec = np.zeros((mat.shape[1],), dtype=np.float32)
+        vec[found] = list(weights.values())
         # L2-нормализация запроса
         norm = np.linalg.norm(vec)
         if norm > 0:
             vec = vec / norm
-        sims, idxs = cosine_search(mat, vec.reshape(1, -1), top_k)
-        print(f"Топ-{top_k} результатов:")
-        for score, i in zip(sims, idxs):
-            print(f"[{score:.4f}] {doc_ids[i]}")
-        print()
+        if postings is not None:
+            sims, idxs = postings.search({i: vec[i] for i in found}, top_k)
+        else:
+            sims, idxs = cosine_search(mat, vec.reshape(1, -1), top_k)
+        results = [(doc_ids[i], float(score)) for score, i in zip(sims, idxs)]
+        cache.put(q_terms, top_k, results)
+        print_results(results, top_k)
+    stats = cache.stats()
+    print(f"Кэш результатов: попаданий {stats['hits']}, промахов {stats['misses']}, "
+          f"вытеснений {stats['evictions']}")
+
+
+def print_results(results, top_k):
+    print(f"Топ-{top_k} результатов:")
+    for doc_id, score in results:
+        print(f"[{score:.4f}] {doc_id}")
+    print()
 
 
 def main():
@@ -130,17 +622,20 @@ def main():
     parser.add_argument('--mode', choices=['terms','lemmas'], default='terms')
     parser.add_argument('--rebuild', action='store_true')
     parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--engine', choices=['dense','postings'], default='dense')
+    parser.add_argument('--profile', default=None,
+                        help="записать профиль cProfile в файл и этапы для flame graph рядом (.folded)")
     args = parser.parse_args()
+    if args.profile:
+        instrumentation.profile_to(args.profile)
 
-    folder = Path(TFIDF_TERMS_DIR if args.mode=='terms' else TFIDF_LEMMAS_DIR)
     mat, doc_ids, vocab = (None, None, None) if args.rebuild else load_objects()
 
     if mat is None:
-        doc_ids, vocab, tfidf_data = load_tfidf(folder)
-        mat = build_matrix(doc_ids, vocab, tfidf_data)
+        mat, doc_ids, vocab = load_tfidf_matrix(args.mode)
         save_objects(mat, doc_ids, vocab)
 
-    search_loop(mat, doc_ids, vocab, args.top_k)
+    search_loop(mat, doc_ids, vocab, args.top_k, args.engine)
 
 if __name__ == '__main__':
     main()